@@ -8,8 +8,8 @@ Created on Sat May 27 13:51:51 2023
 import os
 import pandas as pd
 import matplotlib.pyplot as plt
-from molar_mass_calculator import *
-from dta_analysis_funcs import *
+from dta_analysis_funcs import get_dta_data, perform_adjustment, get_intermetallic_heat, convert_Jg_kJmol
+from dta_plot import plot_run, fill_window
 
 # Global plotting parameters
 plt.rcParams["font.family"] = "sans-serif"
@@ -33,22 +33,17 @@ spread_sheet_ar = "Argon DTA Results.xlsx"
 im = 11.469                                                                     # initial mass
 run_data = get_dta_data(spread_sheet_ar,"AlZr_081722_Ar_022123_R1",im)          # get main data
 
-#get the data to plot
-run_data_df = run_data[0]
-scan1 = run_data_df["Heatflow (mW)"]
-baseline = run_data_df["Heatflow (mW).1"]
-
-# plot data
+# plot data, plot_run thins out the run to the points that show (see dta_plot.py) so it draws fast
 fig, axes = plt.subplots(nrows=1,ncols=2)
-axes[0].plot(run_data[1],scan1,lw=2,color=y,label="scan 1")
-axes[0].plot(run_data[1],baseline,lw=2,color=r,label="baseline")
-axes[0].plot(run_data[1],run_data[3],lw=2,color=b,label="bls hf")
-axes[1].plot(run_data[1],run_data[3],lw=2,color=b,label="bls hf")
+plot_run(run_data,y="heatflow",ax=axes[0],lw=2,color=y,label="scan 1")
+plot_run(run_data,y="heatflow_bl",ax=axes[0],lw=2,color=r,label="baseline")
+plot_run(run_data,y="bls_hf",ax=axes[0],lw=2,color=b,label="bls hf")
+plot_run(run_data,y="bls_hf",ax=axes[1],lw=2,color=b,label="bls hf")
 
 # adjust data and plot on same graph -- if you use the same variable name as the original run data it overwrites so just beware
 run_data = perform_adjustment(run_data, 100, 200)
-axes[0].plot(run_data[1],run_data[3],lw=2,color="black",label="adj bls hf")
-axes[1].plot(run_data[1],run_data[3],lw=2,color="black",label="adj bls hf")
+plot_run(run_data,y="bls_hf",ax=axes[0],lw=2,color="black",label="adj bls hf")
+plot_run(run_data,y="bls_hf",ax=axes[1],lw=2,color="black",label="adj bls hf")
 
 # Plotting parameters to make it look nice
 axes[0].set_ylabel('Heatflow (mW)',fontsize=18)
@@ -77,9 +72,9 @@ numatoms = 2
 
 ax = plt.subplot(111)
 
-# Plot data
-plt.plot(run_data[1],run_data[3],lw=2,color=y)
-plt.fill_between(run_data[1],run_data[3],color=y,where=(run_data[1] > lower_temp)&(run_data[1] < upper_temp),alpha=0.3)
+# Plot data, the shaded window covers exactly the points that get integrated
+plot_run(run_data,y="bls_hf",ax=ax,lw=2,color=y)
+fill_window(run_data,lower_temp,upper_temp,y="bls_hf",ax=ax,color=y,alpha=0.3)
 
 # Plot parameters to make it look pretty
 ax.set_ylabel('Heatflow (mW)',fontsize=18)
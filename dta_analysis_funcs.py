@@ -6,22 +6,34 @@ Created on Thu Dec 15 14:33:59 2022
 """
 
 ## dta analysis functions
-import os
-import sys
-from sys import path
-import pandas as pd
-import scipy
-from scipy import integrate
-from scipy.signal import savgol_filter
-import matplotlib.pyplot as plt
-import statistics
+## pandas and scipy are only imported by the functions that need them so the compute functions
+## load fast (e.g. in the batch workers)
+import re
 import numpy as np
 
-from molar_mass_calculator import *
+from molar_mass_calculator import pt_dict, get_molar_mass
+from dta_cache import load_cached_frame, save_cached_frame
+from dta_run import DTARun, TemperatureIndex, as_dta_run
+from dta_profile import instrumented, profiled_block
 
-def get_dta_data(filename,sheetname,initial_mass):
+__all__ = ['EXCEL_PARSER_VERSION', 'EXCEL_RUN_COLUMNS', 'TA_DEFAULT_SIGNALS', 'TA_RUN_SIGNALS',
+           'ZRO2_FORM_HEAT', 'ZRN_FORM_HEAT', 'ALN_FORM_HEAT',
+           'get_dta_data', 'load_workbook_runs', 'get_ta_encoding', 'read_ta_header', 'get_ta_initial_mass',
+           'get_ta_signal_columns', 'read_ta_signals', 'get_dta_txt_data', 'get_lower_upper_idxs',
+           'get_temperature_idxs', 'perform_adjustment', 'get_intermetallic_heat', 'mass_gain_over_temp_range',
+           'get_heat_oxidation', 'get_heat_nitridation', 'avg_stdev_heat', 'get_window_heats',
+           'avg_stdev_window_heats', 'align_runs', 'avg_stdev_aligned', 'calculate_incremental_cumulative_heat',
+           'convert_Jg_kJmol',
+           # from molar_mass_calculator, scripts doing "from dta_analysis_funcs import *" use them
+           'pt_dict', 'get_molar_mass']
+
+# bump when the way the excel sheets are parsed changes so old cache entries are not used
+EXCEL_PARSER_VERSION = 1
+
+@instrumented('load')
+def get_dta_data(filename,sheetname,initial_mass,use_cache=True,dtype=np.float64):
     '''
-    This function takes in the data from DTA run and returns a list with useful information
+    This function takes in the data from DTA run and returns a DTARun with useful information
     that can be used with the other functions for analysis
     
     Parameters
@@ -32,12 +44,18 @@ def get_dta_data(filename,sheetname,initial_mass):
         name of excel sheet where the data is
     initial_mass : float
         initial mass of sample in milligrams
+    use_cache : Bool, optional
+        Look for the parsed sheet in the on-disk cache (see dta_cache.py) before reading
+        the excel file and save it there afterwards. The default is True.
+    dtype : numpy dtype, optional
+        dtype the signals are stored as, np.float32 halves the memory. The default is np.float64.
 
     Returns
     -------
-    list
-        list that has the following data in each index: dataframe with 
-            [0] excel data,
+    DTARun
+        Run with the signals as NumPy arrays (see dta_run.py). It can still be indexed like
+        the list this function used to return, each index gives back: 
+            [0] dataframe with the signals (named like the excel columns),
             [1] temperature 
             [2] time in seconds 
             [3] baseline subtracted 
@@ -48,40 +66,342 @@ def get_dta_data(filename,sheetname,initial_mass):
 
     '''
        
-    data = pd.read_excel(filename,sheet_name=sheetname, skiprows=1)
-    temp = data.iloc[:,1]
-    time_min = data.iloc[:,0]
-    time_sec = time_min*60
-    heatflow = data.iloc[:,3]
-    heatflow_bl = data.iloc[:,10]
-    bls_hf = heatflow - heatflow_bl
-    
-    # mass
-    im = initial_mass
-    data['Mass Diff Scan1'] = data.iloc[:,2] - data.iat[0, 2]
-    data['True Mass Scan1'] = data['Mass Diff Scan1'] + im
-    true_mass = data['True Mass Scan1']
-    
-    norm_hf = heatflow.divide(true_mass)                        #norm_hf = heatflow.divide(im)
-    norm_hf_bl = heatflow_bl.divide(true_mass)                  #norm_hf_bl = heatflow_bl.divide(im)
-    norm_hf_bls = norm_hf - norm_hf_bl
-       
-    return [data, temp, time_sec, bls_hf, true_mass, norm_hf, norm_hf_bl, norm_hf_bls]
+    data = None
+    if use_cache:
+        data = load_cached_frame(filename, sheetname, EXCEL_PARSER_VERSION)
+    
+    if data is None:
+        import pandas as pd
+        with profiled_block('get_dta_data.read_excel', 'excel'):
+            data = pd.read_excel(filename,sheet_name=sheetname, skiprows=1)
+        if use_cache:
+            save_cached_frame(filename, sheetname, EXCEL_PARSER_VERSION, data)
+    
+    return DTARun(data.iloc[:,0]*60, data.iloc[:,1], data.iloc[:,2], data.iloc[:,3], data.iloc[:,10],
+                  initial_mass, dtype=dtype)
+
+# positions of the time, temperature, weight, heat flow and baseline heat flow columns in the excel template
+EXCEL_RUN_COLUMNS = [0, 1, 2, 3, 10]
+
+@instrumented('excel')
+def _read_run_columns(filename, sheetnames):
+    # openpyxl is used directly so the workbook is only opened once and the cells to the right
+    # of the last column we need are never parsed
+    import openpyxl
+    import pandas as pd
+    
+    last_col = max(EXCEL_RUN_COLUMNS) + 1
+    frames = {}
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        for sheetname in sheetnames:
+            rows = workbook[sheetname].iter_rows(min_row=2, max_col=last_col, values_only=True)
+            header = next(rows, ())
+            data = pd.DataFrame.from_records(list(rows), columns=_mangle_columns(header, last_col))
+            data = data.iloc[:, EXCEL_RUN_COLUMNS].astype(np.float64)
+            
+            # read_only mode can hand back empty rows past the end of the data
+            last_row = data.last_valid_index()
+            frames[sheetname] = data.iloc[:0 if last_row is None else last_row + 1]
+    finally:
+        workbook.close()
+        
+    return frames
+
+def _mangle_columns(header, ncols):
+    # same names read_excel gives to duplicated columns ('Heatflow (mW)', 'Heatflow (mW).1', ...)
+    header = list(header) + [None] * (ncols - len(header))
+    names = []
+    for i, name in enumerate(header[:ncols]):
+        name = 'Unnamed: ' + str(i) if name is None else str(name)
+        base, count = name, 0
+        while name in names:
+            count += 1
+            name = base + '.' + str(count)
+        names.append(name)
+    return names
+
+@instrumented('load')
+def load_workbook_runs(filename, masses_by_sheet, use_cache=True, dtype=np.float64):
+    '''
+    Loads many runs from the same workbook at once. The workbook is opened a single time and
+    only the time, temperature, weight, heat flow and baseline heat flow columns are read from
+    each sheet, which is a lot faster than calling get_dta_data for every sheet.
+
+    Parameters
+    ----------
+    filename : string
+        name of excel file (properly formatted) where the data is
+    masses_by_sheet : dict
+        sheet names mapped to the initial mass of the sample in milligrams for that run
+    use_cache : Bool, optional
+        Look for the parsed sheets in the on-disk cache (see dta_cache.py) first and save
+        the ones that had to be read. The default is True.
+    dtype : numpy dtype, optional
+        dtype the signals are stored as. The default is np.float64.
+
+    Returns
+    -------
+    runs : dict
+        sheet names mapped to the DTARun for that sheet (same as get_dta_data)
+
+    '''
+    version = str(EXCEL_PARSER_VERSION) + '-runcols'
+    
+    frames = {}
+    if use_cache:
+        for sheetname in masses_by_sheet:
+            data = load_cached_frame(filename, sheetname, version)
+            if data is not None:
+                frames[sheetname] = data
+    
+    # read every sheet that wasn't cached in one go
+    missing = [sheetname for sheetname in masses_by_sheet if sheetname not in frames]
+    if len(missing) > 0:
+        frames.update(_read_run_columns(filename, missing))
+        if use_cache:
+            for sheetname in missing:
+                save_cached_frame(filename, sheetname, version, frames[sheetname])
+    
+    runs = {}
+    for sheetname, initial_mass in masses_by_sheet.items():
+        data = frames[sheetname]
+        runs[sheetname] = DTARun(data.iloc[:,0]*60, data.iloc[:,1], data.iloc[:,2], data.iloc[:,3],
+                                 data.iloc[:,4], initial_mass, dtype=dtype)
+    
+    return runs
+
+# signals of the SDT Q600 export in the order they are written when there is no header
+TA_DEFAULT_SIGNALS = ['Time (min)', 'Temperature (°C)', 'Weight (mg)', 'Heat Flow (mW)',
+                      'Temperature Difference (°C/mg)', 'Temperature Difference (°C)',
+                      'Sample Purge Flow (mL/min)']
+
+# column names used in the excel template for the signals we need from a TA export
+TA_RUN_SIGNALS = ['Time (min)', 'Temperature', 'Weight (mg)', 'Heatflow (mW)']
+
+_FLOAT_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_MASS_RE = re.compile(r'([-+]?(?:\d+\.?\d*|\.\d+))\s*mg', re.IGNORECASE)
+
+def _is_ta_signal(name, signal):
+    # match the signal names UA writes to the excel template column names
+    signal = signal.lower()
+    if name == 'Time (min)':
+        return signal.startswith('time')
+    if name == 'Temperature':
+        return signal.startswith('temperature') and 'diff' not in signal
+    if name == 'Weight (mg)':
+        return signal.startswith('weight') and '%' not in signal
+    if name == 'Heatflow (mW)':
+        return signal.replace(' ', '').startswith('heatflow') and '/g' not in signal
+    return False
+
+def get_ta_encoding(filename):
+    '''
+    Encoding of a TA text export, Universal Analysis writes either ANSI or UTF-16 depending
+    on the version.
+    '''
+    with open(filename, 'rb') as f:
+        start = f.read(2)
+    if start in (b'\xff\xfe', b'\xfe\xff'):
+        return 'utf-16'
+    return 'latin-1'
+
+@instrumented('parse')
+def read_ta_header(filename, max_header_lines=500):
+    '''
+    Reads the header block of a TA Universal Analysis text export (the part above
+    "StartOfData").
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt file exported from TA Universal Analysis
+    max_header_lines : int, optional
+        Stop looking for "StartOfData" after this many lines. The default is 500.
+
+    Returns
+    -------
+    header : dict
+        Header fields (e.g. 'Sample', 'Size', 'Comment') mapped to their text. The
+        signal names are under 'signals' in the order of the data columns and the number
+        of lines to skip to get to the data is under 'data_start'. If the file has no header
+        'signals' is the default SDT Q600 signal order and 'data_start' is 0.
+
+    '''
+    header = {'signals': [], 'data_start': 0, 'encoding': get_ta_encoding(filename)}
+    
+    with open(filename, 'r', encoding=header['encoding'], errors='replace') as f:
+        for line_num, line in enumerate(f):
+            line = line.rstrip('\r\n')
+            if line.strip() == 'StartOfData':
+                header['data_start'] = line_num + 1
+                break
+            if line_num >= max_header_lines:
+                line_num = None
+                break
+            
+            key, _, value = line.partition('\t')
+            key = key.strip()
+            if key.startswith('Sig') and key[3:].isdigit():
+                header['signals'].append(value.strip())
+            elif key:
+                header[key] = value.strip()
+        else:
+            line_num = None
+        
+    # no header block, the file is just the signal table
+    if line_num is None:
+        return {'signals': list(TA_DEFAULT_SIGNALS), 'data_start': 0, 'encoding': header['encoding']}
+    
+    return header
 
-def get_lower_upper_idxs(temperatures,ltb,utb):
+def get_ta_initial_mass(header):
+    '''
+    Gets the initial mass in mg from the header of a TA text export. I record the starting mass
+    in the "comment" section so that is used first, but only if it says "mg" (the comment also has
+    sample IDs and dates in it), the "Size" field is the fallback.
+
+    Parameters
+    ----------
+    header : dict
+        From read_ta_header
+
+    Returns
+    -------
+    initial_mass : float or None
+        Initial sample mass in milligrams, None if it could not be found
+
+    '''
+    comment = header.get('Comment', '')
+    match = _MASS_RE.search(comment)
+    if match is not None:
+        return float(match.group(1))
+    
+    match = _FLOAT_RE.search(header.get('Size', ''))
+    if match is not None:
+        return float(match.group())
+    return None
+
+def get_ta_signal_columns(header):
+    '''
+    Finds which columns of a TA text export hold the time, temperature, weight and heat flow
+    (in the order of TA_RUN_SIGNALS). Falls back to the SDT Q600 order for signals it can't find.
+
+    Parameters
+    ----------
+    header : dict
+        From read_ta_header
+
+    Returns
+    -------
+    columns : list
+        column positions of the signals
+
+    '''
+    columns = []
+    for default_pos, name in enumerate(TA_RUN_SIGNALS):
+        pos = next((i for i, sig in enumerate(header['signals']) if _is_ta_signal(name, sig)), default_pos)
+        columns.append(pos)
+    return columns
+
+@instrumented('parse')
+def read_ta_signals(filename, header=None):
+    '''
+    Reads the time, temperature, weight and heat flow columns of a TA Universal Analysis
+    text export. Only those columns are parsed (with the pandas C parser) so it is much faster
+    than going through excel.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt file exported from TA Universal Analysis
+    header : dict, optional
+        From read_ta_header, read from the file if not given
+
+    Returns
+    -------
+    signals : Pandas DataFrame
+        dataframe with the columns 'Time (min)', 'Temperature', 'Weight (mg)', 'Heatflow (mW)'
+        (the same names as the excel template)
+
+    '''
+    if header is None:
+        header = read_ta_header(filename)
+    
+    # find the position of each signal we need, fall back to the SDT Q600 order
+    usecols = get_ta_signal_columns(header)
+    
+    import pandas as pd
+    signals = pd.read_csv(filename, sep='\t', header=None, skiprows=header['data_start'],
+                          usecols=usecols, dtype=np.float64, engine='c',
+                          encoding=header['encoding'], skipinitialspace=True)
+    
+    # usecols doesn't keep the order it was given in
+    signals = signals[usecols]
+    signals.columns = TA_RUN_SIGNALS
+    
+    return signals
+
+@instrumented('load')
+def get_dta_txt_data(filename, baseline_filename, initial_mass=None, dtype=np.float64):
+    '''
+    Same as get_dta_data but reads the TA Universal Analysis .txt exports directly so the
+    data doesn't have to be pasted into an excel sheet first.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt export of the sample scan
+    baseline_filename : string
+        name of the .txt export of the baseline scan
+    initial_mass : float, optional
+        initial mass of sample in milligrams. If not given it is read from the comment
+        (or size) field of the sample export
+    dtype : numpy dtype, optional
+        dtype the signals are stored as. The default is np.float64.
+
+    Returns
+    -------
+    DTARun
+        Same as get_dta_data
+
+    '''
+    header = read_ta_header(filename)
+    if initial_mass is None:
+        initial_mass = get_ta_initial_mass(header)
+        if initial_mass is None:
+            raise ValueError("could not find the initial mass (in mg) in the comment or size of " + str(filename) 
+                             + ", pass initial_mass")
+    
+    data = read_ta_signals(filename, header)
+    baseline = read_ta_signals(baseline_filename)
+    
+    # line up the baseline with the scan row by row like in the excel sheet
+    heatflow_bl = baseline['Heatflow (mW)'].reindex(data.index)
+    
+    return DTARun(data['Time (min)']*60, data['Temperature'], data['Weight (mg)'], data['Heatflow (mW)'],
+                  heatflow_bl, initial_mass, dtype=dtype)
+
+@instrumented('lookup')
+def get_lower_upper_idxs(temperatures,ltb,utb,segment='heating'):
     '''
     Finds the dataframe index that corresponds to the temperature bounds you will want for 
     curve adjustment or integration
     
     Parameters
     ----------
-    temperatures : Pandas Series
-        series of temperatures from run, must be a series and not a list! Use [1] from the 
-        extracted data
+    temperatures : array, Pandas Series or DTARun
+        temperatures from run, use [1] (or .temp) from the extracted data. A DTARun can also
+        be passed directly
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
     utb : int or float
         utb = upper temperature bound (in Celsius)
+    segment : string, int or None, optional
+        Part of the temperature program to look in, "heating" is the first heating ramp so 
+        points in cooling or isothermal segments are never picked. Can also be "cooling",
+        "last heating", "longest heating", ... or "all" for the whole run (see 
+        TemperatureIndex.select in dta_run.py). The default is "heating".
 
     Returns
     -------
@@ -92,56 +412,92 @@ def get_lower_upper_idxs(temperatures,ltb,utb):
 
     '''
     
-    initial_idx = temperatures.sub(ltb).abs().idxmin() 
-    final_idx = temperatures.sub(utb).abs().idxmin()
+    initial_idx, final_idx = _temperature_index(temperatures).lookup([ltb, utb], segment)
     
     return initial_idx, final_idx
 
-def perform_adjustment(run_data, ltb, utb):
+def _temperature_index(temperatures):
+    # the index a DTARun keeps, otherwise one has to be built for the temperatures given
+    if isinstance(temperatures, DTARun):
+        return temperatures.temp_index
+    return TemperatureIndex(temperatures)
+
+@instrumented('lookup')
+def get_temperature_idxs(temperatures, bounds, segment='heating'):
+    '''
+    Same as get_lower_upper_idxs but for any number of temperatures at once. With a DTARun
+    thousands of bounds are found in about the time it takes to scan the run once.
+
+    Parameters
+    ----------
+    temperatures : array, Pandas Series or DTARun
+        temperatures from run, use [1] (or .temp) from the extracted data
+    bounds : array
+        temperatures (in Celsius) to find the index of
+    segment : string, int or None, optional
+        Part of the temperature program to look in, see get_lower_upper_idxs. The default
+        is "heating".
+
+    Returns
+    -------
+    idxs : array of ints
+        index of the point closest to each temperature in bounds
+
+    '''
+    return np.asarray(_temperature_index(temperatures).lookup(bounds, segment))
+
+@instrumented('adjust')
+def perform_adjustment(run_data, ltb, utb, inplace=False):
     '''
     Provides an adjustment to the non-normalized and normalized baseline subtracted heat flow.
     It looks for a local minimum in the region of interest, finds the heat flow at that point and
-    subtracts that from the non and normalized blshf. 
+    subtracts that from the non and normalized blshf. For a DTARun the minimums are kept as
+    offsets (run.bls_offset, run.norm_bls_offset) instead of making new arrays, so trying many
+    adjustment windows on the same run only looks at the points inside each window.
 
     Parameters
     ----------
-    run_data : list
+    run_data : DTARun or list
         Result from running get_dta_data function
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
     utb : int or float
         tb = upper temperature bound (in Celsius)
+    inplace : Bool, optional
+        Adjust run_data itself instead of a copy. The default is False.
 
     Returns
     -------
-    run_data_adj : list
-        The adjusted data replaces the non and normalized blshf which corresponds to 
-        in column [3], [7] of original extracted data list
+    run_data_adj : DTARun or list
+        Copy of the run where the non and normalized blshf (.bls_hf and .norm_hf_bls, [3] and [7]
+        of the old list) are adjusted (run_data itself if inplace). The other signals are shared
+        with the original run. Given the old list a list is returned.
 
     '''   
     # get data
-    bls_hf = run_data[3]
-    norm_hf_bls = run_data[7]
-    temperatures = run_data[1]
+    run = as_dta_run(run_data)
     
-    # find idxs of pandas df temperatures
-    initial_temp_idx,final_temp_idx = get_lower_upper_idxs(temperatures,ltb,utb)
+    # find idxs of temperatures
+    initial_temp_idx,final_temp_idx = get_lower_upper_idxs(run,ltb,utb)
        
     # get local min in range of idxs
-    min_hf_idx_bls_hf = bls_hf[initial_temp_idx:final_temp_idx].idxmin()
-    min_hf_idx_norm_hf_bls = norm_hf_bls[initial_temp_idx:final_temp_idx].idxmin()
-    
-    # find bls_hf value at 
-    min_hf_bls_hf = bls_hf[min_hf_idx_bls_hf]
-    min_hf_norm_bls_hf = norm_hf_bls[min_hf_idx_norm_hf_bls]
+    min_hf_bls_hf = np.nanmin(run.chunk('bls_hf', initial_temp_idx, final_temp_idx))
+    min_hf_norm_bls_hf = np.nanmin(run.chunk('norm_hf_bls', initial_temp_idx, final_temp_idx))
       
     # make dta adjustment, replace bls_hf with adjusted
-    run_data_adj = run_data.copy()
-    run_data_adj[3] = run_data[3] - min_hf_bls_hf
-    run_data_adj[7] = run_data[7] - min_hf_norm_bls_hf      
+    if not isinstance(run_data, DTARun):
+        run_data_adj = run_data if inplace else list(run_data)
+        run_data_adj[3] = run_data[3] - min_hf_bls_hf
+        run_data_adj[7] = run_data[7] - min_hf_norm_bls_hf
+        return run_data_adj
+    
+    # the integral of the heat flow is built once on this run and shared by every adjusted copy
+    run._raw_cum_bls_hf()
+    run_data_adj = run.adjust(float(min_hf_bls_hf), float(min_hf_norm_bls_hf), inplace=inplace)
         
     return run_data_adj
 
+@instrumented('integrate')
 def get_intermetallic_heat(ar_run_data,ltb,utb,ar_initial_mass):
     
     '''
@@ -150,7 +506,7 @@ def get_intermetallic_heat(ar_run_data,ltb,utb,ar_initial_mass):
 
     Parameters
     ----------
-    ar_run_data : list
+    ar_run_data : DTARun or list
         Result from running get_dta_data function (ran in Argon)
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
@@ -167,19 +523,19 @@ def get_intermetallic_heat(ar_run_data,ltb,utb,ar_initial_mass):
     '''   
     
     # get temps, time, bls_hf
-    temperatures = ar_run_data[1]
-    times = ar_run_data[2]
-    ar_bls_hf = ar_run_data[3]
+    run = as_dta_run(ar_run_data)
         
     # get idx of lower and upper temperature bounds
-    initial_idx, final_idx = get_lower_upper_idxs(temperatures,ltb,utb)
+    initial_idx, final_idx = get_lower_upper_idxs(run,ltb,utb)
     
-    # calc intermetallic heat release in J/g (doesn't factor in chemistry)
-    raw_total_area = scipy.integrate.trapz(ar_bls_hf[initial_idx:final_idx],times[initial_idx:final_idx])
+    # calc intermetallic heat release in J/g (doesn't factor in chemistry), uses the cumulative 
+    # integral of the run so it's the same as trapz over bls_hf[initial_idx:final_idx]
+    raw_total_area = run.bls_hf_integral(initial_idx, final_idx)
     intermetallic_heat = raw_total_area / (ar_initial_mass / 1000) / 1000
     
     return intermetallic_heat
 
+@instrumented('integrate')
 def mass_gain_over_temp_range(aro2_run_data, ltb,utb):
     '''
     Calculates mass gain over given temperature range. Can be used for Ar + O2 or
@@ -187,7 +543,7 @@ def mass_gain_over_temp_range(aro2_run_data, ltb,utb):
 
     Parameters
     ----------
-    aro2_run_data : list
+    aro2_run_data : DTARun or list
         Result from running get_dta_data function (ran in Ar + O2 or Ar + N2)
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
@@ -202,20 +558,26 @@ def mass_gain_over_temp_range(aro2_run_data, ltb,utb):
     '''
     
     # get masses and temperatures
-    mass_list = aro2_run_data[4]
-    temperatures = aro2_run_data[1]
+    run = as_dta_run(aro2_run_data)
+    mass_list = run.true_mass
     
     # get idx of lower and upper temperature bounds
-    initial_idx, final_idx = get_lower_upper_idxs(temperatures,ltb,utb)
+    initial_idx, final_idx = get_lower_upper_idxs(run,ltb,utb)
     
     # find the mass at initial and final idx
-    initial_mass = mass_list[initial_idx]
-    final_mass = mass_list[final_idx]
+    initial_mass = float(mass_list[initial_idx])
+    final_mass = float(mass_list[final_idx])
     
     mg = final_mass - initial_mass
     
     return mg
 
+# heats of formation per 1 g of gas added in mass gain
+ZRO2_FORM_HEAT = 34.3     # kJ/g  Zirconia formation per 1 g O2 added in mass gain
+ZRN_FORM_HEAT = 14.79     # kJ/g  zirconium nitride formation per 1 g N2 added in mass gain
+ALN_FORM_HEAT = 22.7      # kJ/g  aluminum nitride formation per 1 g N2 added in mass gain 
+
+@instrumented('integrate')
 def get_heat_oxidation(aro2_run_data,ltb,utb,initial_mass):
     '''
     Calculates the heat of oxidation. Assumes that all mass gain is from O2 that
@@ -223,7 +585,7 @@ def get_heat_oxidation(aro2_run_data,ltb,utb,initial_mass):
 
     Parameters
     ----------
-    aro2_run_data : list
+    aro2_run_data : DTARun or list
         Result from running get_dta_data function (ran in Ar + O2)
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
@@ -240,11 +602,11 @@ def get_heat_oxidation(aro2_run_data,ltb,utb,initial_mass):
     '''
         
     mass_gain = mass_gain_over_temp_range(aro2_run_data,ltb,utb)  # mass gain in mg
-    zro2_form_heat = 34.3     # kJ/g  Zirconia formation per 1 g O2 added in mass gain
-    oxidation_heat = zro2_form_heat * mass_gain / (initial_mass / 1000)
+    oxidation_heat = ZRO2_FORM_HEAT * mass_gain / (initial_mass / 1000)
     
     return oxidation_heat
 
+@instrumented('integrate')
 def get_heat_nitridation(arn2_run_data,ltb,utb,initial_mass):
     '''
     Calculates the heat of nitridation. Assumes an average value between the heat of
@@ -252,7 +614,7 @@ def get_heat_nitridation(arn2_run_data,ltb,utb,initial_mass):
 
     Parameters
     ----------
-   arn2_run_data : list
+   arn2_run_data : DTARun or list
        Result from running get_dta_data function (ran in Ar + N2)
    ltb : int or float
        ltb = lower temperature bound (in Celsius)
@@ -269,14 +631,12 @@ def get_heat_nitridation(arn2_run_data,ltb,utb,initial_mass):
     '''
         
     mass_gain = mass_gain_over_temp_range(arn2_run_data,ltb,utb)  # mass gain in mg
-    zrn_form_heat = 14.79     # kJ/g  zirconium nitride formation per 1 g N2 added in mass gain
-    aln_form_heat = 22.7       # kJ/g  aluminum nitride formation per 1 g N2 added in mass gain 
-    
-    form_heat = (zrn_form_heat + aln_form_heat) / 2
+    form_heat = (ZRN_FORM_HEAT + ALN_FORM_HEAT) / 2
     nitridation_heat = form_heat * mass_gain / (initial_mass / 1000)
     
     return nitridation_heat
 
+@instrumented('integrate')
 def avg_stdev_heat(run_data_list,ltb,utb,initial_mass_list,heat_type):
     '''
     Calculates the avg and standard deviation heat release over a given temperature
@@ -286,7 +646,7 @@ def avg_stdev_heat(run_data_list,ltb,utb,initial_mass_list,heat_type):
     Parameters
     ----------
     run_data_list : list
-        list containing the names of the extracted data for each run
+        list containing the names of the extracted data for each run (DTARun or old list)
     ltb : int or float
         ltb = lower temperature bound (in Celsius)
     utb : int or float
@@ -306,32 +666,264 @@ def avg_stdev_heat(run_data_list,ltb,utb,initial_mass_list,heat_type):
 
     '''
     
-    # make a list with calc heat from either im, ox, nit for each trial in the run data list
-    heats = []
-    for i in range(len(run_data_list)):
-        if heat_type == "im":
-            heats.append(get_intermetallic_heat(run_data_list[i],ltb,utb,initial_mass_list[i]))
-                
-        elif heat_type == "ox":
-            heats.append(get_heat_oxidation(run_data_list[i],ltb,utb,initial_mass_list[i]))
-            
-        elif heat_type == "nit":
-            heats.append(get_heat_nitridation(run_data_list[i],ltb,utb,initial_mass_list[i]))
-            
-        else:
-            print("heat type incorrect. use either 'im', 'ox', or 'nit'")
+    # calc heat from either im, ox, nit for each trial in the run data list
+    avg_heats, heat_stdevs, _ = avg_stdev_window_heats(run_data_list, [(ltb, utb)], initial_mass_list, heat_type)
+        
+    return float(avg_heats[0]), float(heat_stdevs[0])
+
+@instrumented('integrate')
+def get_window_heats(run_data_list, windows, initial_mass_list, heat_type, segment='heating'):
+    '''
+    Calculates the heat released by every run over every temperature window in one call.
+    Gives the same values as get_intermetallic_heat, get_heat_oxidation or get_heat_nitridation
+    called for each run and window, but the bounds of all windows are looked up at once and the
+    heats come from the cumulative integral of each run.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list containing the extracted data for each run (DTARun or old list)
+    windows : array
+        (ltb, utb) pairs in Celsius, shape (number of windows, 2)
+    initial_mass_list : list
+        list containing the initial masses of the extracted data for each run
+    heat_type : string
+        Can be either "im", "ox", or "nit" depending on what kind of heat you are
+        trying to calculate.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    heats : array
+        heat in J/g of each run (rows) over each window (columns)
+
+    '''
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    
+    heats = np.empty((len(run_data_list), len(windows)))
+    for i, run_data in enumerate(run_data_list):
+        run = as_dta_run(run_data)
+        idxs = get_temperature_idxs(run, windows, segment)
+        heats[i] = _window_heats(run, idxs[:, 0], idxs[:, 1], initial_mass_list[i], heat_type)
     
-    # get average of the heat list
-    avg_heat = sum(heats) / len(run_data_list)
+    return heats
+
+@instrumented('integrate')
+def avg_stdev_window_heats(run_data_list, windows, initial_mass_list, heat_type, segment='heating'):
+    '''
+    Same as get_window_heats but also gives the average and standard deviation over the runs
+    for each window, like avg_stdev_heat does for a single window.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list containing the extracted data for each run (DTARun or old list)
+    windows : array
+        (ltb, utb) pairs in Celsius, shape (number of windows, 2)
+    initial_mass_list : list
+        list containing the initial masses of the extracted data for each run
+    heat_type : string
+        Can be either "im", "ox", or "nit" depending on what kind of heat you are
+        trying to average.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    avg_heats : array
+        average heat in J/g over each window
+    heat_stdevs : array
+        standard deviation of the heat in J/g over each window (0 with a single run)
+    heats : array
+        heat in J/g of each run (rows) over each window (columns)
+
+    '''
+    heats = get_window_heats(run_data_list, windows, initial_mass_list, heat_type, segment)
     
-    # stdev
+    avg_heats = heats.mean(axis=0)
     if len(run_data_list) > 1:
-        heat_stdev = statistics.stdev(heats)
+        heat_stdevs = heats.std(axis=0, ddof=1)
     else:
-        heat_stdev = 0
-        
-    return avg_heat, heat_stdev
+        heat_stdevs = np.zeros(heats.shape[1])
+    
+    return avg_heats, heat_stdevs, heats
+
+@instrumented('average')
+def align_runs(run_data_list, signal, grid=None, axis='temp', segment='heating', dtype=np.float64):
+    '''
+    Puts a signal of every run on the same grid of temperatures (or times) so replicates with
+    different lengths or sampling can be averaged point by point. Each run is linearly
+    interpolated onto the grid, straight into one array.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list containing the extracted data for each run (DTARun or old list)
+    signal : string or list
+        name of the signal of the runs (e.g. "mass_diff" or "norm_hf_bls"), or one array per
+        run lined up with the points of the run
+    grid : array, optional
+        temperatures (or times in seconds) to interpolate at. The default is evenly spaced
+        over the range any of the runs cover, with as many points as the longest run has in it.
+    axis : string, optional
+        "temp" to line up by temperature (within segment), "time" to line up by time, or
+        "index" to line up point by point without interpolating (shorter runs are nan
+        padded, like a dataframe would). The default is "temp".
+    segment : string, int or None, optional
+        Part of the temperature program used when lining up by temperature, see
+        get_lower_upper_idxs. The default is "heating".
+    dtype : numpy dtype, optional
+        dtype of the aligned array. The default is np.float64.
+
+    Returns
+    -------
+    grid : array
+        the grid the runs were put on (the indices for "index")
+    aligned : array
+        the signal of each run (rows) at each grid point (columns), nan where a run doesn't
+        cover the grid point
+
+    '''
+    runs = [as_dta_run(run_data) for run_data in run_data_list]
+    if isinstance(signal, str):
+        signals = [getattr(run, signal) for run in runs]
+    else:
+        signals = [np.asarray(values) for values in signal]
+
+    if axis == 'index':
+        grid = np.arange(max(len(values) for values in signals))
+        aligned = np.full((len(runs), len(grid)), np.nan, dtype=dtype)
+        for i, values in enumerate(signals):
+            aligned[i, :len(values)] = values
+        return grid, aligned
+
+    # positions of the points of each run along the axis, in increasing order
+    positions = []
+    for run, values in zip(runs, signals):
+        if axis == 'temp':
+            x, order = run.temp_index.ordered(segment)
+            y = values[order]
+        elif axis == 'time':
+            x, y = run.time_sec, values
+        else:
+            raise ValueError("axis should be 'temp', 'time' or 'index', got " + repr(axis))
+        keep = ~(np.isnan(x) | np.isnan(y))
+        positions.append((x[keep], y[keep]))
+
+    if grid is None:
+        covered = [(x[0], x[-1]) for x, _ in positions if len(x) > 0]
+        if len(covered) == 0:
+            raise ValueError("none of the runs have any points to align")
+        grid = np.linspace(min(lo for lo, _ in covered), max(hi for _, hi in covered),
+                           max(len(x) for x, _ in positions))
+    grid = np.asarray(grid, dtype=np.float64)
+
+    aligned = np.full((len(runs), len(grid)), np.nan, dtype=dtype)
+    for i, (x, y) in enumerate(positions):
+        if len(x) > 0:
+            aligned[i] = np.interp(grid, x, y, left=np.nan, right=np.nan)
+
+    return grid, aligned
+
+@instrumented('average')
+def avg_stdev_aligned(aligned, confidence=0.95, block_size=1 << 20, scales=None):
+    '''
+    Average, standard deviation and confidence band of aligned runs at each grid point. Nan
+    points (runs that don't cover that part of the grid) are skipped like pandas does.
 
+    Parameters
+    ----------
+    aligned : array or list
+        From align_runs, one row per run. Can also be a list of one array per run (of any
+        length), they are then lined up point by point like align_runs(..., axis='index')
+        without ever making the whole table
+    confidence : float, optional
+        Confidence level of the band around the average (student t), None to skip the band
+        (lower and upper are then None). The default is 0.95.
+    block_size : int, optional
+        The columns are reduced a block of about this many values at a time so big arrays
+        don't need big temporary copies. The default is 1048576.
+    scales : array, optional
+        Each run is multiplied by its scale first (e.g. 100 / initial mass for percentages).
+        The default is no scaling.
+
+    Returns
+    -------
+    avg : array
+        average over the runs at each grid point
+    stdev : array
+        standard deviation (ddof=1) at each grid point, nan where fewer than 2 runs
+    lower : array
+        lower edge of the confidence band of the average
+    upper : array
+        upper edge of the confidence band of the average
+
+    '''
+    if isinstance(aligned, (list, tuple)):
+        num_points = max(len(values) for values in aligned)
+        return _avg_stdev_blocks(_index_blocks(aligned, scales, block_size), num_points, confidence)
+    
+    aligned = np.asarray(aligned)
+    num_runs, num_points = aligned.shape
+    step = max(1, block_size // max(num_runs, 1))
+    blocks = ((start, aligned[:, start:start + step]) for start in range(0, num_points, step))
+    if scales is not None:
+        scales = np.asarray(scales, dtype=np.float64)[:, None]
+        blocks = ((start, block * scales) for start, block in blocks)
+    
+    return _avg_stdev_blocks(blocks, num_points, confidence)
+
+def _index_blocks(signals, scales=None, block_size=1 << 20):
+    # the signals lined up point by point like align_runs(..., axis='index') gives them, a block
+    # of columns at a time (times scales) so the whole table is never in memory
+    num_points = max(len(values) for values in signals)
+    step = max(1, block_size // len(signals))
+    for start in range(0, num_points, step):
+        block = np.full((len(signals), min(step, num_points - start)), np.nan)
+        for i, values in enumerate(signals):
+            part = values[start:start + step]
+            block[i, :len(part)] = part
+            if scales is not None:
+                block[i] *= scales[i]
+        yield start, block
+
+def _avg_stdev_blocks(blocks, num_points, confidence=0.95):
+    # avg_stdev_aligned over (start, block) pairs that cover the columns
+    avg = np.empty(num_points)
+    stdev = np.empty(num_points)
+    lower = np.empty(num_points) if confidence is not None else None
+    upper = np.empty(num_points) if confidence is not None else None
+    t_values = None
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start, block in blocks:
+            stop = start + block.shape[1]
+            missing = np.isnan(block)
+            count = block.shape[0] - missing.sum(axis=0)
+            mean = np.where(missing, 0, block).sum(axis=0, dtype=np.float64) / count
+            deviation = np.where(missing, 0, block - mean)
+            variance = np.einsum('ij,ij->j', deviation, deviation) / (count - 1)
+            
+            avg[start:stop] = mean
+            stdev[start:stop] = np.where(count > 1, np.sqrt(variance), np.nan)
+            if confidence is None:
+                continue
+            
+            if t_values is None:
+                # student t of every number of runs a point can have, looked up instead of
+                # worked out at every point
+                from scipy import stats
+                t_values = stats.t.ppf(0.5 + confidence / 2, np.arange(block.shape[0] + 1) - 1)
+            half_width = t_values[count] * stdev[start:stop] / np.sqrt(count)
+            lower[start:stop] = mean - half_width
+            upper[start:stop] = mean + half_width
+    
+    return avg, stdev, lower, upper
+
+@instrumented('integrate')
 def calculate_incremental_cumulative_heat(run_data_list,start_temp,end_temp,step,initial_mass_list,heat_type):
     '''
     Calculates the incremental heat release over a given temperature range at a given step size
@@ -340,7 +932,7 @@ def calculate_incremental_cumulative_heat(run_data_list,start_temp,end_temp,step
     Parameters
     ----------
     run_data_list : list
-        list containing the names of the extracted data for each run
+        list containing the names of the extracted data for each run (DTARun or old list)
     start_temp : float
         starting temperature of range
     end_temp : float
@@ -367,45 +959,62 @@ def calculate_incremental_cumulative_heat(run_data_list,start_temp,end_temp,step
     # create a list that is the temp array. 
     temps = np.arange(start_temp, end_temp+step, step)
     
-    # calculate the heat release 
-    incremental_heat = []
-    incremental_heat_stdev = []
-    bound0 = temps[0]
-    
-    for i in range(1,len(temps)):
-        
-        avg_heat, stdev_heat = avg_stdev_heat(run_data_list,bound0, temps[i],initial_mass_list,heat_type)
-        incremental_heat.append(avg_heat)
-        incremental_heat_stdev.append(stdev_heat)
-        
-        # increment to next temperature range
-        bound0 = temps[i]
+    # calculate the heat release of every interval of every run at once
+    windows = np.column_stack((temps[:-1], temps[1:]))
+    incremental_heat, incremental_heat_stdev, _ = avg_stdev_window_heats(run_data_list, windows, 
+                                                                         initial_mass_list, heat_type)
         
     cumulative_heats = np.cumsum(incremental_heat)
 
-    return incremental_heat, incremental_heat_stdev, cumulative_heats
+    return incremental_heat.tolist(), incremental_heat_stdev.tolist(), cumulative_heats
+
+def _window_heats(run, initial_idxs, final_idxs, initial_mass, heat_type):
+    # heat in J/g between each pair of indexes, the vectorized version of get_intermetallic_heat, 
+    # get_heat_oxidation and get_heat_nitridation
+    if heat_type == "im":
+        return run.bls_hf_integral(initial_idxs, final_idxs) / (initial_mass / 1000) / 1000
+    
+    if heat_type == "ox":
+        form_heat = ZRO2_FORM_HEAT
+    elif heat_type == "nit":
+        form_heat = (ZRN_FORM_HEAT + ALN_FORM_HEAT) / 2
+    else:
+        raise ValueError("heat type incorrect. use either 'im', 'ox', or 'nit'")
+    
+    mass_gain = run.true_mass[final_idxs].astype(np.float64) - run.true_mass[initial_idxs]
+    return form_heat * mass_gain / (initial_mass / 1000)
 
+@instrumented('convert')
 def convert_Jg_kJmol(heat_J_g,chemstring,numatoms):
     '''
-    Converts heat in J/g to kJ/mol
+    Converts heat in J/g to kJ/mol. Works on one heat or on a whole table at once, the heats,
+    chemistries and numbers of atoms can be arrays (or pandas columns) that line up with each
+    other, or single values that apply to every heat.
 
     Parameters
     ----------
-    heat_J_g : float
+    heat_J_g : float or array
         Heat in J/g
-    chemstring : string
+    chemstring : string or array of strings
         String representing chemistry of powder. Refer to molar mass calculator script to 
         use proper syntax
-    numatoms : int
+    numatoms : int or array
         Number of atoms per compound
 
     Returns
     -------
-    im_heat_kJ_mol : float
+    im_heat_kJ_mol : float or array
         Heat in kJ/mol
 
     '''
-    molar_mass = get_molar_mass(chemstring) / numatoms
+    if isinstance(chemstring, str):
+        molar_mass = get_molar_mass(chemstring) / numatoms
+    else:
+        # every different chemistry is only parsed once
+        chemstrings = np.asarray(chemstring, dtype=str)
+        unique_chems, inverse = np.unique(chemstrings, return_inverse=True)
+        unique_masses = np.array([get_molar_mass(chem) for chem in unique_chems])
+        molar_mass = unique_masses[inverse].reshape(chemstrings.shape) / np.asarray(numatoms)
 
     # heat in kJ/mol 
     im_heat_kJ_mol = heat_J_g / 1000 * (molar_mass)
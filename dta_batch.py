@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+## runs the analysis over a whole batch of DTA runs listed in a manifest, from the command line
+##
+##   python dta_batch.py manifest.csv -o results.csv --workers 8
+##   python dta_batch.py manifest.csv -o results.csv --db heats.sqlite   # only computes what changed
+##
+## The manifest is a csv with one row per run and the columns:
+##   file            excel workbook (or TA .txt export of the scan, or a .dtarun file from
+##                   dta_store.save_run), relative to the manifest
+##   sheet           sheet of the workbook the run is in (not needed for .txt exports or .dtarun files)
+##   baseline        TA .txt export of the baseline scan (only for .txt exports)
+##   initial_mass    initial mass of sample in milligrams
+##   atmosphere      e.g. Ar, Ar+O2, Ar+N2. Decides which heats are calculated
+##   chemistry       chemstring for convert_Jg_kJmol e.g. Al1Zr1 (optional)
+##   numatoms        number of atoms per compound for convert_Jg_kJmol (optional)
+##   windows         temperature windows to integrate over e.g. 120-600;600-1000
+##   adjustment      window for perform_adjustment e.g. 100-200 (optional, only one)
+##   heat_types      heats to calculate e.g. im;ox (optional, default from the atmosphere)
+import os
+import sys
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from dta_analysis_funcs import (load_workbook_runs, get_dta_txt_data, perform_adjustment,
+                                get_window_heats, convert_Jg_kJmol)
+from dta_store import open_run
+from dta_results import ResultsStore
+from dta_profile import Profile, enable_profiling, disable_profiling
+
+__all__ = ['RESULT_COLUMNS', 'parse_windows', 'default_heat_types', 'read_manifest', 'analyze_run',
+           'run_batch', 'main']
+
+RESULT_COLUMNS = ['run_id', 'file', 'sheet', 'atmosphere', 'chemistry', 'heat_type', 'ltb', 'utb',
+                  'heat_J_g', 'heat_kJ_mol', 'error']
+
+def parse_windows(text):
+    '''
+    Turns "120-600;600-1000" into [(120.0, 600.0), (600.0, 1000.0)].
+    '''
+    windows = []
+    for window in str(text).replace(',', ';').split(';'):
+        window = window.strip()
+        if window == '':
+            continue
+        # split on the dash between the bounds, not the sign of a negative bound
+        split = window.find('-', 1)
+        if split < 0:
+            raise ValueError("window should look like 120-600, got '" + window + "'")
+        windows.append((float(window[:split]), float(window[split + 1:])))
+    return windows
+
+def default_heat_types(atmosphere):
+    '''
+    Heats calculated for a run in an atmosphere when the manifest doesn't list them. The
+    intermetallic heat is always calculated, oxidation for atmospheres with O2 (or air) and
+    nitridation for atmospheres with N2.
+    '''
+    atmosphere = str(atmosphere).lower()
+    heat_types = ['im']
+    if 'o2' in atmosphere or 'air' in atmosphere:
+        heat_types.append('ox')
+    if 'n2' in atmosphere:
+        heat_types.append('nit')
+    return heat_types
+
+def read_manifest(filename):
+    '''
+    Reads the manifest of a batch (see the top of this file for the columns).
+
+    Parameters
+    ----------
+    filename : string
+        name of the manifest csv
+
+    Returns
+    -------
+    entries : list
+        one dict per run with the parsed columns, file paths are made relative to the
+        directory of the manifest. A row that can't be parsed (e.g. a mass that isn't a
+        number) still gives an entry, with the problem and the line of the manifest under
+        'error', so run_batch reports it as a failed run instead of the whole batch failing
+
+    '''
+    import pandas as pd
+    manifest = pd.read_csv(filename, dtype=str, keep_default_na=False, skipinitialspace=True)
+    manifest.columns = [col.strip().lower() for col in manifest.columns]
+    missing = {'file', 'initial_mass', 'windows'} - set(manifest.columns)
+    if missing:
+        raise ValueError("manifest is missing the columns: " + ", ".join(sorted(missing)))
+
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    def resolve(path):
+        return os.path.join(base_dir, path) if path else path
+
+    entries = []
+    for row_num, row in enumerate(manifest.to_dict('records')):
+        atmosphere = row.get('atmosphere', '')
+        heat_types = [ht.strip() for ht in row.get('heat_types', '').split(';') if ht.strip()]
+        entry = {'row': row_num,
+                 'file': resolve(row['file']),
+                 'sheet': row.get('sheet', ''),
+                 'baseline': resolve(row.get('baseline', '')),
+                 'initial_mass': np.nan,
+                 'atmosphere': atmosphere,
+                 'chemistry': row.get('chemistry', ''),
+                 'numatoms': 1,
+                 'windows': [],
+                 'adjustment': [],
+                 'heat_types': heat_types or default_heat_types(atmosphere),
+                 'error': None}
+        try:
+            entry['initial_mass'] = float(row['initial_mass'])
+            if row.get('numatoms', ''):
+                entry['numatoms'] = int(row['numatoms'])
+            entry['windows'] = parse_windows(row['windows'])
+            entry['adjustment'] = parse_windows(row.get('adjustment', ''))
+            if len(entry['adjustment']) > 1:
+                raise ValueError("only one adjustment window can be used, got " + str(len(entry['adjustment'])))
+        except ValueError as err:
+            # +2 for the header and counting from 1, the line number a spreadsheet shows
+            entry['error'] = "manifest line " + str(row_num + 2) + ": ValueError: " + str(err)
+        entries.append(entry)
+    return entries
+
+def _run_id(entry):
+    return os.path.basename(entry['file']) + (':' + entry['sheet'] if entry['sheet'] else '')
+
+def _failed(entry, error):
+    return [{'run_id': _run_id(entry), 'file': entry['file'], 'sheet': entry['sheet'],
+             'atmosphere': entry['atmosphere'], 'chemistry': entry['chemistry'], 'heat_type': None,
+             'ltb': np.nan, 'utb': np.nan, 'heat_J_g': np.nan, 'heat_kJ_mol': np.nan, 'error': error}]
+
+def analyze_run(run, entry):
+    '''
+    The pipeline of dta_analysis_example.py for one run: perform_adjustment (if the entry
+    has an adjustment window), the heat over every window and the conversion to kJ/mol.
+
+    Parameters
+    ----------
+    run : DTARun
+        From get_dta_data (or any of the loaders)
+    entry : dict
+        The manifest entry of the run, from read_manifest
+
+    Returns
+    -------
+    results : list
+        one dict per heat type and window with the columns of RESULT_COLUMNS
+
+    '''
+    for ltb, utb in entry['adjustment']:
+        run = perform_adjustment(run, ltb, utb)
+
+    molar_mass_factor = np.nan
+    if entry['chemistry']:
+        molar_mass_factor = convert_Jg_kJmol(1.0, entry['chemistry'], entry['numatoms'])
+
+    results = []
+    for heat_type in entry['heat_types']:
+        heats = get_window_heats([run], entry['windows'], [entry['initial_mass']], heat_type)[0]
+        for (ltb, utb), heat in zip(entry['windows'], heats):
+            results.append({'run_id': _run_id(entry), 'file': entry['file'], 'sheet': entry['sheet'],
+                            'atmosphere': entry['atmosphere'], 'chemistry': entry['chemistry'],
+                            'heat_type': heat_type, 'ltb': ltb, 'utb': utb, 'heat_J_g': heat,
+                            'heat_kJ_mol': heat * molar_mass_factor, 'error': None})
+    return results
+
+def _analyze_chunk(entries, profile=False, memory=False):
+    # worker: load every run of the chunk (one workbook) and analyze them one by one so a bad
+    # run doesn't take the others down with it, gives back the result rows of each entry and
+    # the profile stats of the chunk (None when not profiling)
+    chunk_profile = enable_profiling(memory=memory) if profile else None
+    try:
+        results = _analyze_entries(entries)
+    finally:
+        if profile:
+            disable_profiling()
+    return results, chunk_profile.stats if profile else None
+
+def _analyze_entries(entries):
+    results = []
+    runs = {}
+    workbook_entries = [entry for entry in entries if not entry['file'].lower().endswith(('.txt', '.dtarun'))]
+    if workbook_entries:
+        try:
+            masses = {entry['sheet']: entry['initial_mass'] for entry in workbook_entries}
+            runs = load_workbook_runs(workbook_entries[0]['file'], masses)
+        except Exception:
+            # loading everything at once failed, load them separately to find the bad ones
+            runs = {}
+
+    for entry in entries:
+        try:
+            if entry['file'].lower().endswith('.txt'):
+                run = get_dta_txt_data(entry['file'], entry['baseline'], entry['initial_mass'])
+            elif entry['file'].lower().endswith('.dtarun'):
+                run = open_run(entry['file'])
+            elif entry['sheet'] in runs:
+                run = runs[entry['sheet']]
+            else:
+                run = load_workbook_runs(entry['file'], {entry['sheet']: entry['initial_mass']})[entry['sheet']]
+            results.append(analyze_run(run, entry))
+        except Exception as err:
+            results.append(_failed(entry, type(err).__name__ + ': ' + str(err)))
+    return results
+
+def _make_chunks(entries, chunk_size):
+    # entries of the same workbook go together so it is only opened once per chunk, a sheet
+    # can only be in a chunk once since the masses are looked up by sheet
+    by_file = {}
+    for entry in entries:
+        by_file.setdefault(entry['file'], []).append(entry)
+
+    chunks = []
+    for file_entries in by_file.values():
+        chunk = []
+        for entry in file_entries:
+            if len(chunk) == chunk_size or any(e['sheet'] == entry['sheet'] for e in chunk):
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(entry)
+        chunks.append(chunk)
+    return chunks
+
+def run_batch(entries, workers=None, chunk_size=8, profile=None, store=None):
+    '''
+    Analyzes every run of a manifest, spread over a pool of processes.
+
+    Parameters
+    ----------
+    entries : list
+        From read_manifest
+    workers : int, optional
+        Number of processes, 1 runs everything in this process. The default is the number
+        of cores.
+    chunk_size : int, optional
+        Max number of sheets of the same workbook handed to a process at once. The default is 8.
+    profile : Profile, optional
+        Profile (see dta_profile.py) the timings of every process are added to. The default is
+        None (no profiling).
+    store : ResultsStore, optional
+        Database of results (see dta_results.py). Runs it has results for that were computed
+        with the same parameters from the same files are taken from it, the others are
+        computed and stored. The default is None (everything is computed).
+
+    Returns
+    -------
+    results : Pandas DataFrame
+        One row per run, heat type and window (columns RESULT_COLUMNS) in the order of the
+        manifest. Runs that failed have a single row with the error and no heats.
+
+    '''
+    import pandas as pd
+    
+    # rows of the manifest that couldn't be parsed fail without being sent out
+    results = {entry['row']: _failed(entry, entry['error']) for entry in entries if entry.get('error')}
+    entries = [entry for entry in entries if not entry.get('error')]
+    if store is not None:
+        todo = []
+        for entry in entries:
+            stored = store.lookup(entry)
+            if stored is None:
+                todo.append(entry)
+            else:
+                results[entry['row']] = stored
+        entries = todo
+
+    chunks = _make_chunks(entries, chunk_size)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            chunk_results, stats = _analyze_chunk(chunk, profile is not None, profile is not None and profile.memory)
+            for entry, rows in zip(chunk, chunk_results):
+                results[entry['row']] = rows
+            if stats is not None:
+                profile.merge(stats)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            memory = profile is not None and profile.memory
+            futures = {pool.submit(_analyze_chunk, chunk, profile is not None, memory): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    chunk_results, stats = future.result()
+                except Exception:
+                    # the worker itself died, every run in it failed
+                    error = traceback.format_exc(limit=1).strip().splitlines()[-1]
+                    chunk_results, stats = [_failed(entry, error) for entry in chunk], None
+                for entry, rows in zip(chunk, chunk_results):
+                    results[entry['row']] = rows
+                if stats is not None:
+                    profile.merge(stats)
+
+    if store is not None:
+        for entry in entries:
+            store.save(entry, results[entry['row']], commit=False)
+        store.commit()
+
+    rows = [row for row_num in sorted(results) for row in results[row_num]]
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculate the heats of a batch of DTA runs listed in a manifest.")
+    parser.add_argument('manifest', help="csv with one run per row (see dta_batch.py for the columns)")
+    parser.add_argument('-o', '--output', default='dta_results.csv', help="csv the results are written to")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument('--chunk-size', type=int, default=8, help="max sheets of a workbook per task")
+    parser.add_argument('--profile', default=None, help="json the time spent in each function is written to")
+    parser.add_argument('--profile-memory', action='store_true', help="also record peak memory (slower)")
+    parser.add_argument('--db', default=None, help="sqlite database of results, runs that didn't change are taken from it")
+    args = parser.parse_args(argv)
+
+    entries = read_manifest(args.manifest)
+    profile = Profile(args.profile_memory) if args.profile else None
+    store = ResultsStore(args.db) if args.db else None
+    try:
+        results = run_batch(entries, workers=args.workers, chunk_size=args.chunk_size, profile=profile, store=store)
+    finally:
+        if store is not None:
+            store.close()
+    results.to_csv(args.output, index=False)
+    if profile is not None:
+        profile.to_json(args.profile)
+        print(profile)
+
+    failed = results[results['error'].notna()]
+    print("analyzed {} runs, {} failed, results written to {}".format(len(entries), len(failed), args.output))
+    for _, row in failed.iterrows():
+        print("  " + row['run_id'] + ": " + row['error'], file=sys.stderr)
+
+    return 1 if len(failed) == len(entries) and len(entries) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
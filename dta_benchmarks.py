@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+## times the analysis functions on synthetic runs of different sizes and saves the results so
+## they can be compared between versions
+##
+##   python dta_benchmarks.py --points 10000 100000 --runs 1 10 -o bench_new.json --compare bench_old.json
+##
+## The cold import of the compute functions (what every batch worker pays) also has to stay under
+## IMPORT_BUDGET_S, the exit code is 1 if it doesn't.
+##
+## Each result is the best of a few repeats. Anything the function caches (the temperature index,
+## the heat flow integral) is made fresh for every repeat so the first call is what is timed.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+import dta_cache
+from dta_run import DTARun
+from dta_synthetic import make_synthetic_runs, write_synthetic_workbook
+from dta_analysis_funcs import (get_dta_data, get_lower_upper_idxs, get_intermetallic_heat,
+                                calculate_incremental_cumulative_heat)
+from dta_mass_gain_funcs import get_mg_percentage_avg_stdev, get_start_mass_gain
+
+__all__ = ['EXCEL_MAX_POINTS', 'IMPORT_BUDGET_S', 'time_call', 'fresh_run', 'run_benchmarks', 'compare_results', 'main']
+
+# excel sheets can't hold more rows than this
+EXCEL_MAX_POINTS = 1048574
+
+# most the median cold import of dta_analysis_funcs and dta_mass_gain_funcs can take (s), they
+# import in about 0.13 s without pandas, scipy and matplotlib
+IMPORT_BUDGET_S = 0.25
+
+def time_call(func, setup=None, repeat=3):
+    '''
+    Times a function a few times.
+
+    Parameters
+    ----------
+    func : function
+        function to time, called with whatever setup gives back
+    setup : function, optional
+        makes the arguments of func before every call (not timed). The default is no arguments.
+    repeat : int, optional
+        Number of times func is called. The default is 3.
+
+    Returns
+    -------
+    times : list
+        seconds each call took
+
+    '''
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+def fresh_run(run):
+    '''
+    Same signals as run but none of the cached things (normalized heat flows, heat flow
+    integral, temperature index) are worked out yet.
+    '''
+    return DTARun(run.time_sec, run.temp, run.weight, run.heatflow, run.heatflow_bl, run.initial_mass,
+                  run.dtype)
+
+def _import_time(modules=('dta_analysis_funcs', 'dta_mass_gain_funcs')):
+    # cold import in a new interpreter, that is what a worker process pays
+    code = ("import time; start = time.perf_counter(); import " + ", ".join(modules)
+            + "; print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.stdout.strip().splitlines()[-1])
+
+def run_benchmarks(points_list=(10000, 100000), runs_list=(1, 10), repeat=3, excel_max_points=100000,
+                   max_memory_mb=4096, seed=0, verbose=True, import_budget=IMPORT_BUDGET_S):
+    '''
+    Times get_dta_data (excel and cached), get_lower_upper_idxs, get_intermetallic_heat,
+    calculate_incremental_cumulative_heat, get_mg_percentage_avg_stdev and get_start_mass_gain
+    on synthetic runs, plus how long the analysis modules take to import.
+
+    Parameters
+    ----------
+    points_list : list, optional
+        Number of points per run to try. The default is (10000, 100000).
+    runs_list : list, optional
+        Number of runs to try for the functions that work on several runs. The default is (1, 10).
+    repeat : int, optional
+        Number of times each function is timed. The default is 3.
+    excel_max_points : int, optional
+        get_dta_data is only timed up to this many points because writing the workbook takes
+        long (never more than excel can hold). The default is 100000.
+    max_memory_mb : int, optional
+        Sizes whose runs would take more memory than this are skipped. The default is 4096.
+    seed : int, optional
+        Seed of the synthetic runs. The default is 0.
+    verbose : Bool, optional
+        Print each result as it is done. The default is True.
+    import_budget : float, optional
+        Most the median cold import can take in seconds, None for no budget. The default is
+        IMPORT_BUDGET_S.
+
+    Returns
+    -------
+    results : list
+        one dict per benchmark and size with 'name', 'points', 'runs', 'best_s', 'mean_s'
+        and 'times_s'. The import result also has 'median_s', 'budget_s' and 'over_budget'
+
+    '''
+    results = []
+    def record(name, points, runs, times):
+        result = {'name': name, 'points': points, 'runs': runs, 'best_s': min(times),
+                  'mean_s': sum(times) / len(times), 'times_s': times}
+        results.append(result)
+        if verbose:
+            print("{:<40} {:>9} points {:>5} runs {:>10.4f} s".format(name, points, runs, result['best_s']))
+
+    record('import', 0, 0, [_import_time() for _ in range(repeat)])
+    import_result = results[-1]
+    import_result['median_s'] = float(np.median(import_result['times_s']))
+    import_result['budget_s'] = import_budget
+    import_result['over_budget'] = import_budget is not None and import_result['median_s'] > import_budget
+
+    for points in points_list:
+        runs_by_count = [num_runs for num_runs in runs_list
+                         if num_runs * points * 8 * 12 <= max_memory_mb * 1024 * 1024]
+        if len(runs_by_count) == 0:
+            continue
+        all_runs, masses = make_synthetic_runs(max(runs_by_count), points, seed=seed)
+        run, mass = all_runs[0], masses[0]
+
+        # single run functions
+        if points <= min(excel_max_points, EXCEL_MAX_POINTS):
+            tmp_dir = tempfile.mkdtemp(prefix='dta_bench_')
+            old_cache_dir = dta_cache.CACHE_DIR
+            try:
+                filename = os.path.join(tmp_dir, 'synthetic.xlsx')
+                write_synthetic_workbook(filename, [run])
+                record('get_dta_data', points, 1,
+                       time_call(lambda: get_dta_data(filename, 'Run1', mass, use_cache=False), repeat=repeat))
+                dta_cache.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+                get_dta_data(filename, 'Run1', mass)
+                record('get_dta_data (cached)', points, 1,
+                       time_call(lambda: get_dta_data(filename, 'Run1', mass), repeat=repeat))
+            finally:
+                dta_cache.CACHE_DIR = old_cache_dir
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        record('get_lower_upper_idxs', points, 1,
+               time_call(lambda temps: get_lower_upper_idxs(temps, 450, 750),
+                         lambda: (run.temp.copy(),), repeat))
+        record('get_intermetallic_heat', points, 1,
+               time_call(lambda fresh: get_intermetallic_heat(fresh, 450, 750, mass),
+                         lambda: (fresh_run(run),), repeat))
+
+        avg_mass_change = None
+        for num_runs in runs_by_count:
+            runs, run_masses = all_runs[:num_runs], masses[:num_runs]
+            record('calculate_incremental_cumulative_heat', points, num_runs,
+                   time_call(lambda fresh: calculate_incremental_cumulative_heat(fresh, 120, 950, 5, run_masses, 'im'),
+                             lambda: ([fresh_run(r) for r in runs],), repeat))
+            record('get_mg_percentage_avg_stdev', points, num_runs,
+                   time_call(lambda: get_mg_percentage_avg_stdev(runs, run_masses), repeat=repeat))
+            avg_mass_change = get_mg_percentage_avg_stdev(runs, run_masses)[0]
+
+        record('get_start_mass_gain', points, 1,
+               time_call(lambda fresh: get_start_mass_gain(avg_mass_change, fresh, 300),
+                         lambda: (fresh_run(run),), repeat))
+
+    return results
+
+def compare_results(results, baseline, tolerance=1.3):
+    '''
+    Compares benchmark results with older ones.
+
+    Parameters
+    ----------
+    results : list
+        From run_benchmarks
+    baseline : list
+        Older results (the 'results' of a saved file)
+    tolerance : float, optional
+        A benchmark is flagged when it got this many times slower. The default is 1.3.
+
+    Returns
+    -------
+    regressions : list
+        (name, points, runs, old best, new best) of the benchmarks that got slower
+
+    '''
+    old = {(r['name'], r['points'], r['runs']): r['best_s'] for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result['name'], result['points'], result['runs'])
+        if key not in old:
+            continue
+        ratio = result['best_s'] / old[key] if old[key] > 0 else float('inf')
+        flag = 'SLOWER' if ratio > tolerance else ''
+        print("{:<40} {:>9} points {:>5} runs {:>10.4f} s -> {:>10.4f} s  x{:.2f} {}".format(
+            key[0], key[1], key[2], old[key], result['best_s'], ratio, flag))
+        if ratio > tolerance:
+            regressions.append(key + (old[key], result['best_s']))
+    return regressions
+
+def _environment():
+    import pandas as pd
+    import scipy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'scipy': scipy.__version__,
+            'machine': platform.platform(), 'cpus': os.cpu_count()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the DTA analysis functions on synthetic runs.")
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000], help="points per run to try")
+    parser.add_argument('--runs', type=int, nargs='+', default=[1, 10], help="numbers of runs to try")
+    parser.add_argument('--repeat', type=int, default=3, help="times each function is timed")
+    parser.add_argument('--excel-max-points', type=int, default=100000, help="largest run get_dta_data is timed on")
+    parser.add_argument('--max-memory-mb', type=int, default=4096, help="skip sizes that need more memory")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic runs")
+    parser.add_argument('-o', '--output', default='dta_benchmarks.json', help="json the results are saved to")
+    parser.add_argument('--compare', default=None, help="json of older results to compare with")
+    parser.add_argument('--tolerance', type=float, default=1.3, help="slowdown that counts as a regression")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_S,
+                        help="most the cold import of the compute functions can take in s, 0 for no budget")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.points, args.runs, args.repeat, args.excel_max_points, args.max_memory_mb,
+                             args.seed, import_budget=args.import_budget or None)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': _environment(), 'results': results}, f, indent=1)
+    print("results written to " + args.output)
+
+    status = 0
+    import_result = next(result for result in results if result['name'] == 'import')
+    if import_result['over_budget']:
+        print("importing dta_analysis_funcs and dta_mass_gain_funcs takes {:.3f} s, the budget is {:.3f} s".format(
+            import_result['median_s'], import_result['budget_s']), file=sys.stderr)
+        status = 1
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(str(len(regressions)) + " benchmarks got slower than x" + str(args.tolerance), file=sys.stderr)
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
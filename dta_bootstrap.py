@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+## confidence intervals for the heats and the average mass gain curve by bootstrapping: the
+## replicates are drawn again with replacement thousands of times and, for the heats, the
+## integration and adjustment bounds are moved around a little each time to see how much the
+## answer depends on where they were put
+##
+##   result = bootstrap_heat(run_data_list, 450, 750, initial_mass_list, 'im', bound_jitter=10,
+##                           adjust_bounds=(100, 200), adjust_jitter=10)
+##   result['lower'], result['upper']                               # 95% interval of the average heat
+##
+## The bounds of every draw are looked up at once on each run and the adjustment of every draw
+## (the minimum of the heat flow in its window) comes out of a sparse table of minimums, so no
+## draw loops over the points of a run. All the random numbers come from one seed in this
+## process, the workers only compute heats, so the result doesn't depend on how many there are.
+import os
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from dta_run import as_dta_run
+from dta_analysis_funcs import align_runs, _window_heats
+from dta_profile import instrumented
+
+__all__ = ['bootstrap_heat', 'bootstrap_mass_gain']
+
+def _window_mins(values, starts, stops):
+    # nanmin of values[start:stop] for many windows at once (every window at least one point):
+    # level k of the table is the minimum of the 2**k points starting at each point, a window is
+    # covered by the two overlapping blocks of the largest level that fits in it
+    table = [np.where(np.isnan(values), np.inf, values)]
+    lengths = stops - starts
+    width = 1
+    while 2 * width <= lengths.max():
+        prev = table[-1]
+        table.append(np.minimum(prev[:-width], prev[width:]))
+        width *= 2
+
+    levels = np.floor(np.log2(lengths)).astype(np.intp)
+    mins = np.empty(len(starts))
+    for k in np.unique(levels):
+        which = levels == k
+        mins[which] = np.minimum(table[k][starts[which]], table[k][stops[which] - (1 << k)])
+    mins[np.isinf(mins)] = np.nan
+    return mins
+
+def _draw_heats(runs, initial_masses, windows, adjust_windows, heat_type, segment):
+    # heat in J/g of each run (rows) for the bounds of each draw (columns)
+    heats = np.empty((len(runs), len(windows)))
+    for i, (run, initial_mass) in enumerate(zip(runs, initial_masses)):
+        idxs = run.temp_index.lookup(windows, segment)
+        initial_idxs, final_idxs = idxs[:, 0], idxs[:, 1]
+        heats[i] = _window_heats(run, initial_idxs, final_idxs, initial_mass, heat_type)
+        if adjust_windows is None or heat_type != 'im':
+            continue
+
+        # perform_adjustment for every draw: the minimum of bls_hf in the adjustment window is
+        # taken off over the time of the integration window
+        adjust_idxs = run.temp_index.lookup(adjust_windows, segment)
+        starts = adjust_idxs[:, 0]
+        stops = np.maximum(adjust_idxs[:, 1], starts + 1)
+        lo, hi = starts.min(), stops.max()
+        mins = _window_mins(np.asarray(run.chunk('bls_hf', lo, hi), dtype=np.float64), starts - lo, stops - lo)
+        last_idxs = np.maximum(final_idxs - 1, initial_idxs)
+        durations = (np.asarray(run.time_sec[last_idxs], dtype=np.float64)
+                     - np.asarray(run.time_sec[initial_idxs], dtype=np.float64))
+        heats[i] -= mins * durations / (initial_mass / 1000) / 1000
+    return heats
+
+def _resample_counts(rng, draws, num_runs):
+    # how many times each run is picked in each draw (drawn with replacement)
+    picks = rng.integers(0, num_runs, size=(draws, num_runs))
+    picks += np.arange(draws)[:, None] * num_runs
+    return np.bincount(picks.ravel(), minlength=draws * num_runs).reshape(draws, num_runs)
+
+def _interval(values, confidence, axis=0):
+    # percentile interval, nan where every draw is nan
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return tuple(np.nanpercentile(values, [tail, 100 - tail], axis=axis))
+
+@instrumented('bootstrap')
+def bootstrap_heat(run_data_list, ltb, utb, initial_mass_list, heat_type, draws=10000, bound_jitter=0.0,
+                   adjust_bounds=None, adjust_jitter=0.0, confidence=0.95, seed=0, workers=1, segment='heating'):
+    '''
+    Bootstrap confidence interval of the average heat of a set of replicates. Each draw picks
+    as many runs as there are with replacement and moves every bound by up to the jitter, the
+    interval is the spread of the average heat over the draws.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list containing the extracted data for each run (DTARun or old list)
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float
+        utb = upper temperature bound (in Celsius)
+    initial_mass_list : list
+        list containing the initial masses of the extracted data for each run
+    heat_type : string
+        Can be either "im", "ox", or "nit" depending on what kind of heat you are
+        trying to calculate.
+    draws : int, optional
+        Number of bootstrap draws. The default is 10000.
+    bound_jitter : float, optional
+        ltb and utb of each draw are moved by a uniform random amount of up to this many
+        degrees (each on its own). The default is 0.
+    adjust_bounds : tuple, optional
+        (ltb, utb) the runs were adjusted with in perform_adjustment. If given, every draw
+        adjusts the runs again in a window moved by up to adjust_jitter degrees ("im" only,
+        the other heats come from the mass). Pass the runs from before the adjustment or
+        adjusted with the same bounds, both give the same heats. The default is none (the runs
+        are used as they are).
+    adjust_jitter : float, optional
+        How far the adjustment bounds are moved, like bound_jitter. The default is 0.
+    confidence : float, optional
+        Confidence level of the interval. The default is 0.95.
+    seed : int, optional
+        Seed of the draws, the same seed gives the same result whatever the number of workers.
+        The default is 0.
+    workers : int, optional
+        Number of processes the runs are split over, None for the number of cores. Only worth
+        it for long runs, the runs have to be sent to the processes. The default is 1.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    result : dict
+        'avg' and 'stdev' of the heats at the bounds given (like avg_stdev_heat), 'lower' and
+        'upper' of the interval, 'bootstrap_stdev' (standard deviation of the average over the
+        draws) and 'draws' (average heat of every draw), all in J/g
+
+    '''
+    runs = [as_dta_run(run_data) for run_data in run_data_list]
+    initial_masses = np.asarray(initial_mass_list, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+
+    # the bounds of every draw, the first row is the bounds given with no jitter
+    windows = np.empty((draws + 1, 2))
+    windows[:] = (ltb, utb)
+    windows[1:] += rng.uniform(-bound_jitter, bound_jitter, size=(draws, 2))
+    adjust_windows = None
+    if adjust_bounds is not None:
+        adjust_windows = np.empty((draws + 1, 2))
+        adjust_windows[:] = adjust_bounds
+        adjust_windows[1:] += rng.uniform(-adjust_jitter, adjust_jitter, size=(draws, 2))
+    counts = _resample_counts(rng, draws, len(runs))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(runs) < 2:
+        heats = _draw_heats(runs, initial_masses, windows, adjust_windows, heat_type, segment)
+    else:
+        groups = np.array_split(np.arange(len(runs)), min(workers, len(runs)))
+        with ProcessPoolExecutor(max_workers=len(groups)) as pool:
+            futures = [pool.submit(_draw_heats, [runs[i] for i in group], initial_masses[group], windows,
+                                   adjust_windows, heat_type, segment) for group in groups]
+            heats = np.concatenate([future.result() for future in futures])
+
+    # the average of each draw is the heats of the runs picked, each as many times as it was picked
+    given = heats[:, 0]
+    draw_avgs = np.einsum('dr,rd->d', counts, heats[:, 1:]) / len(runs)
+    lower, upper = _interval(draw_avgs, confidence)
+
+    return {'avg': float(given.mean()), 'stdev': float(given.std(ddof=1)) if len(runs) > 1 else 0.0,
+            'lower': float(lower), 'upper': float(upper), 'bootstrap_stdev': float(np.nanstd(draw_avgs, ddof=1)),
+            'draws': draw_avgs}
+
+@instrumented('bootstrap')
+def bootstrap_mass_gain(run_data_list, initial_masses_list, draws=2000, confidence=0.95, seed=0, grid=None,
+                        axis='temp', segment='heating', block_size=256):
+    '''
+    Bootstrap confidence band of the average mass gain curve of a set of replicates. The runs
+    are lined up like get_mg_percentage_aligned, each draw picks as many runs as there are with
+    replacement and averages them, the band is the spread of those averages at each point.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list)
+    initial_masses_list : list
+        list of orresponding iniital masses of each run
+    draws : int, optional
+        Number of bootstrap draws. The default is 2000.
+    confidence : float, optional
+        Confidence level of the band. The default is 0.95.
+    seed : int, optional
+        Seed of the draws. The default is 0.
+    grid : array, optional
+        temperatures (or times) to average at, see align_runs. The default covers every run.
+    axis : string, optional
+        "temp", "time" or "index", see align_runs. The default is "temp".
+    segment : string, int or None, optional
+        Part of the temperature program to line up by temperature. The default is "heating".
+    block_size : int, optional
+        Number of grid points done at once (the draws of a block are held in memory). The
+        default is 256.
+
+    Returns
+    -------
+    grid : array
+        temperatures (or times) of the points
+    run_data_mg_avg : array
+        The average mass gain percentage at each point
+    lower, upper : array
+        The bootstrap confidence band of the average mass gain
+
+    '''
+    grid, mass_gain_percentages = align_runs(run_data_list, 'mass_diff', grid, axis, segment)
+    mass_gain_percentages *= 100 / np.asarray(initial_masses_list, dtype=np.float64)[:, None]
+
+    rng = np.random.default_rng(seed)
+    counts = _resample_counts(rng, draws, len(mass_gain_percentages)).astype(np.float64)
+
+    # runs that don't cover a point are left out of the average there, like nanmean
+    covered = ~np.isnan(mass_gain_percentages)
+    values = np.where(covered, mass_gain_percentages, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        run_data_mg_avg = values.sum(axis=0) / covered.sum(axis=0)
+        lower = np.empty(len(grid))
+        upper = np.empty(len(grid))
+        for start in range(0, len(grid), block_size):
+            block = slice(start, start + block_size)
+            draw_avgs = (counts @ values[:, block]) / (counts @ covered[:, block])
+            lower[block], upper[block] = _interval(draw_avgs, confidence)
+
+    return grid, run_data_mg_avg, lower, upper
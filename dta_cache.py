@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+## on-disk cache of parsed excel sheets so a workbook only has to go through openpyxl once
+import os
+import hashlib
+import tempfile
+import warnings
+import numpy as np
+
+from dta_profile import instrumented
+
+__all__ = ['CACHE_DIR', 'CACHE_MAX_BYTES', 'file_digest', 'load_cached_frame', 'save_cached_frame',
+           'evict_cache', 'clear_cache']
+
+# where the cache lives and how big it can get, both can be changed with environment variables
+CACHE_DIR = os.environ.get('DTA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'weihsDTA'))
+CACHE_MAX_BYTES = int(float(os.environ.get('DTA_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+
+# file digests by path, only rehashed when the size or modification time changes
+_digests = {}
+
+def file_digest(filename):
+    '''
+    Gets the sha1 hash of the contents of a file. The hash is remembered for as long as the
+    file size and modification time don't change so repeated calls are cheap.
+
+    Parameters
+    ----------
+    filename : string
+        name of the file
+
+    Returns
+    -------
+    digest : string
+        hex sha1 digest of the file contents
+
+    '''
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _digests[path] = (stamp, digest)
+
+    return digest
+
+def _cache_path(filename, sheetname, version, cache_dir):
+    key = '\0'.join([file_digest(filename), str(sheetname), str(version)])
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+@instrumented('cache')
+def load_cached_frame(filename, sheetname, version, cache_dir=None):
+    '''
+    Looks for a parsed sheet in the cache. Entries are keyed by the contents of the file so
+    editing the workbook automatically misses the old entry.
+
+    Parameters
+    ----------
+    filename : string
+        name of excel file the sheet came from
+    sheetname : string
+        name of excel sheet
+    version : int
+        version of the parser that made the dataframe, bump it when the parsing changes
+    cache_dir : string, optional
+        Cache directory. The default is CACHE_DIR.
+
+    Returns
+    -------
+    data : Pandas DataFrame or None
+        The cached dataframe, None if it isn't in the cache
+
+    '''
+    import pandas as pd
+    
+    path = _cache_path(filename, sheetname, version, cache_dir or CACHE_DIR)
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            columns = npz['columns'].tolist()
+            data = pd.DataFrame({i: npz['col%d' % i] for i in range(len(columns))})
+    except (OSError, KeyError, ValueError):
+        return None
+    data.columns = columns
+
+    # mark as recently used for the LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return data
+
+@instrumented('cache')
+def save_cached_frame(filename, sheetname, version, data, cache_dir=None, max_bytes=None):
+    '''
+    Saves a parsed sheet in the cache and evicts the least recently used entries if the cache
+    got too big. Text columns are stored as text, dataframes with any other kind of column
+    (mixed or python objects) are not cached and a warning says so.
+
+    Parameters
+    ----------
+    filename : string
+        name of excel file the sheet came from
+    sheetname : string
+        name of excel sheet
+    version : int
+        version of the parser that made the dataframe
+    data : Pandas DataFrame
+        dataframe to cache, as it came from the parser
+    cache_dir : string, optional
+        Cache directory. The default is CACHE_DIR.
+    max_bytes : int, optional
+        Size limit of the cache in bytes. The default is CACHE_MAX_BYTES.
+
+    Returns
+    -------
+    saved : bool
+        True if the dataframe was written to the cache
+
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    arrays = {}
+    for i in range(data.shape[1]):
+        arr = data.iloc[:, i].to_numpy()
+        if arr.dtype.kind == 'O' and all(isinstance(value, str) for value in arr):
+            # text columns can be kept without pickling
+            arr = arr.astype(str)
+        if arr.dtype.kind not in 'biufU':
+            warnings.warn("not caching sheet " + repr(sheetname) + " of " + str(filename) + ", column "
+                          + repr(data.columns[i]) + " holds " + str(arr.dtype) + " values")
+            return False
+        arrays['col%d' % i] = arr
+    arrays['columns'] = np.array([str(col) for col in data.columns])
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(filename, sheetname, version, cache_dir)
+
+        # write to a temporary file first so other processes never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException as err:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        if isinstance(err, OSError):
+            return False
+        raise
+
+    evict_cache(cache_dir, max_bytes)
+
+    return True
+
+def evict_cache(cache_dir=None, max_bytes=None):
+    '''
+    Deletes the least recently used entries until the cache is under the size limit.
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Cache directory. The default is CACHE_DIR.
+    max_bytes : int, optional
+        Size limit of the cache in bytes. The default is CACHE_MAX_BYTES.
+
+    Returns
+    -------
+    removed : int
+        number of entries deleted
+
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    return removed
+
+def clear_cache(cache_dir=None):
+    '''
+    Deletes every entry in the cache.
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Cache directory. The default is CACHE_DIR.
+
+    Returns
+    -------
+    removed : int
+        number of entries deleted
+
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return 0
+    return evict_cache(cache_dir, max_bytes=-1)
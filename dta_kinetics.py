@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+## activation energies from runs of the same chemistry at different heating rates
+##
+##   run_data_list = [perform_adjustment(run_data, 100, 200) for run_data in run_data_list]
+##   kissinger(run_data_list, 450, 750)                             # one Ea from the peak temperatures
+##   isoconversional(run_data_list, 450, 750, method='friedman')    # Ea at every conversion level
+##
+## The conversion alpha of a run goes from 0 to 1 over the window, it is the heat released so far
+## (from the cumulative integral of the baseline subtracted heat flow) over the heat of the whole
+## window. The temperature each run reaches every conversion level at is interpolated, then the
+## straight line of every level is fit at once.
+import numpy as np
+
+from dta_run import as_dta_run
+from dta_analysis_funcs import get_lower_upper_idxs
+from dta_profile import instrumented
+
+__all__ = ['GAS_CONSTANT', 'DEFAULT_ALPHAS', 'conversion_curve', 'conversion_temperatures', 'kissinger',
+           'isoconversional']
+
+# J/(mol K)
+GAS_CONSTANT = 8.314462618
+
+# conversion levels isoconversional looks at by default
+DEFAULT_ALPHAS = np.linspace(0.05, 0.95, 181)
+
+def _heating_rate(temps, time_sec):
+    # slope of the temperature over the window in C/min (least squares, nan points left out)
+    keep = ~(np.isnan(temps) | np.isnan(time_sec))
+    if np.count_nonzero(keep) < 2:
+        return np.nan
+    slope = np.polyfit(time_sec[keep], temps[keep], 1)[0]
+    return float(slope * 60)
+
+@instrumented('kinetics')
+def conversion_curve(run_data, ltb, utb, segment='heating'):
+    '''
+    Conversion (fraction of the heat of the window released so far) of a run over a window.
+
+    Parameters
+    ----------
+    run_data : DTARun or list
+        Result from get_dta_data (adjust it first with perform_adjustment)
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float
+        utb = upper temperature bound (in Celsius)
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    curve : dict
+        'temp' (C), 'time_sec', 'alpha' (0 at the first point, 1 at the last, nan after a nan
+        in the heat flow), 'rate' (d alpha / dt in 1/s) of every point of the window and
+        'heating_rate' of the window in C/min
+
+    '''
+    run = as_dta_run(run_data)
+    initial_idx, final_idx = get_lower_upper_idxs(run, ltb, utb, segment)
+    final_idx = max(final_idx, initial_idx + 1)
+
+    # heat released from the start of the window up to each point, the same integral as
+    # get_intermetallic_heat so alpha is 1 exactly at the heat it gives
+    idxs = np.arange(initial_idx, final_idx)
+    released = np.asarray(run.bls_hf_integral(initial_idx, idxs + 1), dtype=np.float64)
+    total = released[-1]
+
+    temps = np.asarray(run.chunk('temp', initial_idx, final_idx), dtype=np.float64)
+    time_sec = np.asarray(run.time_sec[initial_idx:final_idx], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        alpha = released / total
+        rate = np.asarray(run.chunk('bls_hf', initial_idx, final_idx), dtype=np.float64) / total
+
+    return {'temp': temps, 'time_sec': time_sec, 'alpha': alpha, 'rate': rate,
+            'heating_rate': _heating_rate(temps, time_sec)}
+
+@instrumented('kinetics')
+def conversion_temperatures(run_data_list, ltb, utb, alphas=DEFAULT_ALPHAS, segment='heating'):
+    '''
+    Temperature (and conversion rate) every run reaches each conversion level at.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun or old list), one per heating rate
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float
+        utb = upper temperature bound (in Celsius)
+    alphas : array, optional
+        conversion levels between 0 and 1. The default is DEFAULT_ALPHAS (0.05 to 0.95 in 0.005
+        steps).
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    conversions : dict
+        'temp' (C) and 'rate' (d alpha / dt in 1/s) with shape (number of runs, number of
+        levels), 'heating_rate' of each run in C/min
+
+    '''
+    alphas = np.asarray(alphas, dtype=np.float64)
+    temps = np.full((len(run_data_list), len(alphas)), np.nan)
+    rates = np.full((len(run_data_list), len(alphas)), np.nan)
+    heating_rates = np.full(len(run_data_list), np.nan)
+
+    for i, run_data in enumerate(run_data_list):
+        curve = conversion_curve(run_data, ltb, utb, segment)
+        heating_rates[i] = curve['heating_rate']
+        alpha = curve['alpha']
+        keep = ~(np.isnan(alpha) | np.isnan(curve['temp']))
+        if np.count_nonzero(keep) < 2:
+            continue
+
+        # the noise makes alpha go back and forth a little, a level is reached the first time
+        # alpha gets to it so the curve is made to never go down
+        alpha = np.maximum.accumulate(alpha[keep])
+        positions = np.arange(len(alpha))
+        reached = np.interp(alphas, alpha, positions)
+        temps[i] = np.interp(reached, positions, curve['temp'][keep])
+        rates[i] = np.interp(reached, positions, curve['rate'][keep])
+
+    return {'temp': temps, 'rate': rates, 'heating_rate': heating_rates}
+
+def _linear_fits(x, y):
+    # least squares line of every row of y against the same row of x at once, with the
+    # standard error of the slope and r squared
+    n = x.shape[-1]
+    x_mean = x.mean(axis=-1, keepdims=True)
+    y_mean = y.mean(axis=-1, keepdims=True)
+    dx = x - x_mean
+    dy = y - y_mean
+    sxx = np.einsum('...i,...i->...', dx, dx)
+    sxy = np.einsum('...i,...i->...', dx, dy)
+    syy = np.einsum('...i,...i->...', dy, dy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = sxy / sxx
+        intercept = y_mean[..., 0] - slope * x_mean[..., 0]
+        residual = np.maximum(syy - slope * sxy, 0)
+        slope_stderr = np.sqrt(residual / (n - 2) / sxx) if n > 2 else np.full_like(slope, np.nan)
+        r2 = 1 - residual / syy
+    return slope, intercept, slope_stderr, r2
+
+def _get_heating_rates(heating_rates, estimated):
+    if heating_rates is None:
+        return estimated
+    heating_rates = np.asarray(heating_rates, dtype=np.float64)
+    if heating_rates.shape != estimated.shape:
+        raise ValueError("need one heating rate per run, got " + str(len(heating_rates))
+                         + " for " + str(len(estimated)) + " runs")
+    return heating_rates
+
+@instrumented('kinetics')
+def kissinger(run_data_list, ltb, utb, heating_rates=None, segment='heating'):
+    '''
+    Activation energy from how the peak temperature moves with the heating rate:
+    ln(beta / Tp^2) = ln(A R / Ea) - Ea / (R Tp).
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun or old list), one per heating rate
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius) of the window the peak is in
+    utb : int or float
+        utb = upper temperature bound (in Celsius) of the window the peak is in
+    heating_rates : list, optional
+        heating rate of each run in C/min. The default is the slope of the temperature over
+        the window of each run.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    result : dict
+        'Ea_kJ_mol', 'Ea_stderr_kJ_mol', 'ln_A' (A in 1/s), 'r2', and the 'peak_temp' (C) and
+        'heating_rate' (C/min) of each run
+
+    '''
+    peak_temps = np.full(len(run_data_list), np.nan)
+    estimated = np.full(len(run_data_list), np.nan)
+    for i, run_data in enumerate(run_data_list):
+        curve = conversion_curve(run_data, ltb, utb, segment)
+        estimated[i] = curve['heating_rate']
+        if not np.isnan(curve['rate']).all():
+            peak_temps[i] = curve['temp'][np.nanargmax(curve['rate'])]
+    heating_rates = _get_heating_rates(heating_rates, estimated)
+
+    peak_K = peak_temps + 273.15
+    slope, intercept, slope_stderr, r2 = _linear_fits(1 / peak_K, np.log(heating_rates / 60 / peak_K ** 2))
+    ea = -slope * GAS_CONSTANT
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ln_a = intercept + np.log(ea / GAS_CONSTANT)
+
+    return {'Ea_kJ_mol': ea / 1000, 'Ea_stderr_kJ_mol': slope_stderr * GAS_CONSTANT / 1000, 'ln_A': ln_a,
+            'r2': r2, 'peak_temp': peak_temps, 'heating_rate': heating_rates}
+
+@instrumented('kinetics')
+def isoconversional(run_data_list, ltb, utb, alphas=DEFAULT_ALPHAS, method='friedman', heating_rates=None,
+                    segment='heating'):
+    '''
+    Activation energy at every conversion level from runs at different heating rates, all the
+    levels are fit in one go.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun or old list), one per heating rate
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float
+        utb = upper temperature bound (in Celsius)
+    alphas : array, optional
+        conversion levels between 0 and 1. The default is DEFAULT_ALPHAS.
+    method : string, optional
+        "friedman" ln(d alpha/dt) against 1/T (differential, uses the rates so it is noisier),
+        "ozawa" (Flynn-Wall-Ozawa) ln(beta) against 1/T with Doyle's 1.052, or "kas"
+        (Kissinger-Akahira-Sunose) ln(beta / T^2) against 1/T. The default is "friedman".
+    heating_rates : list, optional
+        heating rate of each run in C/min. The default is the slope of the temperature over
+        the window of each run.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+
+    Returns
+    -------
+    result : Pandas DataFrame
+        one row per level: alpha, temp_mean (C, over the runs), Ea_kJ_mol, Ea_stderr_kJ_mol,
+        intercept (ln(A f(alpha)) with A in 1/s for friedman, the intercept of the line for
+        the others) and r2
+
+    '''
+    import pandas as pd
+
+    if method not in ('friedman', 'ozawa', 'kas'):
+        raise ValueError("method should be 'friedman', 'ozawa' or 'kas', got " + repr(method))
+
+    alphas = np.asarray(alphas, dtype=np.float64)
+    conversions = conversion_temperatures(run_data_list, ltb, utb, alphas, segment)
+    heating_rates = _get_heating_rates(heating_rates, conversions['heating_rate'])
+
+    # one row per level, one column per run
+    inv_temps = 1 / (conversions['temp'].T + 273.15)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'friedman':
+            y = np.log(conversions['rate'].T)
+        elif method == 'ozawa':
+            y = np.broadcast_to(np.log(heating_rates / 60), inv_temps.shape)
+        else:
+            y = np.log(heating_rates / 60 * inv_temps ** 2)
+    slope, intercept, slope_stderr, r2 = _linear_fits(inv_temps, y)
+
+    factor = 1.052 if method == 'ozawa' else 1.0
+    return pd.DataFrame({'alpha': alphas, 'temp_mean': conversions['temp'].mean(axis=0),
+                         'Ea_kJ_mol': -slope * GAS_CONSTANT / factor / 1000,
+                         'Ea_stderr_kJ_mol': slope_stderr * GAS_CONSTANT / factor / 1000,
+                         'intercept': intercept, 'r2': r2})
@@ -5,20 +5,18 @@ Created on Fri May 26 14:17:30 2023
 @author: Mikey
 """
 ## dta analysis functions
-import os
-import sys
-from sys import path
-import pandas as pd
-import scipy
-from scipy import integrate
-from scipy.signal import savgol_filter
-import matplotlib.pyplot as plt
-import statistics
+## pandas, scipy and matplotlib are only imported by the functions that need them
 import numpy as np
 
-from molar_mass_calculator import *
+from dta_run import DTARun, as_dta_run
+from dta_analysis_funcs import align_runs, avg_stdev_aligned
+from dta_profile import instrumented
+
+__all__ = ['get_mg_percentage_avg_stdev', 'get_mg_percentage_aligned', 'MassGainOnsetDetector',
+           'get_start_mass_gain', 'adjust_avg_mass_gain', 'correct_mass_gain', 'modify_run_mass_diff']
 
 #%%
+@instrumented('average')
 def get_mg_percentage_avg_stdev(run_data_list,initial_masses_list):
     '''
     This function takes in a list of run data (from get_dta_data) and their corresponding
@@ -28,7 +26,7 @@ def get_mg_percentage_avg_stdev(run_data_list,initial_masses_list):
     Parameters
     ----------
     run_data_list : list
-        list of run data (from get_dta_data)
+        list of run data (DTARun from get_dta_data or the old list)
     initial_masses_list : list
         list of orresponding iniital masses of each run
 
@@ -41,29 +39,226 @@ def get_mg_percentage_avg_stdev(run_data_list,initial_masses_list):
 
     '''
     
-    mass_gain_percentages = []
-    for i in range(len(run_data_list)):
-        run_data_mg = 100 * (run_data_list[i][0]['Mass Diff Scan1'] / initial_masses_list[i])
-        mass_gain_percentages.append(run_data_mg)
-        
-    run_data_mg_df = pd.DataFrame(mass_gain_percentages).T
-    run_data_mg_avg = run_data_mg_df.mean(axis=1)
-    run_data_mg_stdev = run_data_mg_df.std(axis=1)
+    import pandas as pd
+    
+    # point by point like the runs were columns of a dataframe, shorter runs are nan padded. 
+    # Done a block of points at a time so long (memory mapped) runs don't need a copy in memory
+    mass_diffs = [as_dta_run(run_data).mass_diff for run_data in run_data_list]
+    scales = 100 / np.asarray(initial_masses_list, dtype=np.float64)
+    run_data_mg_avg, run_data_mg_stdev, _, _ = avg_stdev_aligned(mass_diffs, confidence=None, scales=scales)
         
-    return run_data_mg_avg, run_data_mg_stdev
+    return pd.Series(run_data_mg_avg, copy=False), pd.Series(run_data_mg_stdev, copy=False)
+
+@instrumented('average')
+def get_mg_percentage_aligned(run_data_list,initial_masses_list,grid=None,axis='temp',segment='heating',confidence=0.95):
+    '''
+    Same as get_mg_percentage_avg_stdev but the runs are lined up by temperature (or time)
+    first, so replicates with different lengths or sampling are averaged at the same
+    temperatures instead of the same row number.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list)
+    initial_masses_list : list
+        list of orresponding iniital masses of each run
+    grid : array, optional
+        temperatures (or times) to average at, see align_runs. The default covers every run.
+    axis : string, optional
+        "temp", "time" or "index", see align_runs. The default is "temp".
+    segment : string, int or None, optional
+        Part of the temperature program to line up by temperature. The default is "heating".
+    confidence : float, optional
+        Confidence level of the band around the average. The default is 0.95.
+
+    Returns
+    -------
+    grid : array
+        temperatures (or times) of the points
+    run_data_mg_avg : array
+        The average mass gain percentage at each point
+    run_data_mg_stdev : array
+        The standard deviation for the mass gain at each point
+    lower, upper : array
+        The confidence band of the average mass gain
+
+    '''
+    
+    grid, mass_gain_percentages = align_runs(run_data_list, 'mass_diff', grid, axis, segment)
+    mass_gain_percentages *= 100 / np.asarray(initial_masses_list, dtype=np.float64)[:, None]
+    
+    run_data_mg_avg, run_data_mg_stdev, lower, upper = avg_stdev_aligned(mass_gain_percentages, confidence)
+    
+    return grid, run_data_mg_avg, run_data_mg_stdev, lower, upper
+
+class MassGainOnsetDetector:
+    '''
+    Finds the start of mass gain while the data is still coming in. The mass change is fed in
+    blocks (or one point at a time) and the smoothed difference between points is worked out
+    only for the new points, with the same savgol filter get_start_mass_gain uses. The smoothed
+    value at a point needs the smooth_value // 2 points after it, so the onset is found that
+    many points after it happens. Only the last smooth_value points are kept, so following a
+    long run costs the same for every point.
+
+    Parameters
+    ----------
+    threshold : float, optional
+        The threshold that must be crossed to find the start of mass gain. The default is 1e-4.
+    smooth_value : int (odd), optional
+        Window of the savgol filter that smooths the difference between points. The default is 51.
+    cutoff_temp : float, optional
+        Points up to the one closest to this temperature (the first time the run gets there)
+        are ignored. Needs the temperatures to be given to update.
+    cutoff_idx : int, optional
+        Points up to this index are ignored, use it instead of cutoff_temp when the index is
+        already known.
+
+    '''
+
+    def __init__(self, threshold=1e-4, smooth_value=51, cutoff_temp=None, cutoff_idx=None):
+        if smooth_value % 2 == 0 or smooth_value <= 3:
+            raise ValueError("smooth_value must be odd and bigger than 3, got " + str(smooth_value))
+        self.threshold = threshold
+        self.smooth_value = smooth_value
+        self.cutoff_temp = cutoff_temp
+        self.cutoff_idx = cutoff_idx
+        self.onset_idx = None
+        self.onset_temp = None
+
+        self.points = 0
+        self._half = smooth_value // 2
+        from scipy.signal import savgol_coeffs
+        self._coeffs = savgol_coeffs(smooth_value, 3, use='dot')
+        self._last_mass = None
+        self._last_temp = None
+        self._diffs = np.zeros(0)       # last smooth_value differences
+        self._temps = np.zeros(0)       # and their temperatures
+        self._next = 0                  # first point without a smoothed value yet
+
+    def update(self, mass_change, temperatures=None):
+        '''
+        Adds new points.
+
+        Parameters
+        ----------
+        mass_change : array or float
+            the new points of the (average) mass change
+        temperatures : array or float, optional
+            temperatures of the new points, needed for cutoff_temp and onset_temp
+
+        Returns
+        -------
+        onset_idx : int or None
+            Index where the mass gain begins, None if it hasn't been found yet
+
+        '''
+        if self.onset_idx is not None:
+            return self.onset_idx
+
+        mass_change = np.atleast_1d(np.asarray(mass_change, dtype=np.float64))
+        rows = len(mass_change)
+        if rows == 0:
+            return None
+        if temperatures is None:
+            temperatures = np.full(rows, np.nan)
+        temperatures = np.atleast_1d(np.asarray(temperatures, dtype=np.float64))
+
+        # difference from the previous point, the first one has no previous point so it is 0
+        previous = mass_change[0] if self._last_mass is None else self._last_mass
+        diffs = np.diff(mass_change, prepend=previous)
+        diffs[np.isnan(diffs)] = 0
+        self._last_mass = mass_change[-1]
+
+        if self.cutoff_idx is None and self.cutoff_temp is not None:
+            self._find_cutoff(temperatures)
+        self._last_temp = temperatures[-1]
+
+        # the kept points followed by the new ones, buffer[0] is point `first`
+        first = self.points - len(self._diffs)
+        buffer = np.concatenate((self._diffs, diffs))
+        buffer_temps = np.concatenate((self._temps, temperatures))
+        self.points += rows
 
+        if self.points >= self.smooth_value:
+            if self._next == 0:
+                # the first points don't have a full window around them, savgol_filter uses the
+                # polynomial fitted to the first window for them
+                self._check(0, self._fit_edge(buffer[:self.smooth_value], 0), buffer_temps)
+                self._next = self._half
+            stop = self.points - self._half
+            if self.onset_idx is None and stop > self._next:
+                window = buffer[self._next - self._half - first:stop + self._half - first]
+                self._check(self._next - first, np.correlate(window, self._coeffs, 'valid'), buffer_temps)
+            self._next = stop
+
+        self._diffs = buffer[-self.smooth_value:]
+        self._temps = buffer_temps[-self.smooth_value:]
+
+        return self.onset_idx
+
+    def finish(self):
+        '''
+        Call when there are no more points. The last points don't have a full window after
+        them, savgol_filter uses the polynomial fitted to the last window for them.
+
+        Returns
+        -------
+        onset_idx : int or None
+            Index where the mass gain begins, None if it was never found
+
+        '''
+        if self.onset_idx is None and self.points >= self.smooth_value and self._next < self.points:
+            first = self.points - len(self._diffs)
+            self._check(self._next - first, self._fit_edge(self._diffs, self._next - first), self._temps)
+            self._next = self.points
+        return self.onset_idx
+
+    def _fit_edge(self, window, start):
+        # values of the cubic fitted to the window at the positions start...start + half - 1
+        poly_coeffs = np.polyfit(np.arange(self.smooth_value), window, 3)
+        return np.polyval(poly_coeffs, np.arange(start, start + self._half))
+
+    def _check(self, offset, smoothed, temps):
+        # smoothed[0] is the value of point first + offset, temps lines up with the buffer
+        first = self.points - len(temps)
+        idx = np.arange(first + offset, first + offset + len(smoothed))
+        cutoff_idx = self.cutoff_idx
+        if cutoff_idx is None:
+            if self.cutoff_temp is not None:
+                # the run hasn't got to the cutoff yet
+                return
+            cutoff_idx = -1
+        crossed = np.flatnonzero((smoothed > self.threshold) & (idx > cutoff_idx))
+        if len(crossed) > 0:
+            self.onset_idx = int(idx[crossed[0]])
+            self.onset_temp = float(temps[offset + crossed[0]])
+
+    def _find_cutoff(self, temperatures):
+        # point closest to the cutoff temperature the first time the run gets there
+        above = np.flatnonzero(temperatures >= self.cutoff_temp)
+        if len(above) == 0:
+            return
+        j = above[0]
+        previous = temperatures[j - 1] if j > 0 else self._last_temp
+        if previous is not None and abs(previous - self.cutoff_temp) <= abs(temperatures[j] - self.cutoff_temp):
+            self.cutoff_idx = self.points + j - 1
+        else:
+            self.cutoff_idx = self.points + j
+
+@instrumented('smooth')
 def get_start_mass_gain(avg_mass_change,aro2_run_data,cutoff_temp,threshold=1e-4,smooth_value=51,plot=False):
     '''
     Using the averaged data, create a smoothed curve that approximates the average, and find the difference in 
     mass gain between the current and previous mass. Then a threshold value is used to determine when the difference 
     exceeds an appropriate value of mass gain difference. Temperatures below the cutoff temperature are not 
-    considered.Find the index and temperature where this occurs.
+    considered.Find the index and temperature where this occurs. Runs MassGainOnsetDetector over the
+    whole curve at once.
 
     Parameters
     ----------
     avg_mass_change : Pandas Series
         From get_mg_percentage_avg_stdev, a series of the average mass at each point
-    aro2_run_data : list
+    aro2_run_data : DTARun or list
         Use a single trial's run data
     cutoff_temp : float
         Everything below this temperature is ignored when finding the start of mass gain (I would make it at least > 50C)
@@ -84,35 +279,43 @@ def get_start_mass_gain(avg_mass_change,aro2_run_data,cutoff_temp,threshold=1e-4
 
     '''
     
-    avg_mass_change_diff = avg_mass_change.diff().fillna(0)
-    avg_mass_change_diff_smooth = savgol_filter(avg_mass_change_diff, smooth_value, 3)
+    run = as_dta_run(aro2_run_data)
+    temperatures = run.temp
+    avg_mass_change = np.asarray(avg_mass_change, dtype=np.float64)
+
+    # cutoff beginning data
+    cutoff_idx = run.temp_index.lookup(cutoff_temp)
+    detector = MassGainOnsetDetector(threshold, smooth_value, cutoff_idx=cutoff_idx)
+    
+    # fed a block at a time so a long run doesn't need smoothing arrays the size of the run,
+    # and nothing after the onset is looked at
+    block_size = 1 << 20
+    for start in range(0, len(avg_mass_change), block_size):
+        if detector.update(avg_mass_change[start:start + block_size]) is not None:
+            break
+    initial_idx = detector.finish()
+    if initial_idx is None:
+        raise ValueError("the mass gain never crossed the threshold above " + str(cutoff_temp) + " C")
+    temp = float(temperatures[initial_idx])
     
     if plot != False:
         # plot
+        import pandas as pd
+        import matplotlib.pyplot as plt
+        from scipy.signal import savgol_filter
+        from dta_plot import decimate
+        avg_mass_change_diff = pd.Series(avg_mass_change).diff().fillna(0)
+        avg_mass_change_diff_smooth = savgol_filter(avg_mass_change_diff, smooth_value, 3)
         ax = plt.subplot(111)
     
-        ax.plot(aro2_run_data[1],avg_mass_change_diff,color="black",label="raw")
-        ax.plot(aro2_run_data[1],avg_mass_change_diff_smooth,color="lightgreen",label="smooth")
-    
-    avg_mass_change_diff_smooth = pd.Series(avg_mass_change_diff_smooth)
-    # cutoff beginning data
-    cutoff_idx = aro2_run_data[1].sub(cutoff_temp).abs().idxmin()
-    #cutoff_idx = aro2_run_data[1][aro2_run_data[1].gt(cutoff_temp)].index[0]
-    avg_mass_change_diff_smooth = avg_mass_change_diff_smooth[avg_mass_change_diff_smooth.index > cutoff_idx] 
-    #print(avg_mass_change_diff_smooth.size)
-
-
-    # find temperature at which that occurs
-    #initial_idx = avg_mass_change_diff_smooth.sub(threshold).abs().idxmin() #
-    initial_idx = avg_mass_change_diff_smooth[avg_mass_change_diff_smooth.gt(threshold)].index[0]
-    #print(initial_idx)
-    temp = aro2_run_data[1][initial_idx]
-    
-    if plot != False:
+        # thinned out to the points that show, long runs draw as fast as short ones
+        ax.plot(*decimate(temperatures,avg_mass_change_diff),color="black",label="raw")
+        ax.plot(*decimate(temperatures,avg_mass_change_diff_smooth),color="lightgreen",label="smooth")
         ax.scatter(temp,avg_mass_change_diff[initial_idx],color="r",marker="*",s=100)
     
     return initial_idx, temp
     
+@instrumented('adjust')
 def adjust_avg_mass_gain(run_mg_avg,mg_start_idx):
     '''
     Finds the mass where the mass rise begins and makes that the new initial mass. Then it subtracts
@@ -132,25 +335,141 @@ def adjust_avg_mass_gain(run_mg_avg,mg_start_idx):
 
     '''
     
-    # make a new column that has "true" mass gain differential
-    run_avg_new_im = run_mg_avg[mg_start_idx]
+    import pandas as pd
+    
+    # the index is a label of the series, work on a copy of the values at its position
+    run_mg_avg = pd.Series(run_mg_avg)
+    position = run_mg_avg.index.get_loc(mg_start_idx)
+    run_mg_avg_adj = run_mg_avg.to_numpy(dtype=np.float64, copy=True)
+    _correct_mass_arrays([run_mg_avg_adj], [None], [position], [None])
+    
+    return pd.Series(run_mg_avg_adj, index=run_mg_avg.index, name=run_mg_avg.name, copy=False)
+
+def _correct_mass_arrays(mass_diffs, true_masses, mg_start_idxs, initial_masses, rebase=True, out=None):
+    # rebases each mass change on its value at the start of mass gain, sets everything before
+    # it to 0 and the true mass before it to the initial mass (after it the true mass is the
+    # initial mass plus the rebased mass change, so the two stay consistent). Every point is
+    # read and written once, into out (mass diffs, true masses) or into the arrays themselves
+    out_diffs, out_true_masses = out if out is not None else (mass_diffs, true_masses)
+    for mass_diff, true_mass, out_diff, out_true_mass, idx, mass in zip(
+            mass_diffs, true_masses, out_diffs, out_true_masses, mg_start_idxs, initial_masses):
+        out_diff[:idx] = 0
+        if rebase:
+            np.subtract(mass_diff[idx:], mass_diff[idx], out=out_diff[idx:])
+        elif out_diff is not mass_diff:
+            out_diff[idx:] = mass_diff[idx:]
+        if true_mass is not None:
+            out_true_mass[:idx] = mass
+            if rebase:
+                np.add(out_diff[idx:], mass, out=out_true_mass[idx:], casting='unsafe')
+            elif out_true_mass is not true_mass:
+                out_true_mass[idx:] = true_mass[idx:]
+
+def _is_single_run(run_data):
+    # a DTARun, or the list of the older get_dta_data: [data, temp, time_sec, bls_hf, true_mass,
+    # norm_hf, norm_hf_bl, norm_hf_bls] with the dataframe of the sheet first
+    if isinstance(run_data, DTARun):
+        return True
+    if not isinstance(run_data, list) or len(run_data) != 8:
+        return False
+    import pandas as pd
+    return isinstance(run_data[0], pd.DataFrame)
+
+@instrumented('adjust')
+def correct_mass_gain(run_data_list,mg_start_idxs,initial_masses,rebase=True,inplace=False):
+    '''
+    Corrects the mass gain of a batch of runs in one go: the mass change of each run is shifted
+    so it is 0 where the mass gain begins, every point before that is set to 0 and the true
+    mass is set to the true initial mass before it (and to the true initial mass plus the
+    shifted mass change after it). Without inplace the corrected signals of
+    all the runs are written into one new block of memory and the runs get views of it, the
+    original runs aren't touched.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list), or a single run
+    mg_start_idxs : int or list
+        From get_start_mass_gain, the index where the mass gain begins in each run (one int is used for every run)
+    initial_masses : float or list
+        true initial starting mass of each run (one float is used for every run)
+    rebase : Bool, optional
+        Shift the mass change so it starts at 0 at the start of mass gain. The default is True.
+    inplace : Bool, optional
+        Write into the arrays of the runs themselves (shallow copies of a run share them) and
+        give back the same runs. The default is False.
+
+    Returns
+    -------
+    run_data_list : list
+        the corrected runs, or the corrected run if a single run was passed in
+
+    '''
+    
+    single = _is_single_run(run_data_list)
+    run_list = [run_data_list] if single else list(run_data_list)
+    if len(run_list) == 0:
+        return run_list
+    
+    runs = [as_dta_run(run_data) for run_data in run_list]
+    mg_start_idxs = np.broadcast_to(np.asarray(mg_start_idxs, dtype=np.intp), (len(runs),))
+    initial_masses = np.broadcast_to(np.asarray(initial_masses, dtype=np.float64), (len(runs),))
+    lengths = [len(run.mass_diff) for run in runs]
+    for i, (idx, length) in enumerate(zip(mg_start_idxs, lengths)):
+        if not 0 <= idx < length:
+            raise IndexError("mass gain start index " + str(idx) + " is outside run " + str(i)
+                             + " (" + str(length) + " points)")
     
-    # adjust the curve by subtracting by that amount for each point and then plot the avg
-    run_mg_avg_adj = run_mg_avg - run_avg_new_im 
+    if inplace:
+        # the arrays of an old list can be read only views of its dataframe
+        for run in runs:
+            if not run.mass_diff.flags.writeable:
+                run.mass_diff = run.mass_diff.copy()
+            if not run.true_mass.flags.writeable:
+                run.true_mass = run.true_mass.copy()
+        mass_diffs = [run.mass_diff for run in runs]
+        true_masses = [run.true_mass for run in runs]
+        _correct_mass_arrays(mass_diffs, true_masses, mg_start_idxs, initial_masses, rebase)
+    else:
+        # one block for the mass diffs of every run and one for the true masses
+        dtype = np.result_type(*(run.dtype for run in runs))
+        bounds = np.cumsum(lengths)[:-1]
+        out = (np.split(np.empty(sum(lengths), dtype=dtype), bounds),
+               np.split(np.empty(sum(lengths), dtype=dtype), bounds))
+        _correct_mass_arrays([run.mass_diff for run in runs], [run.true_mass for run in runs],
+                             mg_start_idxs, initial_masses, rebase, out)
+        mass_diffs, true_masses = out
     
-    # replace everything below with 0s
-    run_mg_avg_adj.loc[0:mg_start_idx] = 0
+    corrected = []
+    for run_data, run, mass_diff, true_mass in zip(run_list, runs, mass_diffs, true_masses):
+        if isinstance(run_data, DTARun):
+            if not inplace:
+                run = run.copy()
+                run.mass_diff = run._signal(mass_diff)
+                run.true_mass = run._signal(true_mass)
+            corrected.append(run)
+        else:
+            # old list, whole columns are replaced so nothing is written through a view
+            if not inplace:
+                run_data = list(run_data)
+                run_data[0] = run_data[0].copy()
+            run_data[0]['Mass Diff Scan1'] = mass_diff
+            run_data[0]['True Mass Scan1'] = true_mass
+            run_data[4] = run_data[0]['True Mass Scan1']
+            corrected.append(run_data)
     
-    return run_mg_avg_adj
+    return corrected[0] if single else corrected
 
+@instrumented('adjust')
 def modify_run_mass_diff(aro2_run_data,mg_start_idx,im):
     '''
     Modifies the original extracted dataframe and sets the mass below the starting index to 0
-    and changes the True Mass column to reflect the true starting mass
+    and changes the True Mass column to reflect the true starting mass. The mass change is
+    shifted so it is 0 at the starting index (see correct_mass_gain to do many runs at once).
 
     Parameters
     ----------
-    aro2_run_data : list
+    aro2_run_data : DTARun or list
         From get_dta_data
     mg_start_idx : int
         From get_start_mass_gain, the index of the run_mg_avg pandas series where mass gain begins
@@ -159,15 +478,9 @@ def modify_run_mass_diff(aro2_run_data,mg_start_idx,im):
 
     Returns
     -------
-    aro2_run_data : list
-        Returns the modified dataframe
+    aro2_run_data : DTARun or list
+        Returns the modified run (the same object that was passed in)
 
     '''
     
-    aro2_run_data[0]['Mass Diff Scan1'] - aro2_run_data[0]['Mass Diff Scan1'].loc[mg_start_idx] 
-    aro2_run_data[0]['Mass Diff Scan1'][0:mg_start_idx] = 0
-    
-    # also need to change the "true mass column to make it the original mass
-    aro2_run_data[0]['True Mass Scan1'][0:mg_start_idx] = im
-    
-    return aro2_run_data
+    return correct_mass_gain(aro2_run_data, mg_start_idx, im, inplace=True)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+## finds the exotherms of runs so the integration windows don't have to be picked by eye
+##
+##   peaks = peak_table(run_data_list, initial_masses_list, run_ids=sheetnames)
+##   peaks.groupby('peak')[['onset_temp', 'peak_temp', 'area_J_g']].agg(['mean', 'std'])
+##
+## The peaks are found on the baseline subtracted heat flow of the heating segment, the onset
+## and end are where the heat flow drops back to the base of the peak and the area comes out
+## of the cumulative integral of the run (the same one get_intermetallic_heat uses). peak_table
+## looks for the peaks of the whole batch in one pass over the runs put end to end.
+import numpy as np
+
+from dta_run import as_dta_run
+from dta_profile import instrumented
+
+__all__ = ['PEAK_COLUMNS', 'find_exotherms', 'peak_table']
+
+PEAK_COLUMNS = ['run_id', 'peak', 'onset_temp', 'extrapolated_onset_temp', 'peak_temp', 'end_temp',
+                'peak_heatflow', 'prominence', 'area_J_g', 'onset_idx', 'peak_idx', 'end_idx']
+
+def _noise_level(values):
+    # standard deviation of the noise from the differences between points, robust to the peaks
+    diffs = np.diff(values)
+    diffs = diffs[~np.isnan(diffs)]
+    if len(diffs) == 0:
+        return 0.0
+    return float(1.4826 * np.median(np.abs(diffs - np.median(diffs))) / np.sqrt(2))
+
+def _segment_argmin(values, starts, stops):
+    # index of the (first) smallest value of every values[start:stop] at once, none are empty
+    lengths = stops - starts
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.intp)
+    firsts = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - firsts, lengths) + np.arange(lengths.sum())
+    segment_values = values[positions]
+    mins = np.minimum.reduceat(segment_values, firsts)
+    is_min = np.flatnonzero(segment_values == np.repeat(mins, lengths))
+    _, first_min = np.unique(np.repeat(np.arange(len(lengths)), lengths)[is_min], return_index=True)
+    return positions[is_min[first_min]]
+
+def _prepare(run, signal, smooth_value, segment):
+    # the signal of the segment with the nan points filled, its temperatures and where it starts
+    start, stop, _ = run.temp_index.select(segment)
+    temps = np.asarray(run.chunk('temp', start, stop), dtype=np.float64)
+    values = np.asarray(run.chunk(signal, start, stop), dtype=np.float64)
+    if smooth_value is not None:
+        from scipy.signal import savgol_filter
+        values = savgol_filter(values, smooth_value, 3)
+
+    # nan points can't be peaks or bases, they take the value of the point before (or the
+    # first one that isn't nan at the start)
+    missing = np.isnan(values)
+    if missing.all():
+        values = np.zeros(len(values))
+    elif missing.any():
+        filled = np.where(missing, 0, np.arange(len(values)))
+        filled[:np.argmin(missing)] = np.argmin(missing)
+        np.maximum.accumulate(filled, out=filled)
+        values = values[filled]
+    return start, stop, temps, values
+
+def _find_exotherms(runs, initial_masses, signal, prominence, min_width, min_temp, max_temp, rel_height,
+                    smooth_value, segment):
+    # the exotherms of every run at once: the segments of all the runs are put one after the
+    # other with +inf between them, so one pass of find_peaks, peak_prominences and peak_widths
+    # covers the whole batch. Nothing is higher than the separators so the bases of a peak and
+    # the widths never reach into the next run, the peaks are the same as run by run
+    from scipy.signal import find_peaks, peak_prominences, peak_widths
+
+    if len(runs) == 0:
+        return []
+    prepared = [_prepare(run, signal, smooth_value, segment) for run in runs]
+    lengths = np.array([len(values) for _, _, _, values in prepared], dtype=np.intp)
+    offsets = np.cumsum(lengths + 1) - lengths - 1
+    total = int(lengths.sum() + len(runs))
+    values = np.full(total, np.inf)
+    temps = np.full(total, np.nan)
+    slopes = np.full(total, np.nan)
+    min_prominences = np.empty(len(runs))
+    min_widths = np.zeros(len(runs))
+    for i, (offset, (_, _, run_temps, run_values)) in enumerate(zip(offsets, prepared)):
+        values[offset:offset + len(run_values)] = run_values
+        temps[offset:offset + len(run_values)] = run_temps
+        if len(run_values) > 1:
+            slopes[offset:offset + len(run_values)] = np.gradient(run_values)
+        if prominence is None:
+            span = float(run_values.max() - run_values.min()) if len(run_values) else 0.0
+            min_prominences[i] = max(10 * _noise_level(run_values), 0.01 * span)
+        else:
+            min_prominences[i] = prominence
+        if min_width and len(run_temps) > 1:
+            # points per degree from the typical temperature step of the segment
+            step = np.nanmedian(np.abs(np.diff(run_temps)))
+            if step > 0:
+                min_widths[i] = min_width / step
+
+    # candidates (the separators are left out), then the conditions find_peaks would apply
+    peak_idxs, _ = find_peaks(values)
+    peak_idxs = peak_idxs[np.isfinite(values[peak_idxs])]
+    run_of = np.searchsorted(offsets, peak_idxs, side='right') - 1
+    prominences, left_bases, right_bases = peak_prominences(values, peak_idxs)
+    keep = prominences >= min_prominences[run_of]
+    peak_idxs, run_of = peak_idxs[keep], run_of[keep]
+    prominences, left_bases, right_bases = prominences[keep], left_bases[keep], right_bases[keep]
+    if min_widths.any():
+        widths = peak_widths(values, peak_idxs, 0.5, (prominences, left_bases, right_bases))[0]
+        keep = widths >= min_widths[run_of]
+        peak_idxs, run_of = peak_idxs[keep], run_of[keep]
+        prominences, left_bases, right_bases = prominences[keep], left_bases[keep], right_bases[keep]
+    in_range = np.ones(len(peak_idxs), dtype=bool)
+    if min_temp is not None:
+        in_range &= temps[peak_idxs] >= min_temp
+    if max_temp is not None:
+        in_range &= temps[peak_idxs] <= max_temp
+    peak_idxs, run_of, prominences = peak_idxs[in_range], run_of[in_range], prominences[in_range]
+    bases = (left_bases[in_range], right_bases[in_range])
+
+    # where the heat flow is back down to the base, interpolated between points
+    _, base_heights, left, right = peak_widths(values, peak_idxs, rel_height, (prominences,) + bases)
+    # peaks of the same run that overlap are split at the lowest point between them
+    pairs = np.flatnonzero(run_of[:-1] == run_of[1:])
+    valleys = _segment_argmin(values, peak_idxs[pairs], peak_idxs[pairs + 1] + 1)
+    right[pairs] = np.minimum(right[pairs], valleys)
+    left[pairs + 1] = np.maximum(left[pairs + 1], valleys)
+    positions = np.arange(total)
+    onset_temps = np.interp(left, positions, temps)
+    end_temps = np.interp(right, positions, temps)
+    onset_idxs = np.floor(left).astype(np.intp)
+    end_idxs = np.minimum(np.ceil(right).astype(np.intp), offsets[run_of] + lengths[run_of] - 1)
+
+    # tangent at the steepest point of the rising edge, where it crosses the base
+    extrapolated = np.full(len(peak_idxs), np.nan)
+    rising = np.flatnonzero(peak_idxs > onset_idxs)
+    steepest = _segment_argmin(-slopes, onset_idxs[rising], peak_idxs[rising])
+    climbing = slopes[steepest] > 0
+    rising, steepest = rising[climbing], steepest[climbing]
+    crossings = steepest - (values[steepest] - base_heights[rising]) / slopes[steepest]
+    # a tangent that crosses outside the run gets the temperature of its first or last point
+    crossings = np.clip(crossings, offsets[run_of[rising]], offsets[run_of[rising]] + lengths[run_of[rising]] - 1)
+    extrapolated[rising] = np.interp(crossings, positions, temps)
+
+    results = []
+    for i, (run, initial_mass, (start, stop, _, _)) in enumerate(zip(runs, initial_masses, prepared)):
+        lo, hi = np.searchsorted(run_of, [i, i + 1])
+        offset = offsets[i]
+        run_onsets = onset_idxs[lo:hi] - offset
+        run_ends = end_idxs[lo:hi] - offset
+        run_peaks = peak_idxs[lo:hi] - offset
+        initial_mass = run.initial_mass if initial_mass is None else initial_mass
+
+        # areas over onset..end (end included) from the cumulative integral of the run
+        areas = run.bls_hf_integral(start + run_onsets, start + run_ends + 1)
+        areas_J_g = np.asarray(areas, dtype=np.float64) / (initial_mass / 1000) / 1000
+        raw_values = np.asarray(run.chunk(signal, start, stop))
+        results.append({'onset_temp': onset_temps[lo:hi], 'extrapolated_onset_temp': extrapolated[lo:hi],
+                        'peak_temp': temps[peak_idxs[lo:hi]], 'end_temp': end_temps[lo:hi],
+                        'peak_heatflow': raw_values[run_peaks].astype(np.float64),
+                        'prominence': prominences[lo:hi], 'area_J_g': areas_J_g, 'onset_idx': start + run_onsets,
+                        'peak_idx': start + run_peaks, 'end_idx': start + run_ends})
+    return results
+
+@instrumented('peaks')
+def find_exotherms(run_data, initial_mass=None, signal='bls_hf', prominence=None, min_width=2.0, min_temp=50,
+                   max_temp=None, rel_height=0.98, smooth_value=None, segment='heating'):
+    '''
+    Finds the exotherms (peaks of the baseline subtracted heat flow) of a run.
+
+    Parameters
+    ----------
+    run_data : DTARun or list
+        Result from get_dta_data (adjust it first with perform_adjustment)
+    initial_mass : float, optional
+        Initial sample mass in milligrams to get the areas in J/g. The default is the initial
+        mass of the run.
+    signal : string, optional
+        "bls_hf" (mW, [3] of the old list) or "norm_hf_bls" (W/g, [7]) to look for the peaks
+        in. The areas always come from the integral of bls_hf. The default is "bls_hf".
+    prominence : float, optional
+        How far a peak has to stick out above the heat flow around it, in the units of signal.
+        The default is 10 times the noise of the signal, and at least 1% of the range of the
+        signal so a flat or stepped signal doesn't give every little bump as a peak.
+    min_width : float, optional
+        How wide (in C, at half its prominence) a peak has to be, spikes narrower than this are
+        ignored. 0 or None to keep them. The default is 2.
+    min_temp : float, optional
+        Peaks below this temperature are ignored (the DTA is full of artifacts early on).
+        The default is 50.
+    max_temp : float, optional
+        Peaks above this temperature are ignored. The default is none.
+    rel_height : float, optional
+        The onset and end are where the heat flow is back down to this fraction of the
+        prominence below the peak (1 is the base of the peak). The default is 0.98.
+    smooth_value : int (odd), optional
+        Window of a savgol filter applied before looking for peaks, for noisy runs. The
+        default is no smoothing.
+    segment : string, int or None, optional
+        Part of the temperature program to look in, see get_lower_upper_idxs. The default is
+        "heating".
+
+    Returns
+    -------
+    peaks : dict
+        one array per column of PEAK_COLUMNS (except run_id and peak), one value per peak in
+        order of temperature. Temperatures in C, peak_heatflow in the units of signal
+
+    '''
+    return _find_exotherms([as_dta_run(run_data)], [initial_mass], signal, prominence, min_width, min_temp,
+                           max_temp, rel_height, smooth_value, segment)[0]
+
+@instrumented('peaks')
+def peak_table(run_data_list, initial_mass_list=None, run_ids=None, signal='bls_hf', prominence=None, min_width=2.0,
+               min_temp=50, max_temp=None, rel_height=0.98, smooth_value=None, segment='heating'):
+    '''
+    Finds the exotherms of every run of a batch in one go and puts them in one table. The
+    peaks of all the runs are looked for at once (see find_exotherms for what they are).
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list)
+    initial_mass_list : list, optional
+        Initial mass of each run in milligrams. The default is the initial mass of each run.
+    run_ids : list, optional
+        name of each run for the run_id column. The default is the position in the list.
+    signal, prominence, min_width, min_temp, max_temp, rel_height, smooth_value, segment
+        Same as for find_exotherms, used for every run.
+
+    Returns
+    -------
+    peaks : Pandas DataFrame
+        one row per peak with the columns PEAK_COLUMNS, peak counts the peaks of a run from 0
+
+    '''
+    import pandas as pd
+
+    if initial_mass_list is None:
+        initial_mass_list = [None] * len(run_data_list)
+    if run_ids is None:
+        run_ids = list(range(len(run_data_list)))
+
+    runs = [as_dta_run(run_data) for run_data in run_data_list]
+    all_peaks = _find_exotherms(runs, list(initial_mass_list), signal, prominence, min_width, min_temp, max_temp,
+                                rel_height, smooth_value, segment)
+
+    columns = {name: [] for name in PEAK_COLUMNS}
+    for run_id, peaks in zip(run_ids, all_peaks):
+        num_peaks = len(peaks['peak_idx'])
+        columns['run_id'].append(np.full(num_peaks, run_id, dtype=object))
+        columns['peak'].append(np.arange(num_peaks))
+        for name, values in peaks.items():
+            columns[name].append(values)
+
+    if len(run_data_list) == 0:
+        return pd.DataFrame(columns=PEAK_COLUMNS)
+    return pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
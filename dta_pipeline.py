@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+## the analysis as a graph of steps instead of a script, so changing one parameter only reruns
+## the steps after it
+##
+##   pipe = mass_gain_pipeline(run_data_list, initial_masses_list, cutoff_temp=300)
+##   pipe.get('corrected')                                 # everything runs the first time
+##   pipe.set_params('mg_start', smooth_value=31)
+##   pipe.get('corrected')                                 # only the onset and what uses it
+##
+## Every step (node) is a function with its inputs (other nodes) and parameters. The result of a
+## node is remembered under a hash of the function, its parameters and the contents of its
+## inputs, and its own contents are hashed for the nodes after it. So a node is only run again if
+## something it uses really changed: a new smooth_value that finds the same onset doesn't rerun
+## anything after get_start_mass_gain. A node can also be run for each run of a batch on its own
+## (map), then changing one run only reruns that run. The functions must not change their inputs
+## in place (use correct_mass_gain instead of modify_run_mass_diff).
+import os
+import mmap
+import pickle
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+from dta_run import DTARun
+from dta_analysis_funcs import perform_adjustment, get_window_heats, convert_Jg_kJmol
+from dta_mass_gain_funcs import (get_mg_percentage_avg_stdev, get_start_mass_gain, adjust_avg_mass_gain,
+                                 correct_mass_gain)
+
+__all__ = ['content_hash', 'Pipeline', 'heat_pipeline', 'mass_gain_pipeline']
+
+# signals that make up a run, the derived heat flows only count when they can't be worked out
+# from the raw ones (runs made from the old list)
+_RUN_FIELDS = ('time_sec', 'temp', 'weight', 'heatflow', 'heatflow_bl', 'mass_diff', 'true_mass', 'initial_mass',
+               'bls_offset', 'norm_bls_offset')
+_DERIVED_FIELDS = ('_bls_hf', '_norm_hf', '_norm_hf_bl', '_norm_hf_bls')
+
+class _Hasher:
+    # content hashes of values, an array that shows up more than once (e.g. the runs and their
+    # adjusted copies share arrays) is only hashed once
+    def __init__(self):
+        self._arrays = {}
+
+    def _sha(self, *parts):
+        sha = hashlib.sha1()
+        for part in parts:
+            sha.update(part if isinstance(part, (bytes, memoryview)) else str(part).encode('utf-8'))
+            sha.update(b'\0')
+        return sha.hexdigest()
+
+    def array(self, values):
+        cached = self._arrays.get(id(values))
+        if cached is not None and cached[0] is values:
+            return cached[1]
+        if isinstance(values, np.memmap) and isinstance(values.base, mmap.mmap) and values.filename is not None:
+            # a whole memory map (not a slice of one) is as good as its file, it isn't read to hash it
+            stat = os.stat(values.filename)
+            digest = self._sha('memmap', values.filename, values.offset, values.shape, values.dtype.str,
+                               stat.st_size, stat.st_mtime_ns)
+        elif values.dtype.hasobject:
+            digest = self._sha('object', values.shape, pickle.dumps(values.tolist()))
+        else:
+            digest = self._sha('array', values.shape, values.dtype.str, memoryview(np.ascontiguousarray(values)).cast('B'))
+        # the array is kept so its id can't be reused while the hash is remembered
+        self._arrays[id(values)] = (values, digest)
+        return digest
+
+    def parts(self, value):
+        # (hash, hashes of the items) of a list or tuple, so an item of it can be used on its own
+        if isinstance(value, (list, tuple)) and not _is_old_run(value):
+            parts = [self.digest(item) for item in value]
+            return self._sha(type(value).__name__, *parts), parts
+        return self.digest(value), None
+
+    def digest(self, value):
+        if value is None or isinstance(value, (bool, int, float, str, bytes, np.generic)):
+            return self._sha(type(value).__name__, repr(value))
+        if isinstance(value, np.ndarray):
+            return self.array(value)
+        if isinstance(value, DTARun):
+            fields = _RUN_FIELDS
+            if value.heatflow is None or value.heatflow_bl is None or value.weight is None:
+                fields = fields + _DERIVED_FIELDS
+            return self._sha('DTARun', *(name + '=' + self.digest(getattr(value, name)) for name in fields))
+        if isinstance(value, (list, tuple)):
+            return self._sha(type(value).__name__, *(self.digest(item) for item in value))
+        if isinstance(value, dict):
+            return self._sha('dict', *(self.digest(key) + ':' + self.digest(item) for key, item in
+                                       sorted(value.items(), key=lambda pair: repr(pair[0]))))
+        if hasattr(value, 'to_numpy') and hasattr(value, 'index'):
+            # pandas series or dataframe, checked without importing pandas
+            columns = getattr(value, 'columns', [getattr(value, 'name', None)])
+            return self._sha(type(value).__name__, self.digest(list(columns)), self.array(value.index.to_numpy()),
+                             self.array(np.ascontiguousarray(value.to_numpy())))
+        return self._sha('pickle', pickle.dumps(value))
+
+def _is_old_run(value):
+    # the list get_dta_data used to give back starts with its dataframe
+    return isinstance(value, list) and len(value) == 8 and hasattr(value[0], 'columns')
+
+def content_hash(value):
+    '''
+    Hash of the contents of a value: arrays, runs (DTARun or the old list), pandas objects,
+    lists, dicts and numbers are hashed by what is in them, anything else by its pickle.
+    Memory maps (runs opened with dta_store.open_run) are hashed by their file, size and
+    modification time without reading them.
+
+    Parameters
+    ----------
+    value : anything
+
+    Returns
+    -------
+    digest : string
+        hex sha1 digest
+
+    '''
+    return _Hasher().digest(value)
+
+class Pipeline:
+    '''
+    Graph of analysis steps whose results are remembered by the contents of what went into
+    them. Add the data with set_input, the steps with add and ask for a result with get.
+
+    Parameters
+    ----------
+    keep : int, optional
+        How many results each node remembers (for each run of a mapped node), so going back to
+        parameters that were used before doesn't rerun anything. The default is 4.
+
+    Attributes
+    ----------
+    last_computed : dict
+        number of times each node was actually run during the last get (nodes taken from what
+        was remembered aren't in it)
+
+    '''
+
+    def __init__(self, keep=4):
+        self.keep = keep
+        self.nodes = {}
+        self.last_computed = {}
+
+    def set_input(self, name, value):
+        '''
+        Sets (or replaces) data going into the pipeline, e.g. the list of runs. Set it again
+        after changing it in place, it is only hashed here.
+
+        Parameters
+        ----------
+        name : string
+            name the nodes use for it
+        value : anything
+            the data
+
+        Returns
+        -------
+        None.
+
+        '''
+        if name in self.nodes and self.nodes[name]['func'] is not None:
+            raise ValueError(repr(name) + " is a node, not an input")
+        digest, parts = _Hasher().parts(value)
+        self.nodes[name] = {'func': None, 'value': value, 'hash': (digest, parts)}
+
+    def add(self, name, func, inputs=None, params=None, map=None):
+        '''
+        Adds a step.
+
+        Parameters
+        ----------
+        name : string
+            name of the node
+        func : function
+            what the node runs, called as func(**inputs, **params)
+        inputs : dict, optional
+            argument name -> input or node it comes from. Give (name, i) to use item i of
+            what a node gives back (e.g. ('mg_avg', 0) for the average of
+            get_mg_percentage_avg_stdev or ('runs', 0) for the first run). The default is none.
+        params : dict, optional
+            argument name -> value for everything else. The default is none.
+        map : list, optional
+            arguments (out of inputs, each a list) to run func on one item at a time, the node
+            gives back the list of results. The default is none (func gets the whole inputs).
+
+        Returns
+        -------
+        None.
+
+        '''
+        if name in self.nodes and self.nodes[name]['func'] is None:
+            raise ValueError(repr(name) + " is an input, not a node")
+        inputs = dict(inputs or {})
+        unknown = set(map or []) - set(inputs)
+        if unknown:
+            raise ValueError("mapped arguments have to be inputs: " + ", ".join(sorted(unknown)))
+        self.nodes[name] = {'func': func, 'inputs': inputs, 'params': dict(params or {}), 'map': list(map or []),
+                            'memo': OrderedDict()}
+
+    def set_params(self, name, **params):
+        '''
+        Changes parameters of a node, the nodes that depend on it are run again next time
+        their results are asked for (if what the node gives back changes).
+        '''
+        node = self.nodes[name]
+        if node['func'] is None:
+            raise ValueError(repr(name) + " is an input, use set_input")
+        node['params'].update(params)
+
+    def get(self, *names):
+        '''
+        Gets the result of one or more nodes, running only the nodes whose inputs or
+        parameters changed since their results were remembered.
+
+        Parameters
+        ----------
+        *names : string
+            nodes (or inputs) to get
+
+        Returns
+        -------
+        result : anything
+            what the node gives back, a tuple of them if more than one name was given
+
+        '''
+        self.last_computed = {}
+        hasher = _Hasher()
+        resolved = {}
+        results = tuple(self._resolve(name, hasher, resolved, ())[0] for name in names)
+        return results[0] if len(results) == 1 else results
+
+    def _resolve(self, ref, hasher, resolved, path):
+        # value and (hash, hashes of the items or None) of an input, node or item of a node
+        name, item = (ref, None) if isinstance(ref, str) else ref
+        if name not in self.nodes:
+            raise KeyError("no input or node named " + repr(name))
+        if name in path:
+            raise ValueError("nodes depend on each other in a loop: " + " -> ".join(path + (name,)))
+        if name not in resolved:
+            resolved[name] = self._evaluate(name, hasher, resolved, path + (name,))
+
+        value, (digest, parts) = resolved[name]
+        if item is None:
+            return value, (digest, parts)
+        if parts is None:
+            raise TypeError(repr(name) + " doesn't give back a list or tuple to take item " + str(item) + " of")
+        return value[item], (parts[item], None)
+
+    def _remember(self, memo, key, result, size):
+        memo[key] = result
+        while len(memo) > size:
+            memo.popitem(last=False)
+
+    def _evaluate(self, name, hasher, resolved, path):
+        node = self.nodes[name]
+        if node['func'] is None:
+            return node['value'], node['hash']
+
+        func = node['func']
+        values, digests, item_digests = {}, {}, {}
+        for arg, ref in node['inputs'].items():
+            values[arg], (digests[arg], item_digests[arg]) = self._resolve(ref, hasher, resolved, path)
+        base = hasher._sha(getattr(func, '__module__', ''), getattr(func, '__qualname__', repr(func)),
+                           hasher.digest(node['params']))
+        memo = node['memo']
+
+        if not node['map']:
+            key = hasher._sha(base, *(arg + '=' + digests[arg] for arg in sorted(digests)))
+            if key in memo:
+                memo.move_to_end(key)
+                return memo[key]
+            value = func(**values, **node['params'])
+            result = (value, hasher.parts(value))
+            self._remember(memo, key, result, self.keep)
+            self.last_computed[name] = 1
+            return result
+
+        # one call per item of the mapped inputs, remembered on their own
+        lengths = {len(values[arg]) for arg in node['map']}
+        if len(lengths) > 1:
+            raise ValueError("the mapped inputs of " + repr(name) + " have different lengths")
+        count = lengths.pop()
+        for arg in node['map']:
+            if item_digests[arg] is None:
+                item_digests[arg] = hasher.parts(values[arg])[1]
+        fixed = [arg + '=' + digests[arg] for arg in sorted(digests) if arg not in node['map']]
+
+        outputs, parts = [], []
+        for i in range(count):
+            key = hasher._sha(base, i, *fixed, *(arg + '=' + item_digests[arg][i] for arg in sorted(node['map'])))
+            if key in memo:
+                memo.move_to_end(key)
+                value, digest = memo[key]
+            else:
+                kwargs = dict(values)
+                for arg in node['map']:
+                    kwargs[arg] = values[arg][i]
+                value = func(**kwargs, **node['params'])
+                digest = hasher.digest(value)
+                self._remember(memo, key, (value, digest), self.keep * count)
+                self.last_computed[name] = self.last_computed.get(name, 0) + 1
+            outputs.append(value)
+            parts.append(digest)
+        return outputs, (hasher._sha('list', *parts), parts)
+
+def heat_pipeline(run_data_list, initial_mass_list, windows, heat_type='im', adjustment=(100, 200),
+                  chemstring=None, numatoms=1):
+    '''
+    The heat analysis of dta_analysis_example.py as a pipeline: perform_adjustment on each run
+    ('adjusted'), the heat of every run over every window ('heats', from get_window_heats) and
+    the heats in kJ/mol ('heats_kJ_mol', only with a chemstring).
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list), input 'runs'
+    initial_mass_list : list
+        initial mass of each run in milligrams, input 'initial_masses'
+    windows : array
+        (ltb, utb) pairs in Celsius, parameter of 'heats'
+    heat_type : string, optional
+        "im", "ox" or "nit", parameter of 'heats'. The default is "im".
+    adjustment : tuple, optional
+        (ltb, utb) of perform_adjustment, parameters of 'adjusted'. The default is (100, 200).
+    chemstring : string, optional
+        chemistry for convert_Jg_kJmol. The default is none (no 'heats_kJ_mol' node).
+    numatoms : int, optional
+        Number of atoms per compound for convert_Jg_kJmol. The default is 1.
+
+    Returns
+    -------
+    pipe : Pipeline
+
+    '''
+    pipe = Pipeline()
+    pipe.set_input('runs', list(run_data_list))
+    pipe.set_input('initial_masses', list(initial_mass_list))
+    pipe.add('adjusted', perform_adjustment, inputs={'run_data': 'runs'},
+             params={'ltb': adjustment[0], 'utb': adjustment[1]}, map=['run_data'])
+    pipe.add('heats', get_window_heats, inputs={'run_data_list': 'adjusted', 'initial_mass_list': 'initial_masses'},
+             params={'windows': np.asarray(windows, dtype=np.float64), 'heat_type': heat_type})
+    if chemstring is not None:
+        pipe.add('heats_kJ_mol', convert_Jg_kJmol, inputs={'heat_J_g': 'heats'},
+                 params={'chemstring': chemstring, 'numatoms': numatoms})
+    return pipe
+
+def mass_gain_pipeline(run_data_list, initial_masses_list, cutoff_temp, threshold=1e-4, smooth_value=51):
+    '''
+    The mass gain correction of the README as a pipeline: the average mass gain ('mg_avg', from
+    get_mg_percentage_avg_stdev), where it starts ('mg_start', get_start_mass_gain on the
+    average and the first run), the adjusted average ('mg_avg_adj', adjust_avg_mass_gain) and
+    the corrected runs ('corrected', correct_mass_gain, copies so the inputs aren't changed).
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list), input 'runs'
+    initial_masses_list : list
+        initial mass of each run in milligrams, input 'initial_masses'
+    cutoff_temp : float
+        parameter of 'mg_start', see get_start_mass_gain
+    threshold : float, optional
+        parameter of 'mg_start'. The default is 1e-4.
+    smooth_value : int (odd), optional
+        parameter of 'mg_start'. The default is 51.
+
+    Returns
+    -------
+    pipe : Pipeline
+
+    '''
+    pipe = Pipeline()
+    pipe.set_input('runs', list(run_data_list))
+    pipe.set_input('initial_masses', list(initial_masses_list))
+    pipe.add('mg_avg', get_mg_percentage_avg_stdev,
+             inputs={'run_data_list': 'runs', 'initial_masses_list': 'initial_masses'})
+    pipe.add('mg_start', get_start_mass_gain, inputs={'avg_mass_change': ('mg_avg', 0), 'aro2_run_data': ('runs', 0)},
+             params={'cutoff_temp': cutoff_temp, 'threshold': threshold, 'smooth_value': smooth_value})
+    pipe.add('mg_avg_adj', adjust_avg_mass_gain, inputs={'run_mg_avg': ('mg_avg', 0), 'mg_start_idx': ('mg_start', 0)})
+    pipe.add('corrected', correct_mass_gain, inputs={'run_data_list': 'runs', 'mg_start_idxs': ('mg_start', 0),
+                                                     'initial_masses': 'initial_masses'})
+    return pipe
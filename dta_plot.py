@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+## plotting helpers that thin out runs before handing them to matplotlib, so overlays of many
+## long runs draw quickly and save to small vector files
+##
+##   fig, ax = plt.subplots()
+##   plot_runs(run_data_list, y='bls_hf', ax=ax)                 # every run, 2000 points each
+##   fill_window(run_data, 120, 600, ax=ax, alpha=0.3)            # the integrated window
+##
+## The runs are cut into buckets and only the points that decide the shape of the line are kept
+## ("minmax": the first, last, lowest and highest point of each bucket, or "lttb": the point of
+## each bucket making the largest triangle with its neighbours). Peaks survive, nothing is
+## averaged away. The kept points of a run are remembered for each resolution.
+import weakref
+import numpy as np
+
+from dta_run import as_dta_run
+from dta_analysis_funcs import get_lower_upper_idxs
+
+__all__ = ['minmax_indices', 'lttb_indices', 'decimate', 'decimate_run', 'plot_run', 'plot_runs',
+           'fill_window', 'clear_plot_cache']
+
+# points kept of each run by (x, y, points, method), forgotten with the run
+_cache = weakref.WeakKeyDictionary()
+
+def minmax_indices(y, points=2000):
+    '''
+    Picks the points of a curve to draw: it is cut into points / 4 buckets and the first, last,
+    lowest and highest point of each bucket are kept, so the line looks the same at any zoom
+    that doesn't show more than one bucket per pixel. A bucket with nan points keeps its first
+    nan so the gap still shows.
+
+    Parameters
+    ----------
+    y : array
+        values of the curve
+    points : int, optional
+        About how many points to keep (never more, except for the nans). The default is 2000.
+
+    Returns
+    -------
+    idxs : array of ints
+        the points to keep, in order
+
+    '''
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= points:
+        return np.arange(n)
+
+    # equal buckets, the last one padded with the last value
+    buckets = max(1, points // 4)
+    size = -(-n // buckets)
+    padded = np.empty(buckets * size)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    blocks = padded.reshape(buckets, size)
+    nans = np.isnan(blocks)
+
+    starts = np.arange(buckets) * size
+    has_nan = nans.any(axis=1)
+    idxs = np.concatenate((starts, starts + size - 1,
+                           starts + np.argmin(np.where(nans, np.inf, blocks), axis=1),
+                           starts + np.argmax(np.where(nans, -np.inf, blocks), axis=1),
+                           (starts + np.argmax(nans, axis=1))[has_nan]))
+    return np.unique(np.minimum(idxs, n - 1))
+
+def lttb_indices(x, y, points=2000):
+    '''
+    Picks the points of a curve to draw with largest-triangle-three-buckets: the first and last
+    point are kept and in each bucket in between the point that makes the biggest triangle with
+    the point kept before it and the average of the next bucket. Keeps the look of the curve
+    with fewer points than minmax_indices but is slower (a loop over the buckets).
+
+    Parameters
+    ----------
+    x : array
+        x values of the curve (e.g. temperature)
+    y : array
+        y values of the curve
+    points : int, optional
+        Number of points to keep. The default is 2000.
+
+    Returns
+    -------
+    idxs : array of ints
+        the points to keep, in order
+
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= points or points < 3:
+        return np.arange(n)
+
+    # points - 2 buckets between the first and last point, and the average of each one
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    idxs = np.empty(points, dtype=np.intp)
+    idxs[0], idxs[-1] = 0, n - 1
+    a = 0
+    with np.errstate(invalid='ignore'):
+        for i in range(points - 2):
+            start, stop = edges[i], edges[i + 1]
+            next_x, next_y = (avg_x[i + 1], avg_y[i + 1]) if i + 1 < points - 2 else (x[-1], y[-1])
+            # twice the area of the triangle, the constant factor doesn't change which is largest
+            area = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+            a = start + int(np.argmax(area))
+            idxs[i + 1] = a
+    return idxs
+
+def _indices(x, y, points, method):
+    if method == 'minmax':
+        return minmax_indices(y, points)
+    if method == 'lttb':
+        return lttb_indices(x, y, points)
+    raise ValueError("method should be 'minmax' or 'lttb', got " + repr(method))
+
+def decimate(x, y, points=2000, method='minmax'):
+    '''
+    Thins out a curve for plotting.
+
+    Parameters
+    ----------
+    x : array
+        x values of the curve
+    y : array
+        y values of the curve
+    points : int, optional
+        About how many points to keep. The default is 2000.
+    method : string, optional
+        "minmax" or "lttb" (see minmax_indices and lttb_indices). The default is "minmax".
+
+    Returns
+    -------
+    x : array
+        x values of the kept points
+    y : array
+        y values of the kept points
+
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    idxs = _indices(x, y, points, method)
+    return x[idxs], y[idxs]
+
+def decimate_run(run_data, x='temp', y='bls_hf', points=2000, method='minmax'):
+    '''
+    Thins out a signal of a run for plotting. The kept points are remembered for the run (as
+    long as it exists), so plotting it again at the same resolution only has to pick them out.
+    They are worked out again if the signal is replaced (set_signals, an adjustment), after
+    changing an array in place call clear_plot_cache.
+
+    Parameters
+    ----------
+    run_data : DTARun or list
+        Result from get_dta_data (an old list is converted every time so nothing is remembered)
+    x : string, optional
+        signal on the x axis. The default is "temp".
+    y : string, optional
+        signal on the y axis e.g. "bls_hf", "norm_hf_bls" or "true_mass". The default is "bls_hf".
+    points : int, optional
+        About how many points to keep. The default is 2000.
+    method : string, optional
+        "minmax" or "lttb". The default is "minmax".
+
+    Returns
+    -------
+    x : array
+        x values of the kept points
+    y : array
+        y values of the kept points
+
+    '''
+    run = as_dta_run(run_data)
+    x_values = getattr(run, x)
+    y_values = getattr(run, y)
+
+    key = (x, y, points, method)
+    run_cache = _cache.setdefault(run, {})
+    cached = run_cache.get(key)
+    if cached is not None and cached[0]() is x_values and cached[1]() is y_values:
+        idxs = cached[2]
+    else:
+        idxs = _indices(x_values, y_values, points, method)
+        run_cache[key] = (weakref.ref(x_values), weakref.ref(y_values), idxs)
+
+    return x_values[idxs], y_values[idxs]
+
+def plot_run(run_data, x='temp', y='bls_hf', points=2000, method='minmax', ax=None, **kwargs):
+    '''
+    Plots a signal of a run, thinned out with decimate_run.
+
+    Parameters
+    ----------
+    run_data : DTARun or list
+        Result from get_dta_data
+    x, y, points, method
+        see decimate_run
+    ax : matplotlib axes, optional
+        Axes to plot on. The default is the current axes.
+    **kwargs
+        Passed on to ax.plot (color, lw, label, ...).
+
+    Returns
+    -------
+    line : matplotlib Line2D
+
+    '''
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    x_values, y_values = decimate_run(run_data, x, y, points, method)
+    return ax.plot(x_values, y_values, **kwargs)[0]
+
+def plot_runs(run_data_list, x='temp', y='bls_hf', points=2000, method='minmax', ax=None, labels=None,
+              colors=None, **kwargs):
+    '''
+    Overlays the same signal of many runs (e.g. replicates), each thinned out with decimate_run.
+
+    Parameters
+    ----------
+    run_data_list : list
+        list of run data (DTARun from get_dta_data or the old list)
+    x, y, points, method
+        see decimate_run
+    ax : matplotlib axes, optional
+        Axes to plot on. The default is the current axes.
+    labels : list, optional
+        label of each run for the legend. The default is no labels.
+    colors : list, optional
+        color of each run. The default is the matplotlib color cycle.
+    **kwargs
+        Passed on to ax.plot for every run.
+
+    Returns
+    -------
+    lines : list
+        the Line2D of each run
+
+    '''
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    lines = []
+    for i, run_data in enumerate(run_data_list):
+        run_kwargs = dict(kwargs)
+        if labels is not None:
+            run_kwargs['label'] = labels[i]
+        if colors is not None:
+            run_kwargs['color'] = colors[i]
+        lines.append(plot_run(run_data, x, y, points, method, ax, **run_kwargs))
+    return lines
+
+def fill_window(run_data, ltb, utb, x='temp', y='bls_hf', points=1000, method='minmax', ax=None,
+                segment='heating', **kwargs):
+    '''
+    Shades the area under a signal between two temperatures, like the fill_between of the
+    intermetallic heat plot. The window is found with get_lower_upper_idxs and starts and ends
+    on exactly the points get_intermetallic_heat integrates, only the inside is thinned out.
+
+    Parameters
+    ----------
+    run_data : DTARun or list
+        Result from get_dta_data
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float
+        utb = upper temperature bound (in Celsius)
+    x, y, points, method
+        see decimate_run, points is for the window only. The default points is 1000.
+    ax : matplotlib axes, optional
+        Axes to plot on. The default is the current axes.
+    segment : string, int or None, optional
+        Part of the temperature program the bounds are looked up in, see get_lower_upper_idxs.
+        The default is "heating".
+    **kwargs
+        Passed on to ax.fill_between (color, alpha, ...).
+
+    Returns
+    -------
+    fill : matplotlib PolyCollection
+
+    '''
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    run = as_dta_run(run_data)
+    initial_idx, final_idx = get_lower_upper_idxs(run, ltb, utb, segment)
+
+    # the same points bls_hf_integral adds up, the first and last are always kept
+    x_values = run.chunk(x, initial_idx, max(final_idx, initial_idx + 1))
+    y_values = run.chunk(y, initial_idx, max(final_idx, initial_idx + 1))
+    x_values, y_values = decimate(x_values, y_values, points, method)
+    return ax.fill_between(x_values, y_values, **kwargs)
+
+def clear_plot_cache():
+    '''
+    Forgets the points kept of every run.
+    '''
+    _cache.clear()
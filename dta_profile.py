@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+## opt-in timing and memory stats for the analysis functions, to find where a slow batch spends its time
+##
+##   with profiling() as profile:
+##       ...analysis...
+##   print(profile)                      # or profile.table(), profile.to_json('profile.json')
+##
+## The analysis functions are decorated with @instrumented(stage). When no profile is running the
+## decorator only checks one flag, so leaving it on the functions costs nothing noticeable.
+import time
+import json
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+__all__ = ['Profile', 'instrumented', 'profiled_block', 'profiling', 'enable_profiling', 'disable_profiling',
+           'active_profile']
+
+# the profile being filled in, None when profiling is off
+_active = None
+_local = threading.local()
+
+class Profile:
+    '''
+    Stats of every instrumented function (or block) that ran while the profile was active:
+    number of calls, total time, time not spent in other instrumented functions (self), the
+    slowest call, how many points went in and the peak memory allocated during a call.
+    '''
+
+    FIELDS = ['name', 'stage', 'calls', 'total_s', 'self_s', 'mean_s', 'max_s', 'points', 'peak_bytes']
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def add(self, name, stage, elapsed, self_time, points, peak_bytes):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {'stage': stage, 'calls': 0, 'total_s': 0.0, 'self_s': 0.0,
+                                            'max_s': 0.0, 'points': 0, 'peak_bytes': 0}
+            stats['calls'] += 1
+            stats['total_s'] += elapsed
+            stats['self_s'] += self_time
+            stats['max_s'] = max(stats['max_s'], elapsed)
+            stats['points'] += points
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+
+    def merge(self, other):
+        '''
+        Adds the stats of another profile (or its .stats, e.g. sent back by a worker process).
+        '''
+        stats = other.stats if isinstance(other, Profile) else other
+        with self._lock:
+            for name, new in stats.items():
+                old = self.stats.get(name)
+                if old is None:
+                    self.stats[name] = dict(new)
+                    continue
+                for key in ('calls', 'total_s', 'self_s', 'points'):
+                    old[key] += new[key]
+                old['max_s'] = max(old['max_s'], new['max_s'])
+                old['peak_bytes'] = max(old['peak_bytes'], new['peak_bytes'])
+
+    def records(self, by='name'):
+        '''
+        The stats as a list of dicts (columns FIELDS), slowest first.
+
+        Parameters
+        ----------
+        by : string, optional
+            "name" for one record per function, "stage" to add the functions of each stage
+            together (by self time so nested calls aren't counted twice). The default is "name".
+
+        Returns
+        -------
+        records : list
+            one dict per function or stage
+
+        '''
+        if by == 'stage':
+            grouped = Profile()
+            for stats in self.stats.values():
+                grouped.merge({stats['stage']: dict(stats, total_s=stats['self_s'])})
+            rows = [dict(stats, name=stage) for stage, stats in grouped.stats.items()]
+        elif by == 'name':
+            rows = [dict(stats, name=name) for name, stats in self.stats.items()]
+        else:
+            raise ValueError("by should be 'name' or 'stage', got " + repr(by))
+
+        for row in rows:
+            row['mean_s'] = row['total_s'] / row['calls']
+        rows.sort(key=lambda row: row['self_s'], reverse=True)
+        return [{field: row[field] for field in self.FIELDS} for row in rows]
+
+    def table(self, by='name'):
+        '''
+        The stats as a pandas DataFrame (see records).
+        '''
+        import pandas as pd
+        return pd.DataFrame(self.records(by), columns=self.FIELDS)
+
+    def to_json(self, filename=None, by='name'):
+        '''
+        The stats as json (see records), written to filename if it is given.
+        '''
+        text = json.dumps(self.records(by), indent=1)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(text)
+        return text
+
+    def __str__(self):
+        lines = ["{:<45} {:<10} {:>7} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+            'name', 'stage', 'calls', 'total s', 'self s', 'max s', 'points', 'peak MB')]
+        for row in self.records():
+            lines.append("{:<45} {:<10} {:>7} {:>10.4f} {:>10.4f} {:>10.4f} {:>12} {:>10.1f}".format(
+                row['name'][:45], row['stage'], row['calls'], row['total_s'], row['self_s'], row['max_s'],
+                row['points'], row['peak_bytes'] / 1e6))
+        return '\n'.join(lines)
+
+def _size(value):
+    # number of points in an argument: the length of a run or array, added up over lists of them
+    temp = getattr(value, 'temp', None)
+    if temp is not None:
+        return len(temp)
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        return int(value.size)
+    if isinstance(value, (list, tuple)) and len(value) > 0 and not isinstance(value[0], (int, float, str)):
+        return sum(_size(item) for item in value)
+    return 0
+
+def _start(profile):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = {'children': 0.0, 'peak': 0, 'current': 0}
+    if profile.memory and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # resetting the peak loses the peak of the caller so far, keep it in its frame
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame['current'] = current
+    stack.append(frame)
+    frame['start'] = time.perf_counter()
+    return frame
+
+def _stop(profile, frame, name, stage, points):
+    elapsed = time.perf_counter() - frame['start']
+    stack = _local.stack
+    stack.pop()
+
+    peak_bytes = 0
+    if profile.memory and tracemalloc.is_tracing():
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        peak_bytes = peak - frame['current']
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+    if stack:
+        stack[-1]['children'] += elapsed
+
+    profile.add(name, stage, elapsed, elapsed - frame['children'], points, peak_bytes)
+
+def instrumented(stage):
+    '''
+    Decorator that records the calls of a function in the active profile.
+
+    Parameters
+    ----------
+    stage : string
+        part of the pipeline the function belongs to (e.g. "load", "lookup", "integrate"),
+        the report can be added up by stage
+
+    '''
+    def decorator(func):
+        name = func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _active
+            if profile is None:
+                return func(*args, **kwargs)
+            # first argument, or the one after self for methods
+            points = next((size for size in map(_size, args[:2]) if size), 0)
+            frame = _start(profile)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _stop(profile, frame, name, stage, points)
+        return wrapper
+    return decorator
+
+@contextmanager
+def profiled_block(name, stage, points=0):
+    '''
+    Records a block of code inside a function in the active profile, like instrumented does
+    for a whole function. Does nothing when profiling is off.
+    '''
+    profile = _active
+    if profile is None:
+        yield
+        return
+    frame = _start(profile)
+    try:
+        yield
+    finally:
+        _stop(profile, frame, name, stage, points)
+
+def enable_profiling(profile=None, memory=False):
+    '''
+    Starts recording into a profile until disable_profiling is called.
+
+    Parameters
+    ----------
+    profile : Profile, optional
+        Profile to add the stats to. The default is a new one.
+    memory : Bool, optional
+        Also record the peak memory allocated by each call with tracemalloc, this makes
+        everything run noticeably slower. The default is False.
+
+    Returns
+    -------
+    profile : Profile
+        the profile the stats go to
+
+    '''
+    global _active
+    profile = profile if profile is not None else Profile(memory)
+    profile.memory = profile.memory or memory
+    if profile.memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profile._started_tracing = True
+    _active = profile
+    return profile
+
+def disable_profiling():
+    '''
+    Stops recording, gives back the profile that was active (None if there wasn't one).
+    '''
+    global _active
+    profile = _active
+    _active = None
+    if profile is not None and profile._started_tracing:
+        tracemalloc.stop()
+        profile._started_tracing = False
+    return profile
+
+def active_profile():
+    '''
+    The profile being recorded into, None when profiling is off.
+    '''
+    return _active
+
+@contextmanager
+def profiling(memory=False, profile=None):
+    '''
+    Records the instrumented functions called inside the with block.
+
+    Parameters
+    ----------
+    memory : Bool, optional
+        Also record peak memory per call (slower). The default is False.
+    profile : Profile, optional
+        Profile to add the stats to. The default is a new one.
+
+    Yields
+    ------
+    profile : Profile
+        the stats, complete once the with block is over
+
+    '''
+    previous = _active
+    profile = enable_profiling(profile, memory)
+    try:
+        yield profile
+    finally:
+        disable_profiling()
+        if previous is not None:
+            enable_profiling(previous)
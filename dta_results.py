@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+## SQLite database of computed heats so a batch only computes the runs that changed, and results
+## of every batch can be compared without running the analysis again
+##
+##   python dta_batch.py manifest.csv -o results.csv --db heats.sqlite     # skips what is in there
+##
+##   with ResultsStore('heats.sqlite') as store:
+##       store.query(chemistry='Al1Zr1', heat_type='im', ltb=120, utb=600)
+##
+## Each run is stored with a hash of its parameters (mass, windows, adjustment, chemistry, ...)
+## and of its input files. The files are only hashed again if their size or modification time
+## changed, so checking a batch that didn't change doesn't read any of them.
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+from dta_cache import file_digest
+
+__all__ = ['RESULTS_VERSION', 'parameter_hash', 'ResultsStore']
+
+# part of the parameter hash, bump it when the analysis changes so old results are recomputed
+RESULTS_VERSION = 1
+
+# the columns of dta_batch.RESULT_COLUMNS (without error, failed runs aren't stored) and what
+# the run was computed from
+_COLUMNS = ['run_id', 'file', 'sheet', 'atmosphere', 'chemistry', 'heat_type', 'ltb', 'utb', 'heat_J_g',
+            'heat_kJ_mol', 'run_key', 'param_hash', 'file_stamp', 'file_digest', 'computed_at']
+_NUMERIC = ('ltb', 'utb', 'heat_J_g', 'heat_kJ_mol')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY, run_id TEXT, file TEXT, sheet TEXT, atmosphere TEXT, chemistry TEXT,
+    heat_type TEXT, ltb REAL, utb REAL, heat_J_g REAL, heat_kJ_mol REAL, run_key TEXT,
+    param_hash TEXT, file_stamp TEXT, file_digest TEXT, computed_at REAL);
+CREATE INDEX IF NOT EXISTS results_run_key ON results (run_key);
+CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id);
+CREATE INDEX IF NOT EXISTS results_chemistry ON results (chemistry, heat_type);
+CREATE INDEX IF NOT EXISTS results_atmosphere ON results (atmosphere, heat_type);
+CREATE INDEX IF NOT EXISTS results_window ON results (ltb, utb);
+CREATE INDEX IF NOT EXISTS results_heat_type ON results (heat_type);
+CREATE INDEX IF NOT EXISTS results_param_hash ON results (param_hash);
+'''
+
+def parameter_hash(entry):
+    '''
+    Hash of everything in a manifest entry (from dta_batch.read_manifest) that changes the
+    results of a run except the input files themselves.
+
+    Parameters
+    ----------
+    entry : dict
+        manifest entry of the run
+
+    Returns
+    -------
+    param_hash : string
+        hex sha1 digest
+
+    '''
+    params = {'version': RESULTS_VERSION, 'initial_mass': entry['initial_mass'], 'atmosphere': entry['atmosphere'],
+              'chemistry': entry['chemistry'], 'numatoms': entry['numatoms'],
+              'windows': [list(window) for window in entry['windows']],
+              'adjustment': [list(window) for window in entry['adjustment']], 'heat_types': entry['heat_types']}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _run_key(entry):
+    # the same run of the same file, wherever the manifest that lists it is
+    return os.path.abspath(entry['file']) + '\0' + str(entry['sheet'])
+
+def _input_files(entry):
+    return [path for path in (entry['file'], entry.get('baseline', '')) if path]
+
+def _file_stamp(entry):
+    stats = [os.stat(path) for path in _input_files(entry)]
+    return ';'.join('%d:%d' % (stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+def _file_digest(entry):
+    return ';'.join(file_digest(path) for path in _input_files(entry))
+
+class ResultsStore:
+    '''
+    SQLite database of the result rows of dta_batch, one row per run, heat type and window,
+    indexed by chemistry, atmosphere, run id, window, heat type and parameter hash.
+
+    Parameters
+    ----------
+    path : string
+        name of the database file, made if it doesn't exist
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        # keeps the statistics the query planner picks the indexes with up to date
+        self.connection.execute('PRAGMA optimize')
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _rows(self, cursor):
+        rows = []
+        names = [col[0] for col in cursor.description]
+        for values in cursor:
+            row = dict(zip(names, values))
+            for name in _NUMERIC:
+                if name in row and row[name] is None:
+                    # sqlite keeps nan as null
+                    row[name] = np.nan
+            rows.append(row)
+        return rows
+
+    def lookup(self, entry):
+        '''
+        Gets the stored results of a run if they were computed with the same parameters from
+        the same input files.
+
+        Parameters
+        ----------
+        entry : dict
+            manifest entry of the run (from dta_batch.read_manifest)
+
+        Returns
+        -------
+        results : list or None
+            one dict per heat type and window like dta_batch.analyze_run gives, None if the run
+            has to be computed (again)
+
+        '''
+        cursor = self.connection.execute(
+            'SELECT id, run_id, file, sheet, atmosphere, chemistry, heat_type, ltb, utb, heat_J_g, heat_kJ_mol, '
+            'param_hash, file_stamp, file_digest FROM results WHERE run_key = ? ORDER BY id', (_run_key(entry),))
+        rows = self._rows(cursor)
+        if len(rows) == 0 or rows[0]['param_hash'] != parameter_hash(entry):
+            return None
+
+        try:
+            stamp = _file_stamp(entry)
+            if stamp != rows[0]['file_stamp']:
+                # touched, only a problem if the contents changed
+                if _file_digest(entry) != rows[0]['file_digest']:
+                    return None
+                with self.connection:
+                    self.connection.execute('UPDATE results SET file_stamp = ? WHERE run_key = ?',
+                                            (stamp, _run_key(entry)))
+        except OSError:
+            return None
+
+        return [{'run_id': row['run_id'], 'file': entry['file'], 'sheet': row['sheet'],
+                 'atmosphere': row['atmosphere'], 'chemistry': row['chemistry'], 'heat_type': row['heat_type'],
+                 'ltb': row['ltb'], 'utb': row['utb'], 'heat_J_g': row['heat_J_g'],
+                 'heat_kJ_mol': row['heat_kJ_mol'], 'error': None} for row in rows]
+
+    def save(self, entry, results, commit=True):
+        '''
+        Stores the results of a run, replacing the ones it had. Results with an error are not
+        stored so a run that failed is tried again next time.
+
+        Parameters
+        ----------
+        entry : dict
+            manifest entry of the run
+        results : list
+            the result dicts of the run from dta_batch.analyze_run
+        commit : Bool, optional
+            Commit right away, False to commit many runs at once with commit(). The default is
+            True.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if any(row.get('error') for row in results):
+            return
+        key = _run_key(entry)
+        stamp, digest = _file_stamp(entry), _file_digest(entry)
+        param_hash = parameter_hash(entry)
+        now = time.time()
+
+        self.connection.execute('DELETE FROM results WHERE run_key = ?', (key,))
+        self.connection.executemany(
+            'INSERT INTO results (' + ', '.join(_COLUMNS) + ') VALUES (' + ', '.join('?' * len(_COLUMNS)) + ')',
+            [(row['run_id'], row['file'], row['sheet'], row['atmosphere'], row['chemistry'], row['heat_type'],
+              float(row['ltb']), float(row['utb']), float(row['heat_J_g']), float(row['heat_kJ_mol']), key,
+              param_hash, stamp, digest, now) for row in results])
+        if commit:
+            self.connection.commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def query(self, **filters):
+        '''
+        Gets stored results, e.g. every intermetallic heat of a chemistry over all the batches
+        that were ever run.
+
+        Parameters
+        ----------
+        **filters
+            column=value to keep only the rows with that value, value can be a list for any of
+            them. The columns are run_id, file, sheet, atmosphere, chemistry, heat_type, ltb,
+            utb and param_hash.
+
+        Returns
+        -------
+        results : Pandas DataFrame
+            matching rows with the columns of dta_batch.RESULT_COLUMNS (without error) and
+            param_hash, computed_at
+
+        '''
+        import pandas as pd
+
+        allowed = ('run_id', 'file', 'sheet', 'atmosphere', 'chemistry', 'heat_type', 'ltb', 'utb', 'param_hash')
+        clauses, values = [], []
+        for name, value in filters.items():
+            if name not in allowed:
+                raise ValueError("can't filter on " + repr(name) + ", use one of " + ", ".join(allowed))
+            if isinstance(value, (list, tuple, set, np.ndarray)):
+                value = list(value)
+                clauses.append(name + ' IN (' + ', '.join('?' * len(value)) + ')')
+                values.extend(value)
+            else:
+                clauses.append(name + ' = ?')
+                values.append(value)
+
+        columns = _COLUMNS[:10] + ['param_hash', 'computed_at']
+        sql = 'SELECT ' + ', '.join(columns) + ' FROM results'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        results = pd.DataFrame.from_records(self.connection.execute(sql + ' ORDER BY id', values).fetchall(),
+                                            columns=columns)
+        # sqlite keeps nan as null
+        for name in _NUMERIC + ('computed_at',):
+            results[name] = results[name].astype(np.float64)
+        return results
@@ -0,0 +1,631 @@
+# -*- coding: utf-8 -*-
+
+## compact container for the data of a single DTA run
+import numpy as np
+
+from dta_profile import instrumented
+
+__all__ = ['DTARun', 'TemperatureIndex', 'RUN_DATA_FIELDS', 'as_dta_run']
+
+class DTARun:
+    '''
+    Holds the signals of one DTA run (scan and baseline) as contiguous NumPy arrays. This is
+    what get_dta_data returns and what every analysis function works on.
+
+    The normalized and baseline subtracted heat flows are only computed the first time they
+    are used and then kept. An adjustment (perform_adjustment) is kept as a constant offset
+    (bls_offset, norm_bls_offset) that is only subtracted when the adjusted array is asked for,
+    so adjusted copies share the arrays, integral and temperature index of the run. The arrays
+    can also be memory maps of a run saved with dta_store.save_run. The run can still be used
+    like the list get_dta_data used to give back, run[1] is the temperature, run[3] the
+    baseline subtracted heat flow and so on (see RUN_DATA_FIELDS), the entries are handed out
+    as pandas Series.
+
+    Parameters
+    ----------
+    time_sec : array
+        time in seconds
+    temp : array
+        temperature in Celsius
+    weight : array
+        mass read by the DTA balance in milligrams
+    heatflow : array
+        heat flow of the scan in mW
+    heatflow_bl : array
+        heat flow of the baseline scan in mW
+    initial_mass : float
+        initial mass of sample in milligrams
+    dtype : numpy dtype, optional
+        dtype the signals are stored as, use np.float32 to halve the memory. The default
+        is np.float64.
+
+    '''
+
+    __slots__ = ('time_sec', 'temp', 'weight', 'heatflow', 'heatflow_bl', 'mass_diff', 'true_mass',
+                 'initial_mass', 'dtype', 'bls_offset', 'norm_bls_offset', '_bls_hf', '_norm_hf', '_norm_hf_bl',
+                 '_norm_hf_bls', '_bls_hf_adj', '_norm_hf_bls_adj', '_cum_bls_hf', '_cum_bls_hf_nans',
+                 '_temp_index', '__weakref__')
+
+    def __init__(self, time_sec, temp, weight, heatflow, heatflow_bl, initial_mass, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.time_sec = self._signal(time_sec)
+        self.temp = self._signal(temp)
+        self.weight = self._signal(weight)
+        self.heatflow = self._signal(heatflow)
+        self.heatflow_bl = self._signal(heatflow_bl)
+        self.initial_mass = initial_mass
+
+        # mass change read by the DTA and the mass based on the real initial mass
+        if self.weight is not None:
+            self.mass_diff = self.weight - self.weight[0]
+            self.true_mass = self.mass_diff + self.dtype.type(initial_mass)
+        else:
+            self.mass_diff = None
+            self.true_mass = None
+
+        # adjustment subtracted from bls_hf (mW) and norm_hf_bls (W/g)
+        self.bls_offset = 0.0
+        self.norm_bls_offset = 0.0
+
+        self._bls_hf = None
+        self._norm_hf = None
+        self._norm_hf_bl = None
+        self._norm_hf_bls = None
+        self._bls_hf_adj = None
+        self._norm_hf_bls_adj = None
+        self._cum_bls_hf = None
+        self._cum_bls_hf_nans = None
+        self._temp_index = None
+
+    def _signal(self, values):
+        if values is None:
+            return None
+        if hasattr(values, 'to_numpy'):
+            # pandas series or index, checked without importing pandas
+            values = values.to_numpy()
+        return np.ascontiguousarray(values, dtype=self.dtype)
+
+    @classmethod
+    def from_list(cls, run_data, initial_mass=None, dtype=np.float64):
+        '''
+        Makes a DTARun from the list the older get_dta_data gave back.
+
+        Parameters
+        ----------
+        run_data : list
+            [data, temp, time_sec, bls_hf, true_mass, norm_hf, norm_hf_bl, norm_hf_bls]
+        initial_mass : float, optional
+            initial mass of sample in milligrams. If not given the first true mass is used
+        dtype : numpy dtype, optional
+            dtype the signals are stored as. The default is np.float64.
+
+        Returns
+        -------
+        run : DTARun
+
+        '''
+        data = run_data[0]
+        true_mass = np.ascontiguousarray(run_data[4], dtype=dtype)
+        if initial_mass is None:
+            initial_mass = float(true_mass[0] - data['Mass Diff Scan1'].iat[0])
+
+        run = cls(run_data[2], run_data[1], None, None, None, initial_mass, dtype=dtype)
+        run.mass_diff = run._signal(data['Mass Diff Scan1'])
+        run.true_mass = true_mass
+
+        # the raw heat flows are only known if the dataframe has the template names
+        if 'Heatflow (mW)' in data and 'Heatflow (mW).1' in data:
+            run.heatflow = run._signal(data['Heatflow (mW)'])
+            run.heatflow_bl = run._signal(data['Heatflow (mW).1'])
+
+        run._bls_hf = run._signal(run_data[3])
+        run._norm_hf = run._signal(run_data[5])
+        run._norm_hf_bl = run._signal(run_data[6])
+        run._norm_hf_bls = run._signal(run_data[7])
+
+        return run
+
+    def _load_mass(self, start=0, stop=None):
+        # mass at each point when the run was loaded, what the heat flows are normalized by
+        return self.weight[start:stop] - self.weight[0] + self.dtype.type(self.initial_mass)
+
+    def _raw_chunk(self, name, start=0, stop=None):
+        # signal over points start:stop without the adjustment, a derived heat flow that isn't
+        # kept yet is only computed over those points
+        if name not in ('bls_hf', 'norm_hf', 'norm_hf_bl', 'norm_hf_bls'):
+            return getattr(self, name)[start:stop]
+        kept = getattr(self, '_' + name)
+        if kept is not None:
+            return kept[start:stop]
+        if name == 'bls_hf':
+            return self.heatflow[start:stop] - self.heatflow_bl[start:stop]
+        if name == 'norm_hf':
+            return self.heatflow[start:stop] / self._load_mass(start, stop)
+        if name == 'norm_hf_bl':
+            return self.heatflow_bl[start:stop] / self._load_mass(start, stop)
+        return (self.heatflow[start:stop] - self.heatflow_bl[start:stop]) / self._load_mass(start, stop)
+
+    def chunk(self, name, start=0, stop=None):
+        '''
+        Values of a signal over the points start:stop (adjusted like the property is). The
+        derived heat flows are only worked out over those points if the run doesn't keep them
+        yet, so looking at a window of a long run doesn't need memory the size of the run.
+
+        Parameters
+        ----------
+        name : string
+            name of the signal e.g. "temp", "true_mass" or "bls_hf"
+        start : int, optional
+            first point. The default is 0.
+        stop : int, optional
+            point after the last one. The default is the end of the run.
+
+        Returns
+        -------
+        values : array
+            the signal over start:stop
+
+        '''
+        values = self._raw_chunk(name, start, stop)
+        offset = {'bls_hf': self.bls_offset, 'norm_hf_bls': self.norm_bls_offset}.get(name, 0)
+        if offset != 0:
+            values = values - self.dtype.type(offset)
+        return values
+
+    def _raw_bls_hf(self):
+        # baseline subtracted heat flow without the adjustment
+        if self._bls_hf is None:
+            self._bls_hf = self._raw_chunk('bls_hf')
+        return self._bls_hf
+
+    def _raw_norm_hf_bls(self):
+        if self._norm_hf_bls is None:
+            self._norm_hf_bls = self._raw_chunk('norm_hf_bls')
+        return self._norm_hf_bls
+
+    @property
+    def bls_hf(self):
+        '''baseline subtracted heat flow in mW (minus bls_offset)'''
+        if self.bls_offset == 0:
+            return self._raw_bls_hf()
+        if self._bls_hf_adj is None:
+            self._bls_hf_adj = self._raw_bls_hf() - self.dtype.type(self.bls_offset)
+        return self._bls_hf_adj
+
+    @property
+    def norm_hf(self):
+        '''true mass normalized heat flow (W/g)'''
+        if self._norm_hf is None:
+            self._norm_hf = self._raw_chunk('norm_hf')
+        return self._norm_hf
+
+    @property
+    def norm_hf_bl(self):
+        '''true mass normalized baseline heat flow (W/g)'''
+        if self._norm_hf_bl is None:
+            self._norm_hf_bl = self._raw_chunk('norm_hf_bl')
+        return self._norm_hf_bl
+
+    @property
+    def norm_hf_bls(self):
+        '''true mass normalized baseline subtracted heat flow (W/g, minus norm_bls_offset)'''
+        if self.norm_bls_offset == 0:
+            return self._raw_norm_hf_bls()
+        if self._norm_hf_bls_adj is None:
+            self._norm_hf_bls_adj = self._raw_norm_hf_bls() - self.dtype.type(self.norm_bls_offset)
+        return self._norm_hf_bls_adj
+
+    def adjust(self, bls_offset=0.0, norm_bls_offset=0.0, inplace=False):
+        '''
+        Subtracts constants from the baseline subtracted heat flows without touching the arrays,
+        the offsets add up with the ones the run already has.
+
+        Parameters
+        ----------
+        bls_offset : float, optional
+            subtracted from bls_hf (mW). The default is 0.
+        norm_bls_offset : float, optional
+            subtracted from norm_hf_bls (W/g). The default is 0.
+        inplace : Bool, optional
+            Change this run instead of a copy. The default is False.
+
+        Returns
+        -------
+        run : DTARun
+            the adjusted run (a shallow copy unless inplace)
+
+        '''
+        run = self if inplace else self.copy()
+        run.bls_offset = run.bls_offset + float(bls_offset)
+        run.norm_bls_offset = run.norm_bls_offset + float(norm_bls_offset)
+        run._bls_hf_adj = None
+        run._norm_hf_bls_adj = None
+        return run
+
+    def set_signals(self, **signals):
+        '''
+        Replaces signals of the run, e.g. run.set_signals(bls_hf=adjusted). The derived signals
+        (bls_hf, norm_hf, norm_hf_bl, norm_hf_bls) can be set as well, they are then no longer
+        computed from the raw heat flows.
+        '''
+        for name, values in signals.items():
+            # a signal that is set replaces the adjusted one, its offset is dropped
+            if name == 'bls_hf':
+                self.bls_offset = 0.0
+                self._bls_hf_adj = None
+            elif name == 'norm_hf_bls':
+                self.norm_bls_offset = 0.0
+                self._norm_hf_bls_adj = None
+            if name in ('bls_hf', 'norm_hf', 'norm_hf_bl', 'norm_hf_bls'):
+                name = '_' + name
+            elif (name not in DTARun.__slots__ or name.startswith('_')
+                  or name in ('initial_mass', 'dtype', 'bls_offset', 'norm_bls_offset')):
+                raise AttributeError("DTARun has no signal '" + name + "'")
+            setattr(self, name, self._signal(values))
+        
+        # the integral and temperature index have to be rebuilt from the new signals
+        self._cum_bls_hf = None
+        self._cum_bls_hf_nans = None
+        self._temp_index = None
+
+    @property
+    def temp_index(self):
+        '''
+        TemperatureIndex of the run, built the first time it is used. It splits the temperature
+        program into heating, cooling and isothermal segments and finds the point closest to a
+        temperature with a binary search.
+        '''
+        if self._temp_index is None:
+            self._temp_index = TemperatureIndex(self.temp, self.time_sec)
+        return self._temp_index
+
+    def _raw_cum_bls_hf(self):
+        # integral of the heat flow without the adjustment, shared with adjusted copies
+        if self._cum_bls_hf is None:
+            bls_hf = self._raw_bls_hf().astype(np.float64)
+            areas = 0.5 * (bls_hf[1:] + bls_hf[:-1]) * np.diff(self.time_sec.astype(np.float64))
+            
+            # keep track of the missing points so a window that has one gives nan like trapz
+            nans = np.isnan(areas)
+            if nans.any():
+                areas[nans] = 0
+                self._cum_bls_hf_nans = np.concatenate(([0], np.cumsum(nans)))
+            
+            self._cum_bls_hf = np.concatenate(([0.0], np.cumsum(areas)))
+        return self._cum_bls_hf
+
+    @property
+    def cum_bls_hf(self):
+        '''
+        Cumulative trapezoid integral of the baseline subtracted heat flow over time (mW*s = mJ),
+        cum_bls_hf[i] is the area from the first point up to point i. Built the first time it is
+        used so the heat over any window is a subtraction of two values (see bls_hf_integral).
+        '''
+        cum = self._raw_cum_bls_hf()
+        if self.bls_offset == 0:
+            return cum
+        time_sec = self.time_sec.astype(np.float64)
+        return cum - self.bls_offset * (time_sec - time_sec[0])
+
+    def bls_hf_integral(self, initial_idx, final_idx):
+        '''
+        Area under the baseline subtracted heat flow in mJ between the points initial_idx and
+        final_idx (final_idx not included, the same as integrating bls_hf[initial_idx:final_idx]).
+        The adjustment is a constant so its area is taken off without touching the arrays.
+
+        Parameters
+        ----------
+        initial_idx : int or array of ints
+            first point of each window
+        final_idx : int or array of ints
+            point after the last point of each window
+
+        Returns
+        -------
+        area : float or array
+            area of each window in mJ
+
+        '''
+        cum = self._raw_cum_bls_hf()
+        initial_idx = np.asarray(initial_idx)
+        last_idx = np.maximum(np.asarray(final_idx) - 1, initial_idx)
+        
+        area = cum[last_idx] - cum[initial_idx]
+        if self.bls_offset != 0:
+            duration = (np.asarray(self.time_sec[last_idx], dtype=np.float64)
+                        - np.asarray(self.time_sec[initial_idx], dtype=np.float64))
+            area = area - self.bls_offset * duration
+        if self._cum_bls_hf_nans is not None:
+            nans = self._cum_bls_hf_nans[last_idx] - self._cum_bls_hf_nans[initial_idx]
+            area = np.where(nans > 0, np.nan, area)
+        
+        return area if area.ndim else float(area)
+
+    def copy(self):
+        '''
+        Shallow copy, the arrays are shared with the original run (same as list.copy() on the
+        old run data list).
+        '''
+        run = DTARun.__new__(DTARun)
+        for name in DTARun.__slots__[:-1]:
+            setattr(run, name, getattr(self, name))
+        return run
+
+    def astype(self, dtype):
+        '''
+        Copy of the run with every signal stored as dtype (e.g. np.float32).
+        '''
+        run = self.copy()
+        run.dtype = np.dtype(dtype)
+        for name in DTARun.__slots__[:-1]:
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray):
+                setattr(run, name, np.ascontiguousarray(value, dtype=run.dtype))
+        return run
+
+    @property
+    def nbytes(self):
+        '''memory used by the arrays of the run in bytes'''
+        arrays = {id(value): value for value in (getattr(self, name) for name in DTARun.__slots__[:-1])
+                  if isinstance(value, np.ndarray)}
+        return sum(arr.nbytes for arr in arrays.values())
+
+    def __len__(self):
+        return len(RUN_DATA_FIELDS)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(RUN_DATA_FIELDS))[i]]
+        name = RUN_DATA_FIELDS[i]
+        if name == 'data':
+            return self.to_frame()
+        import pandas as pd
+        return pd.Series(getattr(self, name), copy=False, name=name)
+
+    def __iter__(self):
+        for i in range(len(RUN_DATA_FIELDS)):
+            yield self[i]
+
+    def to_list(self):
+        '''
+        The run as the list the older get_dta_data gave back
+        [data, temp, time_sec, bls_hf, true_mass, norm_hf, norm_hf_bl, norm_hf_bls].
+        '''
+        return list(self)
+
+    def to_frame(self):
+        '''
+        Dataframe with the signals of the run, named like the columns of the excel template.
+        It is built every time so changing it doesn't change the run.
+        '''
+        import pandas as pd
+        columns = {'Time (min)': self.time_sec / 60,
+                   'Temperature': self.temp,
+                   'Weight (mg)': self.weight,
+                   'Heatflow (mW)': self.heatflow,
+                   'Heatflow (mW).1': self.heatflow_bl,
+                   'Mass Diff Scan1': self.mass_diff,
+                   'True Mass Scan1': self.true_mass}
+        return pd.DataFrame({name: values for name, values in columns.items() if values is not None})
+
+    def __repr__(self):
+        return 'DTARun(points={}, initial_mass={}, dtype={})'.format(len(self.temp), self.initial_mass,
+                                                                     self.dtype.name)
+
+# what each index of the old run data list holds
+RUN_DATA_FIELDS = ['data', 'temp', 'time_sec', 'bls_hf', 'true_mass', 'norm_hf', 'norm_hf_bl', 'norm_hf_bls']
+
+def as_dta_run(run_data):
+    '''
+    Gives back run_data as a DTARun. The list from the older get_dta_data is converted, a
+    DTARun is passed through untouched.
+    '''
+    if isinstance(run_data, DTARun):
+        return run_data
+    return DTARun.from_list(run_data)
+
+class TemperatureIndex:
+    '''
+    Finds the point of a run closest to a temperature without scanning the whole run. The
+    temperature program is split once into heating, cooling and isothermal segments, the
+    temperatures of a segment are sorted the first time it is used and then searched with
+    np.searchsorted.
+
+    Parameters
+    ----------
+    temperatures : array
+        temperatures of the run in Celsius
+    time_sec : array, optional
+        time of each point in seconds. If not given the points are taken as 1 second apart
+    window_sec : float, optional
+        the heating rate at each point is taken over this much time, so the noise of the
+        thermocouple doesn't split a ramp. The default is 60.
+    rate_tol : float, optional
+        points heating or cooling slower than this (in C/min) are isothermal. The default is 1.
+
+    '''
+
+    __slots__ = ('temps', 'segments', '_keys')
+
+    @instrumented('lookup')
+    def __init__(self, temperatures, time_sec=None, window_sec=60, rate_tol=1.0):
+        self.temps = np.asarray(temperatures, dtype=np.float64)
+        self.segments = _find_segments(self.temps, time_sec, window_sec, rate_tol)
+        self._keys = {}
+
+    @classmethod
+    def from_segments(cls, temperatures, segments, sorted_temps=None):
+        '''
+        Makes an index out of segments (and sorted temperatures) that were worked out before,
+        e.g. the ones saved with a run by dta_store.save_run, so nothing has to be sorted again.
+
+        Parameters
+        ----------
+        temperatures : array
+            temperatures of the run in Celsius (used as is, a memory map isn't read)
+        segments : list
+            (start, stop, kind) of each segment, like .segments
+        sorted_temps : dict, optional
+            (sorted temperatures, index of each) of segments by (start, stop), like ordered
+            gives back. The default is none, they are sorted when first used.
+
+        Returns
+        -------
+        index : TemperatureIndex
+
+        '''
+        index = cls.__new__(cls)
+        index.temps = temperatures
+        index.segments = [(int(start), int(stop), kind) for start, stop, kind in segments]
+        index._keys = dict(sorted_temps or {})
+        return index
+
+    def select(self, segment='heating'):
+        '''
+        Gets the segment a selector refers to.
+
+        Parameters
+        ----------
+        segment : string, int or None, optional
+            "heating", "cooling" or "isothermal" (the first one of that kind), optionally
+            starting with "first", "last" or "longest" e.g. "last cooling". An int picks the
+            segment by its number in .segments, None or "all" is the whole run. The default
+            is "heating".
+
+        Returns
+        -------
+        segment : tuple
+            (start, stop, kind) of the segment, the whole run is (0, n, "all"). A ValueError
+            is raised if the run has no segment of the kind asked for
+
+        '''
+        whole_run = (0, len(self.temps), 'all')
+        if segment is None or segment == 'all':
+            return whole_run
+        if isinstance(segment, (int, np.integer)):
+            return self.segments[segment]
+        
+        words = segment.lower().split()
+        which, kind = (words[0], words[1]) if len(words) == 2 else ('first', words[0])
+        if kind not in ('heating', 'cooling', 'isothermal') or which not in ('first', 'last', 'longest'):
+            raise ValueError("segment should be 'heating', 'cooling' or 'isothermal' (optionally starting " 
+                             "with 'first', 'last' or 'longest'), an int or 'all', got " + repr(segment))
+        
+        matches = [seg for seg in self.segments if seg[2] == kind]
+        if len(matches) == 0:
+            raise ValueError("the run has no " + kind + " segment (it has " 
+                             + ", ".join(sorted(set(seg[2] for seg in self.segments))) 
+                             + "), pick another segment or 'all' for the whole run")
+        if which == 'first':
+            return matches[0]
+        if which == 'last':
+            return matches[-1]
+        return max(matches, key=lambda seg: seg[1] - seg[0])
+
+    def _sorted(self, start, stop):
+        # temperatures of the segment sorted (stable so equal temperatures keep their order)
+        # and where each one came from, nan points are left out
+        sorted_temps = self._keys.get((start, stop))
+        if sorted_temps is None:
+            temps = np.asarray(self.temps[start:stop], dtype=np.float64)
+            order = np.argsort(temps, kind='stable')
+            order = order[:np.count_nonzero(~np.isnan(temps))]
+            sorted_temps = (temps[order], order + start)
+            self._keys[(start, stop)] = sorted_temps
+        return sorted_temps
+
+    def ordered(self, segment='heating'):
+        '''
+        Gets the temperatures of a segment sorted from low to high, e.g. to interpolate a
+        signal of the run against temperature.
+
+        Parameters
+        ----------
+        segment : string, int or None, optional
+            which part of the temperature program, see select. The default is "heating".
+
+        Returns
+        -------
+        temps : array
+            temperatures of the segment in increasing order (nan points are left out)
+        idxs : array
+            index of each of those points into the whole run
+
+        '''
+        start, stop, _ = self.select(segment)
+        return self._sorted(start, stop)
+
+    def lookup(self, temperatures, segment='heating'):
+        '''
+        Finds the index of the point closest to each temperature in a segment of the run.
+
+        Parameters
+        ----------
+        temperatures : float or array
+            temperatures in Celsius, any number of them can be looked up at once
+        segment : string, int or None, optional
+            which part of the temperature program to look in, see select. The default is
+            "heating" (the first heating ramp).
+
+        Returns
+        -------
+        idxs : int or array of ints
+            index of the closest point (into the whole run) for each temperature, if two 
+            points are as close the earlier one is given like idxmin does
+
+        '''
+        start, stop, _ = self.select(segment)
+        key, order = self._sorted(start, stop)
+        if len(key) == 0:
+            raise ValueError("segment " + repr(segment) + " of the run has no temperatures to look up")
+        values = np.asarray(temperatures, dtype=np.float64)
+        
+        # closest of the first point at or above the target and the last one below it
+        hi = np.clip(np.searchsorted(key, values, side='left'), 0, len(key) - 1)
+        lo = np.searchsorted(key, key[np.maximum(hi - 1, 0)], side='left')
+        dist_hi = np.abs(key[hi] - values)
+        dist_lo = np.abs(key[lo] - values)
+        idxs = np.where(dist_hi < dist_lo, order[hi],
+                        np.where(dist_lo < dist_hi, order[lo], np.minimum(order[lo], order[hi])))
+        
+        return idxs if idxs.ndim else int(idxs)
+
+def _find_segments(temps, time_sec, window_sec, rate_tol):
+    # splits the temperature program into (start, stop, kind) segments
+    n = len(temps)
+    if n < 2:
+        return [(0, n, 'isothermal')]
+    time_sec = np.arange(n, dtype=np.float64) if time_sec is None else np.asarray(time_sec, dtype=np.float64)
+    
+    # heating rate over a window around each point (C/min)
+    step = np.nanmedian(np.diff(time_sec))
+    half = int(max(1, round(window_sec / 2 / step))) if step > 0 else 1
+    ahead = np.minimum(np.arange(n) + half, n - 1)
+    behind = np.maximum(np.arange(n) - half, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = (temps[ahead] - temps[behind]) / (time_sec[ahead] - time_sec[behind]) * 60
+    labels = np.where(rate > rate_tol, 1, np.where(rate < -rate_tol, -1, 0))
+    
+    # runs of the same label, runs shorter than the window are merged into the one before
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1, [n]))
+    runs = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        label = labels[start]
+        if len(runs) > 0 and (runs[-1][2] == label or stop - start < 2 * half):
+            runs[-1][1] = stop
+        else:
+            runs.append([start, stop, label])
+    if len(runs) > 1 and runs[0][1] - runs[0][0] < 2 * half:
+        runs[1][0] = 0
+        runs.pop(0)
+    
+    # move the boundary between a heating and a cooling segment to the actual turning point
+    for before, after in zip(runs[:-1], runs[1:]):
+        if before[2] * after[2] == -1:
+            lo, hi = max(before[0], before[1] - half), min(after[1], after[0] + half)
+            turn = np.nanargmax(temps[lo:hi]) if before[2] == 1 else np.nanargmin(temps[lo:hi])
+            before[1] = after[0] = lo + turn + 1
+    
+    kinds = {1: 'heating', -1: 'cooling', 0: 'isothermal'}
+    return [(int(start), int(stop), kinds[label]) for start, stop, label in runs]
+
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+
+## small local server that keeps loaded runs in memory, so every notebook and script asking for
+## heats of the same runs shares one warm cache instead of loading the workbooks again
+##
+##   python dta_server.py --port 8765                  # or --socket /tmp/dta.sock
+##
+##   request('window_heats', runs=[{'file': 'Argon DTA Results.xlsx', 'sheet': 'R1', 'initial_mass': 11.469}],
+##           windows=[[120, 600]], adjustment=[100, 200])
+##
+## Every request is a POST of json to /<endpoint> and gets json back (GET /status for what is
+## loaded). A run is given like a row of the dta_batch manifest: file, sheet, initial_mass and
+## baseline (for .txt exports). Runs are loaded the first time they are asked for, with their
+## heat flow integral and temperature index, and the least recently used ones are dropped when
+## the cache gets bigger than --max-mb. A run is loaded again if its file changed. The last answers
+## are remembered too, asking the same thing again sends them back without computing anything.
+##
+## endpoints:
+##   window_heats       runs, windows, heat_type ("im"), adjustment, segment -> heats, avg, stdev
+##   incremental_heat   runs, start_temp, end_temp, step, heat_type, adjustment -> incremental, stdev, cumulative
+##   mass_gain_average  runs, aligned (false), grid, axis, segment, confidence -> avg, stdev (grid, lower, upper)
+##   mass_gain_onset    runs, cutoff_temp, threshold, smooth_value -> idx, temp
+##   evict              clears the cache
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+import numpy as np
+
+from dta_analysis_funcs import (get_dta_data, get_dta_txt_data, perform_adjustment, avg_stdev_window_heats,
+                                calculate_incremental_cumulative_heat)
+from dta_mass_gain_funcs import get_mg_percentage_avg_stdev, get_mg_percentage_aligned, get_start_mass_gain
+from dta_store import open_run
+
+__all__ = ['DEFAULT_PORT', 'RunCache', 'make_server', 'serve', 'request', 'main']
+
+DEFAULT_PORT = 8765
+
+def _file_stamp(spec):
+    paths = [spec['file']] + ([spec['baseline']] if spec.get('baseline') else [])
+    return tuple((os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths)
+
+def _resident_bytes(run):
+    # memory the run takes up, memory maps of a .dtarun file don't count (the os pages them)
+    arrays = {id(value): value for value in (getattr(run, name) for name in type(run).__slots__[:-1])
+              if isinstance(value, np.ndarray) and not isinstance(value, np.memmap)}
+    if run._temp_index is not None:
+        for key, order in run._temp_index._keys.values():
+            arrays[id(key)], arrays[id(order)] = key, order
+    return sum(arr.nbytes for arr in arrays.values() if not isinstance(arr, np.memmap))
+
+class RunCache:
+    '''
+    Runs loaded for the server, the least recently used ones are dropped when they take up
+    more than max_bytes. Safe to use from many threads, a run being loaded only holds up the
+    requests that need that run. The memory of the runs a request used is measured again after
+    it is answered, since the signals a run derives (normalized heat flows, ...) are only kept
+    once they are used.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        How much memory the runs can take up. The default is 2 GB.
+    max_answers : int, optional
+        How many answers to remember, asking the same thing again about runs whose files
+        didn't change gets the same answer back without computing it. The default is 256.
+
+    '''
+
+    def __init__(self, max_bytes=2 << 30, max_answers=256):
+        self.max_bytes = max_bytes
+        self.max_answers = max_answers
+        self.hits = 0
+        self.misses = 0
+        self._runs = OrderedDict()
+        self._loading = {}
+        self._answers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, spec):
+        return (os.path.abspath(spec['file']), str(spec.get('sheet', '')), spec.get('initial_mass'),
+                os.path.abspath(spec['baseline']) if spec.get('baseline') else '')
+
+    def _load(self, spec):
+        filename = spec['file']
+        if filename.lower().endswith('.dtarun'):
+            run = open_run(filename)
+        elif filename.lower().endswith('.txt'):
+            run = get_dta_txt_data(filename, spec['baseline'], spec.get('initial_mass'))
+        else:
+            run = get_dta_data(filename, spec['sheet'], spec['initial_mass'])
+        # built now so the requests only look things up
+        run._raw_cum_bls_hf()
+        run.temp_index.ordered('heating')
+        return run
+
+    def get(self, spec):
+        '''
+        Gets a run, loading it if it isn't in the cache (or its file changed).
+
+        Parameters
+        ----------
+        spec : dict
+            file, sheet, initial_mass and baseline of the run (like a dta_batch manifest row)
+
+        Returns
+        -------
+        run : DTARun
+
+        '''
+        key = self._key(spec)
+        stamp = _file_stamp(spec)
+        with self._lock:
+            cached = self._runs.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._runs.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            # the first request for a run loads it (without the lock, so the other runs can be
+            # used meanwhile), the ones that ask for it while it loads wait for that load
+            pending = self._loading.get(key)
+            loading = pending is None or pending[0] != stamp
+            if loading:
+                self.misses += 1
+                pending = (stamp, Future())
+                self._loading[key] = pending
+            else:
+                self.hits += 1
+        future = pending[1]
+        if not loading:
+            return future.result()
+
+        try:
+            run = self._load(spec)
+        except BaseException as err:
+            with self._lock:
+                if self._loading.get(key) is pending:
+                    del self._loading[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            if self._loading.get(key) is pending:
+                del self._loading[key]
+            self._runs[key] = [stamp, run, _resident_bytes(run)]
+            self._runs.move_to_end(key)
+            self._trim()
+        future.set_result(run)
+        return run
+
+    def _trim(self):
+        # drops the least recently used runs until they fit (the lock is held)
+        total = sum(entry[2] for entry in self._runs.values())
+        while total > self.max_bytes and len(self._runs) > 1:
+            _, (_, _, size) = self._runs.popitem(last=False)
+            total -= size
+
+    def measure(self, specs):
+        '''
+        Measures the memory of runs again (after they were used) and drops the least recently
+        used runs if the cache is now too big.
+
+        Parameters
+        ----------
+        specs : list
+            the runs, like for get
+
+        Returns
+        -------
+        None.
+
+        '''
+        keys = [self._key(spec) for spec in specs]
+        with self._lock:
+            for key in keys:
+                entry = self._runs.get(key)
+                if entry is not None:
+                    entry[2] = _resident_bytes(entry[1])
+            self._trim()
+
+    def answer(self, endpoint, body, compute):
+        '''
+        The encoded answer of a request, computed with compute() unless it was asked before
+        and the files of its runs didn't change since.
+        '''
+        key = (endpoint, json.dumps(body, sort_keys=True),
+               tuple(_file_stamp(spec) for spec in body.get('runs', [])))
+        with self._lock:
+            cached = self._answers.get(key)
+            if cached is not None:
+                self._answers.move_to_end(key)
+                return cached
+        data = compute()
+        self.measure(body.get('runs', []))
+        with self._lock:
+            self._answers[key] = data
+            while len(self._answers) > self.max_answers:
+                self._answers.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+            self._answers.clear()
+
+    def status(self):
+        with self._lock:
+            return {'runs': [{'file': key[0], 'sheet': key[1], 'initial_mass': key[2], 'bytes': entry[2]}
+                             for key, entry in self._runs.items()],
+                    'bytes': sum(entry[2] for entry in self._runs.values()), 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'answers': len(self._answers)}
+
+def _jsonable(value):
+    # numpy and pandas values to plain lists and floats, nan to null
+    if hasattr(value, 'to_numpy'):
+        value = value.to_numpy()
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f' and np.isnan(value).any():
+            return np.where(np.isnan(value), None, value.astype(object)).tolist()
+        return value.tolist()
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+def _encode(payload):
+    return json.dumps(_jsonable(payload)).encode('utf-8')
+
+def _runs(cache, body):
+    # the runs of a request (adjusted if it asks for it) and their initial masses
+    specs = body['runs']
+    runs = [cache.get(spec) for spec in specs]
+    if body.get('adjustment'):
+        ltb, utb = body['adjustment']
+        runs = [perform_adjustment(run, ltb, utb) for run in runs]
+    masses = [spec.get('initial_mass', run.initial_mass) for spec, run in zip(specs, runs)]
+    return runs, masses
+
+def _window_heats(cache, body):
+    runs, masses = _runs(cache, body)
+    avg, stdev, heats = avg_stdev_window_heats(runs, body['windows'], masses, body.get('heat_type', 'im'),
+                                               body.get('segment', 'heating'))
+    return {'heats': heats, 'avg': avg, 'stdev': stdev}
+
+def _incremental_heat(cache, body):
+    runs, masses = _runs(cache, body)
+    incremental, stdev, cumulative = calculate_incremental_cumulative_heat(
+        runs, body['start_temp'], body['end_temp'], body['step'], masses, body.get('heat_type', 'im'))
+    return {'incremental': incremental, 'stdev': stdev, 'cumulative': cumulative}
+
+def _mass_gain_average(cache, body):
+    runs, masses = _runs(cache, body)
+    if body.get('aligned'):
+        grid, avg, stdev, lower, upper = get_mg_percentage_aligned(
+            runs, masses, body.get('grid'), body.get('axis', 'temp'), body.get('segment', 'heating'),
+            body.get('confidence', 0.95))
+        return {'grid': grid, 'avg': avg, 'stdev': stdev, 'lower': lower, 'upper': upper}
+    avg, stdev = get_mg_percentage_avg_stdev(runs, masses)
+    return {'avg': avg, 'stdev': stdev}
+
+def _mass_gain_onset(cache, body):
+    runs, masses = _runs(cache, body)
+    avg, _ = get_mg_percentage_avg_stdev(runs, masses)
+    idx, temp = get_start_mass_gain(avg, runs[0], body['cutoff_temp'], body.get('threshold', 1e-4),
+                                    body.get('smooth_value', 51))
+    return {'idx': idx, 'temp': temp}
+
+def _evict(cache, body):
+    cache.clear()
+    return {}
+
+_ENDPOINTS = {'window_heats': _window_heats, 'incremental_heat': _incremental_heat,
+              'mass_gain_average': _mass_gain_average, 'mass_gain_onset': _mass_gain_onset, 'evict': _evict}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, payload):
+        self._send(status, _encode(payload))
+
+    def _send(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.strip('/') == 'status':
+            self._reply(200, self.server.cache.status())
+        else:
+            self._reply(404, {'error': "unknown endpoint " + self.path + ", use GET /status or POST one of "
+                              + ", ".join(sorted(_ENDPOINTS))})
+
+    def do_POST(self):
+        endpoint = _ENDPOINTS.get(self.path.strip('/'))
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if endpoint is None:
+            self._reply(404, {'error': "unknown endpoint " + self.path + ", use one of " + ", ".join(sorted(_ENDPOINTS))})
+            return
+        cache = self.server.cache
+        try:
+            request_body = json.loads(body or b'{}')
+            if endpoint is _evict:
+                data = _encode(endpoint(cache, request_body))
+            else:
+                data = cache.answer(self.path.strip('/'), request_body,
+                                    lambda: _encode(endpoint(cache, request_body)))
+        except (KeyError, ValueError, TypeError, IndexError, OSError) as err:
+            # a bad request (missing field, bad window, file that doesn't exist, ...)
+            self._reply(400, {'error': type(err).__name__ + ': ' + str(err)})
+            return
+        except Exception as err:
+            self._reply(500, {'error': type(err).__name__ + ': ' + str(err)})
+            return
+        self._send(200, data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write(format % args + '\n')
+
+class _UnixServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # the http handler expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+def make_server(port=DEFAULT_PORT, host='127.0.0.1', unix_socket=None, max_bytes=2 << 30, verbose=False):
+    '''
+    Makes the server without starting it (call serve_forever on it, or use serve).
+
+    Parameters
+    ----------
+    port : int, optional
+        Port to listen on. The default is DEFAULT_PORT (8765).
+    host : string, optional
+        Address to listen on, keep it local, there is no authentication. The default is
+        "127.0.0.1".
+    unix_socket : string, optional
+        Listen on this Unix socket instead of a port. The default is none.
+    max_bytes : int, optional
+        How much memory the cached runs can take up. The default is 2 GB.
+    verbose : Bool, optional
+        Log every request to stderr. The default is False.
+
+    Returns
+    -------
+    server : socketserver server
+        with the RunCache as .cache
+
+    '''
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixServer(unix_socket, _Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    server.cache = RunCache(max_bytes)
+    server.verbose = verbose
+    return server
+
+def serve(port=DEFAULT_PORT, host='127.0.0.1', unix_socket=None, max_bytes=2 << 30, verbose=False):
+    '''
+    Runs the server until it is interrupted, see make_server for the parameters.
+    '''
+    server = make_server(port, host, unix_socket, max_bytes, verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+def request(endpoint, url='http://127.0.0.1:' + str(DEFAULT_PORT), unix_socket=None, timeout=60, **body):
+    '''
+    Asks a running server for something, e.g. from a notebook.
+
+    Parameters
+    ----------
+    endpoint : string
+        "window_heats", "incremental_heat", "mass_gain_average", "mass_gain_onset", "evict" or
+        "status"
+    url : string, optional
+        Where the server is. The default is http://127.0.0.1:8765.
+    unix_socket : string, optional
+        Unix socket of the server, used instead of url. The default is none.
+    timeout : float, optional
+        Seconds to wait for the answer. The default is 60.
+    **body
+        What the endpoint takes (runs, windows, ...), see the top of dta_server.py.
+
+    Returns
+    -------
+    result : dict
+        the json the server sent back (nan comes back as None)
+
+    '''
+    import http.client
+    from urllib.parse import urlsplit
+
+    if unix_socket is not None:
+        connection = http.client.HTTPConnection('localhost', timeout=timeout)
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.sock.settimeout(timeout)
+        connection.sock.connect(unix_socket)
+    else:
+        parts = urlsplit(url)
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        if endpoint == 'status':
+            connection.request('GET', '/status')
+        else:
+            connection.request('POST', '/' + endpoint, json.dumps(_jsonable(body)),
+                               {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError("server answered " + str(response.status) + ": " + result.get('error', ''))
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep DTA runs loaded and answer analysis requests over local http.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: %(default)s)")
+    parser.add_argument('--socket', default=None, help="listen on this unix socket instead of a port")
+    parser.add_argument('--max-mb', type=float, default=2048, help="memory the cached runs can take up")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    where = args.socket or 'http://{}:{}'.format(args.host, args.port)
+    print("serving DTA runs on " + where + " (ctrl+c to stop)")
+    serve(args.port, args.host, args.socket, int(args.max_mb * 1024 * 1024), args.verbose)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+## binary file for long runs (hours of isothermal at a high sampling rate) that is opened as
+## memory maps instead of being loaded, so many multi-million point runs can be compared at once
+##
+##   save_run('AlZr_iso_R1.dtarun', get_dta_txt_data(scan, baseline))   # once, after loading it
+##   run = open_run('AlZr_iso_R1.dtarun')                               # DTARun backed by the file
+##
+## Layout: 8 byte magic, 8 byte length of the json header, the header, then every array one
+## after the other (little endian, each starting on a 64 byte boundary). Besides the signals the
+## file holds the baseline subtracted and normalized heat flows, the cumulative integral of the
+## heat flow and the sorted temperatures of the temperature index, so nothing the size of the
+## run has to be worked out when it is opened. Only the pages that get used are read from disk.
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+
+from dta_run import DTARun, TemperatureIndex, as_dta_run
+from dta_profile import instrumented
+
+__all__ = ['STORE_VERSION', 'STORE_SIGNALS', 'save_run', 'read_run_header', 'open_run']
+
+STORE_VERSION = 1
+_MAGIC = b'DTARUN\x00\x01'
+_ALIGN = 64
+
+# signals written to the file, if the run has them
+STORE_SIGNALS = ['time_sec', 'temp', 'weight', 'heatflow', 'heatflow_bl', 'mass_diff', 'true_mass',
+                 'bls_hf', 'norm_hf', 'norm_hf_bl', 'norm_hf_bls']
+
+def _padding(position):
+    return -position % _ALIGN
+
+def _has_signal(run, name):
+    # the derived heat flows are there if the run keeps them or has what they are computed from
+    if name in ('bls_hf', 'norm_hf', 'norm_hf_bl', 'norm_hf_bls'):
+        if getattr(run, '_' + name) is not None:
+            return True
+        return run.heatflow is not None and run.heatflow_bl is not None and (name == 'bls_hf' or run.weight is not None)
+    return getattr(run, name) is not None
+
+def _cum_bls_hf_chunks(run, chunk_size):
+    # the cumulative integral of DTARun._raw_cum_bls_hf a chunk at a time: (cumulative areas,
+    # cumulative nan counts) of the points of each chunk, the sums carry on from chunk to chunk
+    # in the same order so the values are exactly the ones the run would compute
+    n = len(run.temp)
+    total, nans = 0.0, 0
+    yield np.zeros(1), np.zeros(1, dtype=np.int64)
+    for start in range(0, n - 1, chunk_size):
+        stop = min(start + chunk_size + 1, n)
+        bls_hf = run._raw_chunk('bls_hf', start, stop).astype(np.float64)
+        areas = 0.5 * (bls_hf[1:] + bls_hf[:-1]) * np.diff(run.time_sec[start:stop].astype(np.float64))
+        missing = np.isnan(areas)
+        areas[missing] = 0
+        cum = np.cumsum(np.concatenate(([total], areas)))[1:]
+        cum_nans = nans + np.cumsum(missing)
+        total, nans = cum[-1], int(cum_nans[-1])
+        yield cum, cum_nans
+
+@instrumented('store')
+def save_run(filename, run_data, metadata=None, chunk_size=1 << 20):
+    '''
+    Writes a run to a .dtarun file that open_run maps back without loading it. The signals are
+    written a chunk at a time, only the temperature index needs the temperatures of one
+    segment in memory at once (it is sorted here so it never has to be when the file is used).
+
+    Parameters
+    ----------
+    filename : string
+        name of the file to write, replaced if it exists
+    run_data : DTARun or list
+        Result from get_dta_data (or any of the loaders, or another open_run)
+    metadata : dict, optional
+        Anything json can hold to keep with the run (sample name, atmosphere, ...). The
+        default is none.
+    chunk_size : int, optional
+        Number of points computed and written at a time. The default is 1048576.
+
+    Returns
+    -------
+    filename : string
+        the file that was written
+
+    '''
+    run = as_dta_run(run_data)
+    n = len(run.temp)
+    dtype = run.dtype.newbyteorder('<')
+
+    # what goes in the file, as (name, dtype, length, chunks)
+    def chunks(name):
+        for start in range(0, n, chunk_size):
+            yield run._raw_chunk(name, start, start + chunk_size)
+
+    arrays = [(name, dtype, n, chunks(name)) for name in STORE_SIGNALS if _has_signal(run, name)]
+
+    has_integral = n > 0 and _has_signal(run, 'bls_hf')
+    if has_integral:
+        # (areas, nan counts) chunks, the nan counts are written into their own slot as they come
+        arrays.append(('cum_bls_hf', np.dtype('<f8'), n, _cum_bls_hf_chunks(run, chunk_size)))
+
+    index = run.temp_index
+    sorted_keys = []
+    for k, (start, stop, _) in enumerate(index.segments):
+        kept = (start, stop) in index._keys
+        key, order = index._sorted(start, stop)
+        if not kept:
+            # sorted for the file only, the run doesn't have to keep it
+            del index._keys[(start, stop)]
+        arrays.append(('index%d_temps' % k, np.dtype('<f8'), len(key), [key]))
+        arrays.append(('index%d_order' % k, np.dtype('<i8'), len(order), [order]))
+        sorted_keys.append([start, stop, 'index%d_temps' % k, 'index%d_order' % k])
+    if has_integral:
+        # last, so it can be cut off the end of the file if the heat flow has no holes (the run
+        # only keeps the nan counts then)
+        arrays.append(('cum_bls_hf_nans', np.dtype('<i8'), n, None))
+
+    # where each array starts, counted from the start of the data
+    layout = {}
+    position = 0
+    for name, array_dtype, length, _ in arrays:
+        layout[name] = [position, array_dtype.str, length]
+        position += length * array_dtype.itemsize
+        position += _padding(position)
+
+    header_fields = {'version': STORE_VERSION, 'points': n, 'dtype': dtype.str,
+                     'initial_mass': float(run.initial_mass), 'bls_offset': float(run.bls_offset),
+                     'norm_bls_offset': float(run.norm_bls_offset),
+                     'segments': [list(segment) for segment in index.segments], 'sorted_temps': sorted_keys,
+                     'arrays': layout, 'metadata': metadata or {}}
+    header = json.dumps(header_fields).encode('utf-8')
+    header += b' ' * _padding(len(_MAGIC) + 8 + len(header))
+    data_offset = len(_MAGIC) + 8 + len(header)
+
+    # write to a temporary file first so nobody opens half a run
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<Q', len(header)) + header)
+            nans_start = data_offset + layout['cum_bls_hf_nans'][0] if has_integral else None
+            total_nans = 0
+            for name, array_dtype, length, values in arrays:
+                if values is None:
+                    # the nan counts, written with the integral
+                    continue
+                written = 0
+                for chunk in values:
+                    if name == 'cum_bls_hf':
+                        chunk, cum_nans = chunk
+                        position = f.tell()
+                        f.seek(nans_start + written * 8)
+                        f.write(memoryview(np.ascontiguousarray(cum_nans, dtype='<i8')).cast('B'))
+                        f.seek(position)
+                        total_nans = int(cum_nans[-1])
+                    chunk = np.ascontiguousarray(chunk, dtype=array_dtype)
+                    f.write(memoryview(chunk).cast('B'))
+                    written += len(chunk)
+                if written != length:
+                    raise ValueError("wrote " + str(written) + " points of " + name + " instead of " + str(length))
+                f.write(b'\0' * _padding(length * array_dtype.itemsize))
+
+            if has_integral and total_nans == 0:
+                # no holes, drop the nan counts and write the header again without them (it only
+                # gets shorter, the spaces keep the data where it was)
+                f.truncate(nans_start)
+                del layout['cum_bls_hf_nans']
+                new_header = json.dumps(header_fields).encode('utf-8')
+                f.seek(len(_MAGIC) + 8)
+                f.write(new_header + b' ' * (len(header) - len(new_header)))
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return filename
+
+def read_run_header(filename):
+    '''
+    Reads the header of a .dtarun file (number of points, initial mass, dtype, segments,
+    metadata, where each array is) without touching the data.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .dtarun file
+
+    Returns
+    -------
+    header : dict
+        the header, 'data_offset' is where the arrays start in the file
+
+    '''
+    with open(filename, 'rb') as f:
+        start = f.read(len(_MAGIC) + 8)
+        if len(start) < len(_MAGIC) + 8 or start[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(str(filename) + " is not a .dtarun file")
+        header_length = struct.unpack('<Q', start[len(_MAGIC):])[0]
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    if header['version'] > STORE_VERSION:
+        raise ValueError(str(filename) + " was written by a newer version (" + str(header['version']) + ")")
+    header['data_offset'] = len(_MAGIC) + 8 + header_length
+    return header
+
+@instrumented('store')
+def open_run(filename, mode='r'):
+    '''
+    Opens a run written by save_run. The signals, the heat flow integral and the temperature
+    index are memory maps of the file, so opening is instant and only the parts of the run the
+    analysis looks at are read. The integration, lookup and mass gain functions work on it like
+    on any other run. perform_adjustment only keeps offsets so it doesn't copy the file either.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .dtarun file
+    mode : string, optional
+        Mode of the memory maps: "r" read only, "r+" changes are written to the file (e.g.
+        correct_mass_gain(..., inplace=True)), "c" changes stay in memory. The default is "r".
+
+    Returns
+    -------
+    run : DTARun
+        the run, backed by the file
+
+    '''
+    header = read_run_header(filename)
+
+    def array(name):
+        if name not in header['arrays']:
+            return None
+        offset, dtype, length = header['arrays'][name]
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode=mode, offset=header['data_offset'] + offset, shape=(length,))
+
+    run = DTARun(array('time_sec'), array('temp'), None, None, None, header['initial_mass'], header['dtype'])
+    for name in STORE_SIGNALS[2:]:
+        setattr(run, name if name in DTARun.__slots__ else '_' + name, array(name))
+    run.bls_offset = header['bls_offset']
+    run.norm_bls_offset = header['norm_bls_offset']
+
+    run._cum_bls_hf = array('cum_bls_hf')
+    if run._cum_bls_hf is not None:
+        run._cum_bls_hf_nans = array('cum_bls_hf_nans')
+    sorted_temps = {(start, stop): (array(temps), array(order)) for start, stop, temps, order in header['sorted_temps']}
+    run._temp_index = TemperatureIndex.from_segments(run.temp, header['segments'], sorted_temps)
+
+    return run
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+## live analysis of a run while it is still going, follows the TA text export as it grows
+import io
+import os
+import codecs
+import time
+import asyncio
+import numpy as np
+
+from dta_analysis_funcs import (read_ta_header, read_ta_signals, get_ta_encoding, get_ta_signal_columns,
+                                get_ta_initial_mass, ZRO2_FORM_HEAT, ZRN_FORM_HEAT, ALN_FORM_HEAT)
+
+__all__ = ['TAExportFollower', 'StreamingHeats', 'follow_ta_export', 'afollow_ta_export', 'stream_heats',
+           'astream_heats']
+
+class TAExportFollower:
+    '''
+    Reads the rows that were added to a TA text export since the last time it was read. Only
+    the new part of the file is read and parsed so following a long run costs the same for
+    every update.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt export that the instrument is writing to
+
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = None
+        self.columns = None
+        self._file = None
+        self._decoder = None
+        self._partial = ''
+        self._header_text = ''
+
+    def read_new(self):
+        '''
+        Gets the rows added since the last call.
+
+        Returns
+        -------
+        block : array or None
+            the time (min), temperature, weight and heat flow of the new rows (one column each),
+            None if there is nothing new yet. A row that is still being written is kept until
+            it is complete
+
+        '''
+        if self._file is None:
+            if not os.path.exists(self.filename) or os.path.getsize(self.filename) < 2:
+                return None
+            # read as bytes and decoded as they come, so a character the instrument is half way
+            # through writing (UTF-16 exports grow by an odd number of bytes) waits for the rest
+            self._file = open(self.filename, 'rb')
+            self._decoder = codecs.getincrementaldecoder(get_ta_encoding(self.filename))(errors='replace')
+
+        text = self._decoder.decode(self._file.read(), final=False)
+        if not text:
+            return None
+
+        if self.header is None:
+            text = self._read_header(text)
+            if text is None:
+                return None
+
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        lines = [line.rstrip('\r') for line in lines if line.strip()]
+        if len(lines) == 0:
+            return None
+
+        return np.loadtxt(io.StringIO('\n'.join(lines)), delimiter='\t', usecols=self.columns,
+                          ndmin=2, dtype=np.float64)
+
+    def _read_header(self, text):
+        # waits until the whole header is in the file, gives back the text after it
+        self._header_text += text
+        lines = self._header_text.split('\n')
+        stripped = [line.strip() for line in lines]
+
+        if 'StartOfData' in stripped:
+            data_start = stripped.index('StartOfData') + 1
+        elif any(line and (line[0].isdigit() or line[0] in '-+.') for line in stripped[:-1]):
+            # no header, the export starts with the signal table
+            data_start = 0
+        else:
+            return None
+
+        self.header = read_ta_header(self.filename)
+        self.columns = get_ta_signal_columns(self.header)
+        self._header_text = ''
+        return '\n'.join(lines[data_start:])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class StreamingHeats:
+    '''
+    Keeps the heats of a run up to date as new rows come in, without ever going back over the
+    rows that were already seen. Gives the same numbers as the batch functions on the rows seen
+    so far: the baseline subtracted heat from ltb (get_intermetallic_heat), the mass gain from
+    ltb (mass_gain_over_temp_range) and the oxidation and nitridation heats from that mass gain.
+
+    Parameters
+    ----------
+    initial_mass : float
+        initial mass of sample in milligrams
+    baseline_heatflow : array
+        heat flow of the baseline scan in mW, lined up row by row with the run like in the
+        excel sheet
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius), the heats start at the point closest to it
+        on the first heating ramp
+    utb : int or float, optional
+        utb = upper temperature bound (in Celsius), the heats stop at the point closest to it.
+        The default is None (keep going until the run ends).
+    bls_offset : float, optional
+        value subtracted from the baseline subtracted heat flow, e.g. the adjustment
+        perform_adjustment found for earlier runs (mW). The default is 0.
+
+    '''
+
+    def __init__(self, initial_mass, baseline_heatflow, ltb, utb=None, bls_offset=0.0):
+        self.initial_mass = initial_mass
+        self.baseline_heatflow = np.asarray(baseline_heatflow, dtype=np.float64)
+        self.ltb = ltb
+        self.utb = utb
+        self.bls_offset = bls_offset
+
+        self.points = 0
+        self.started = False
+        self.stopped = False
+        self.area = 0.0             # mJ since ltb
+        self.start_mass = np.nan    # true mass at ltb
+        self.mass = np.nan          # latest true mass (or the one at utb)
+        self._weight0 = None
+        self._last = None           # (time_sec, temp, bls_hf, true_mass) of the last point
+        self._last_area = 0.0       # area of the trapezoid that ends at the last point
+
+    def update(self, block):
+        '''
+        Adds new rows to the running totals.
+
+        Parameters
+        ----------
+        block : array
+            new rows with the columns time (min), temperature, weight and heat flow, as given
+            by TAExportFollower.read_new
+
+        Returns
+        -------
+        snapshot : dict
+            the current totals, see snapshot
+
+        '''
+        block = np.asarray(block, dtype=np.float64).reshape(-1, 4)
+        rows = len(block)
+        if rows == 0:
+            return self.snapshot()
+
+        # baseline lined up with the new rows, nan past the end of the baseline
+        baseline = np.full(rows, np.nan)
+        available = self.baseline_heatflow[self.points:self.points + rows]
+        baseline[:len(available)] = available
+
+        if self._weight0 is None:
+            self._weight0 = block[0, 2]
+        time_sec = block[:, 0] * 60
+        temp = block[:, 1]
+        true_mass = block[:, 2] - self._weight0 + self.initial_mass
+        bls_hf = block[:, 3] - baseline - self.bls_offset
+
+        # carry the last point over so the trapezoid between the blocks isn't lost
+        if self._last is not None:
+            time_sec, temp, bls_hf, true_mass = (np.concatenate(([last], new)) for last, new
+                                                 in zip(self._last, (time_sec, temp, bls_hf, true_mass)))
+        self._last = (time_sec[-1], temp[-1], bls_hf[-1], true_mass[-1])
+        self.points += rows
+
+        if self.stopped:
+            return self.snapshot()
+
+        start = 0
+        if not self.started:
+            start = self._closest_crossing(temp, self.ltb)
+            if start is None:
+                return self.snapshot()
+            self.started = True
+            self.start_mass = true_mass[start]
+
+        # get_intermetallic_heat doesn't include the point closest to utb, the mass gain does
+        end = len(temp)
+        if self.utb is not None:
+            stop = self._closest_crossing(temp[start:], self.utb)
+            if stop is not None:
+                end = start + stop + 1
+                self.stopped = True
+        last = end - 1 if self.stopped else end
+
+        if last - start > 1:
+            areas = 0.5 * (bls_hf[start + 1:last] + bls_hf[start:last - 1]) * np.diff(time_sec[start:last])
+            self.area += np.sum(areas)
+            self._last_area = areas[-1]
+        elif last == 0:
+            # the point closest to utb was the last one of the previous block, so the trapezoid
+            # that ends there shouldn't have been added
+            self.area -= self._last_area
+        self.mass = true_mass[end - 1]
+
+        return self.snapshot()
+
+    @staticmethod
+    def _closest_crossing(temp, bound):
+        # index of the point closest to bound where the heating ramp first reaches it, None
+        # if it hasn't been reached yet
+        above = np.flatnonzero(temp >= bound)
+        if len(above) == 0:
+            return None
+        j = above[0]
+        if j > 0 and abs(temp[j - 1] - bound) <= abs(temp[j] - bound):
+            return j - 1
+        return j
+
+    def snapshot(self):
+        '''
+        The current totals.
+
+        Returns
+        -------
+        snapshot : dict
+            'points' rows seen, 'time_sec' and 'temp' of the last row, 'started'/'stopped' if
+            ltb/utb were reached, 'heat_J_g' baseline subtracted heat since ltb, 'mass_gain_mg'
+            mass gain since ltb and 'ox_heat_J_g'/'nit_heat_J_g' the heats of oxidation and
+            nitridation from that mass gain
+
+        '''
+        mass_gain = self.mass - self.start_mass if self.started else 0.0
+        mass_g = self.initial_mass / 1000
+        return {'points': self.points,
+                'time_sec': float(self._last[0]) if self._last else np.nan,
+                'temp': float(self._last[1]) if self._last else np.nan,
+                'started': self.started,
+                'stopped': self.stopped,
+                'heat_J_g': float(self.area / mass_g / 1000),
+                'mass_gain_mg': float(mass_gain),
+                'ox_heat_J_g': float(ZRO2_FORM_HEAT * mass_gain / mass_g),
+                'nit_heat_J_g': float((ZRN_FORM_HEAT + ALN_FORM_HEAT) / 2 * mass_gain / mass_g)}
+
+def follow_ta_export(filename, poll_interval=1.0, idle_timeout=None):
+    '''
+    Generator that gives the new rows of a TA text export as the instrument writes them.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt export
+    poll_interval : float, optional
+        seconds to wait before looking at the file again when there is nothing new. The
+        default is 1.
+    idle_timeout : float, optional
+        stop after this many seconds without new rows (the run is over). The default is None
+        (follow forever).
+
+    Yields
+    ------
+    follower, block : TAExportFollower, array
+        the follower (its .header has the header of the export) and the new rows (see
+        TAExportFollower.read_new)
+
+    '''
+    follower = TAExportFollower(filename)
+    last_update = time.monotonic()
+    try:
+        while True:
+            block = follower.read_new()
+            if block is not None:
+                last_update = time.monotonic()
+                yield follower, block
+            elif idle_timeout is not None and time.monotonic() - last_update > idle_timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+    finally:
+        follower.close()
+
+async def afollow_ta_export(filename, poll_interval=1.0, idle_timeout=None):
+    '''
+    Same as follow_ta_export as an async generator, so it can run next to other tasks (e.g. a
+    plot or a dashboard) in an event loop.
+    '''
+    follower = TAExportFollower(filename)
+    last_update = time.monotonic()
+    try:
+        while True:
+            block = follower.read_new()
+            if block is not None:
+                last_update = time.monotonic()
+                yield follower, block
+            elif idle_timeout is not None and time.monotonic() - last_update > idle_timeout:
+                return
+            else:
+                await asyncio.sleep(poll_interval)
+    finally:
+        follower.close()
+
+def _make_heats(follower, baseline_filename, ltb, utb, initial_mass, bls_offset):
+    if initial_mass is None:
+        initial_mass = get_ta_initial_mass(follower.header)
+        if initial_mass is None:
+            raise ValueError("could not find the initial mass (in mg) in the comment or size of " + str(follower.filename)
+                             + ", pass initial_mass")
+    baseline = read_ta_signals(baseline_filename)['Heatflow (mW)'].to_numpy()
+    return StreamingHeats(initial_mass, baseline, ltb, utb, bls_offset)
+
+def stream_heats(filename, baseline_filename, ltb, utb=None, initial_mass=None, bls_offset=0.0,
+                 poll_interval=1.0, idle_timeout=None):
+    '''
+    Follows the export of a run that is still going and gives the updated heats every time
+    new rows are written.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .txt export of the run
+    baseline_filename : string
+        name of the .txt export of the baseline scan (already finished)
+    ltb : int or float
+        ltb = lower temperature bound (in Celsius)
+    utb : int or float, optional
+        utb = upper temperature bound (in Celsius). The default is None.
+    initial_mass : float, optional
+        initial mass of sample in milligrams, read from the comment of the export if not given
+    bls_offset : float, optional
+        adjustment subtracted from the baseline subtracted heat flow (mW). The default is 0.
+    poll_interval : float, optional
+        seconds between looks at the file. The default is 1.
+    idle_timeout : float, optional
+        stop after this many seconds without new rows. The default is None.
+
+    Yields
+    ------
+    snapshot : dict
+        the totals after each update, see StreamingHeats.snapshot
+
+    '''
+    heats = None
+    for follower, block in follow_ta_export(filename, poll_interval, idle_timeout):
+        if heats is None:
+            heats = _make_heats(follower, baseline_filename, ltb, utb, initial_mass, bls_offset)
+        yield heats.update(block)
+
+async def astream_heats(filename, baseline_filename, ltb, utb=None, initial_mass=None, bls_offset=0.0,
+                        poll_interval=1.0, idle_timeout=None):
+    '''
+    Same as stream_heats as an async generator.
+    '''
+    heats = None
+    async for follower, block in afollow_ta_export(filename, poll_interval, idle_timeout):
+        if heats is None:
+            heats = _make_heats(follower, baseline_filename, ltb, utb, initial_mass, bls_offset)
+        yield heats.update(block)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+## makes fake but realistic DTA runs (any size, any number of replicates) for testing and benchmarking
+import numpy as np
+
+from dta_run import DTARun
+
+__all__ = ['DEFAULT_PEAKS', 'make_synthetic_run', 'make_synthetic_runs', 'write_synthetic_workbook']
+
+# exotherm peaks of the default run as (center in C, width in C, height in mW)
+DEFAULT_PEAKS = [(560.0, 12.0, 6.0), (660.0, 25.0, 2.5)]
+
+def make_synthetic_run(points=10000, initial_mass=12.0, start_temp=50.0, max_temp=1000.0, rate=20.0,
+                       cooling_fraction=0.0, peaks=None, mass_gain=0.4, mass_gain_onset=750.0,
+                       mass_gain_width=40.0, seed=0, dtype=np.float64):
+    '''
+    Makes a run that looks like a real one: a temperature ramp, a drifting baseline heat flow,
+    exotherm peaks on top of it in the scan and a mass that dips a little at the start and then
+    rises along a sigmoid. Every signal gets some noise. The same arguments always give the
+    same run.
+
+    Parameters
+    ----------
+    points : int, optional
+        Number of points of the run. The default is 10000.
+    initial_mass : float, optional
+        initial mass of sample in milligrams. The default is 12.
+    start_temp : float, optional
+        Temperature the ramp starts at (C). The default is 50.
+    max_temp : float, optional
+        Temperature the ramp goes up to (C). The default is 1000.
+    rate : float, optional
+        Heating (and cooling) rate in C/min. The default is 20.
+    cooling_fraction : float, optional
+        Fraction of the points spent cooling back down after the heating ramp. The default is 0.
+    peaks : list, optional
+        Exotherm peaks as (center in C, width in C, height in mW). The default is DEFAULT_PEAKS.
+    mass_gain : float, optional
+        Total mass gained in milligrams. The default is 0.4.
+    mass_gain_onset : float, optional
+        Temperature in the middle of the mass gain (C). The default is 750.
+    mass_gain_width : float, optional
+        How spread out the mass gain is (C). The default is 40.
+    seed : int, optional
+        Seed of the noise. The default is 0.
+    dtype : numpy dtype, optional
+        dtype the signals are stored as. The default is np.float64.
+
+    Returns
+    -------
+    DTARun
+        the run, like get_dta_data gives back
+
+    '''
+    rng = np.random.default_rng(seed)
+    peaks = DEFAULT_PEAKS if peaks is None else peaks
+
+    # heating ramp then (maybe) cooling, the sampling is set by how many points there are
+    heating_points = max(2, int(round(points * (1 - cooling_fraction))))
+    cooling_points = points - heating_points
+    heating_min = (max_temp - start_temp) / rate
+    dt_min = heating_min / (heating_points - 1)
+    time_min = np.arange(points) * dt_min
+    temp = np.minimum(start_temp + rate * time_min, max_temp)
+    if cooling_points > 0:
+        temp[heating_points:] = max_temp - rate * (time_min[heating_points:] - time_min[heating_points - 1])
+    temp += rng.normal(0, 0.02, points)
+
+    # instrument drift, the same in the scan and the baseline apart from a small offset
+    scaled = (temp - start_temp) / (max_temp - start_temp)
+    drift = -0.8 + 1.5 * scaled - 0.6 * scaled ** 2
+    heatflow_bl = drift + rng.normal(0, 0.01, points)
+    heatflow = drift + 0.05 + rng.normal(0, 0.01, points)
+    for center, width, height in peaks:
+        heatflow += height * np.exp(-0.5 * ((temp - center) / width) ** 2)
+
+    # water coming off at the start then the sigmoid of the oxidation / nitridation
+    weight = (initial_mass + 0.5
+              - 0.01 * (1 - np.exp(-(temp - start_temp) / 50))
+              + mass_gain / (1 + np.exp(-(temp - mass_gain_onset) / mass_gain_width))
+              + rng.normal(0, 2e-5, points))
+
+    return DTARun(time_min * 60, temp, weight, heatflow, heatflow_bl, initial_mass, dtype)
+
+def make_synthetic_runs(num_runs=3, points=10000, seed=0, vary_length=False, **kwargs):
+    '''
+    Makes replicates of a synthetic run: the initial mass, the peaks and the mass gain change
+    a little from run to run like they do between real replicates.
+
+    Parameters
+    ----------
+    num_runs : int, optional
+        Number of runs. The default is 3.
+    points : int, optional
+        Number of points of each run. The default is 10000.
+    seed : int, optional
+        Seed for the whole set of runs. The default is 0.
+    vary_length : Bool, optional
+        Give each run up to 5% fewer points than points. The default is False.
+    **kwargs
+        Passed on to make_synthetic_run.
+
+    Returns
+    -------
+    runs : list
+        the runs (DTARun)
+    initial_masses : list
+        initial mass of each run in milligrams
+
+    '''
+    rng = np.random.default_rng(seed)
+    base_peaks = kwargs.pop('peaks', DEFAULT_PEAKS)
+    base_mass = kwargs.pop('initial_mass', 12.0)
+    base_gain = kwargs.pop('mass_gain', 0.4)
+    base_onset = kwargs.pop('mass_gain_onset', 750.0)
+
+    runs = []
+    initial_masses = []
+    for i in range(num_runs):
+        run_points = points - int(rng.integers(0, points // 20 + 1)) if vary_length else points
+        initial_mass = base_mass * rng.uniform(0.9, 1.1)
+        peaks = [(center + rng.normal(0, 3), width * rng.uniform(0.9, 1.1), height * rng.uniform(0.95, 1.05))
+                 for center, width, height in base_peaks]
+        runs.append(make_synthetic_run(run_points, initial_mass, peaks=peaks,
+                                       mass_gain=base_gain * rng.uniform(0.9, 1.1),
+                                       mass_gain_onset=base_onset + rng.normal(0, 5),
+                                       seed=int(rng.integers(2**31)), **kwargs))
+        initial_masses.append(initial_mass)
+
+    return runs, initial_masses
+
+def write_synthetic_workbook(filename, runs, sheetnames=None):
+    '''
+    Writes runs to an excel workbook laid out like Example-DTA-spreadhseet.xlsx (the scan in
+    columns A-G and the baseline in H-N) so get_dta_data can read them back. Excel can't hold
+    more than 1048574 points per sheet.
+
+    Parameters
+    ----------
+    filename : string
+        name of the .xlsx file to write
+    runs : list
+        runs (DTARun) to write, one per sheet
+    sheetnames : list, optional
+        name of each sheet. The default is Run1, Run2, ...
+
+    Returns
+    -------
+    sheetnames : list
+        the names of the sheets
+
+    '''
+    import openpyxl
+
+    sheetnames = sheetnames or ['Run' + str(i + 1) for i in range(len(runs))]
+    header = ['Time (min)', 'Temperature', 'Weight (mg)', 'Heatflow (mW)', 'Temperature Diff',
+              'Temperature Diff', 'Sample Purge Flow']
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for run, sheetname in zip(runs, sheetnames):
+        if len(run.temp) > 1048574:
+            raise ValueError("excel sheets can't hold " + str(len(run.temp)) + " points")
+        sheet = workbook.create_sheet(sheetname)
+        sheet.append(['Run 1'] + [None] * 6 + ['Run 2'] + [None] * 6)
+        sheet.append(header + header)
+
+        # the columns we don't use are filled with zeros, the baseline run uses the same
+        # time, temperature and weight as the scan
+        time_min = (run.time_sec / 60).tolist()
+        temp = run.temp.tolist()
+        weight = run.weight.tolist()
+        for row in zip(time_min, temp, weight, run.heatflow.tolist(), time_min, temp, weight,
+                       run.heatflow_bl.tolist()):
+            sheet.append([row[0], row[1], row[2], row[3], 0.0, 0.0, 0.0,
+                          row[4], row[5], row[6], row[7], 0.0, 0.0, 0.0])
+    workbook.save(filename)
+
+    return sheetnames
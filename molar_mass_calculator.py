@@ -7,6 +7,9 @@ Created on Tue Aug  2 15:00:50 2022
 
 ## Gets molecular weight given a chemical formula string
 import re
+from functools import lru_cache
+
+__all__ = ['pt_dict', 'parse_formula', 'get_molar_mass']
 
 pt_dict = {'H': 1.007, 'He': 4.002, 'Li': 6.941, 'Be': 9.012, 
               'B': 10.811, 'C': 12.011, 'N': 14.007, 'O': 15.999, 
@@ -32,9 +35,72 @@ pt_dict = {'H': 1.007, 'He': 4.002, 'Li': 6.941, 'Be': 9.012,
               'Ac': 227.0, 'Th': 232.038, 'Pa': 231.036, 'U': 238.029, 'Np': 237.0, 'Pu': 244.0, 
               'Am': 243.0, 'Cm': 247.0, 'Bk': 247.0, 'Cf': 251.0, 'Es': 252.0, 'Fm': 257.0, 
               'Md': 258.0, 'No': 259.0, 'Lr': 262.0, 'Rf': 261.0, 'Db': 262.0, 'Sg': 266.0, 
-              'Bh': 264.0, 'Hs': 267.0, 'Mt': 268.0, 'Ds ': 271.0, 'Rg ': 272.0, 'Cn ': 285.0, 
+              'Bh': 264.0, 'Hs': 267.0, 'Mt': 268.0, 'Ds': 271.0, 'Rg': 272.0, 'Cn': 285.0, 
               'Nh': 284.0, 'Fl': 289.0, 'Mc': 288.0, 'Lv': 292.0, 'Ts': 295.0, 'Og': 294.0}
 
+# an element, a count (integer or decimal) or a bracket
+_FORMULA_RE = re.compile(r'\s*(?:([A-Z][a-z]?)|(\d+\.?\d*|\.\d+)|([(\[])|([)\]]))')
+
+@lru_cache(maxsize=1024)
+def _parse_formula(formula):
+    # stack of the counts inside each open bracket, last is what a count right after it multiplies
+    stack = [{}]
+    last = None
+    pos = 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = _FORMULA_RE.match(formula, pos)
+        if match is None:
+            raise ValueError("can't read the formula '" + formula + "' at '" + formula[pos:] + "'")
+        element, count, opening, closing = match.groups()
+        pos = match.end()
+
+        if element is not None:
+            if element not in pt_dict:
+                raise ValueError("unknown element '" + element + "' in '" + formula + "'")
+            last = {element: 1.0}
+            stack[-1][element] = stack[-1].get(element, 0.0) + 1.0
+        elif count is not None:
+            if last is None:
+                raise ValueError("count without an element or bracket before it in '" + formula + "'")
+            # the element or bracket was already added once
+            for name, number in last.items():
+                stack[-1][name] += number * (float(count) - 1)
+            last = None
+        elif opening is not None:
+            stack.append({})
+            last = None
+        else:
+            if len(stack) == 1:
+                raise ValueError("unmatched closing bracket in '" + formula + "'")
+            last = stack.pop()
+            for name, number in last.items():
+                stack[-1][name] = stack[-1].get(name, 0.0) + number
+
+    if len(stack) > 1:
+        raise ValueError("unmatched opening bracket in '" + formula + "'")
+    if len(stack[0]) == 0:
+        raise ValueError("no elements in the formula '" + formula + "'")
+    return tuple(stack[0].items())
+
+def parse_formula(molecular_string):
+    """
+    Gets how many of each element are in a chemical formula.
+
+    Parameters
+    ----------
+    molecular_string : string
+        Chemical formula, see get_molar_mass for what it can look like
+
+    Returns
+    -------
+    counts : dict
+        number of each element (floats) in order of first appearance
+
+    """
+    return dict(_parse_formula(molecular_string))
+
+@lru_cache(maxsize=1024)
 def get_molar_mass(molecular_string):
     """
     Parameters
@@ -43,10 +109,15 @@ def get_molar_mass(molecular_string):
         Chemical / molecular formula of the element or compound you are trying 
         to get the molar mass of. It has to be in the format:
             XMYNZP
-            where X, Y, Z are chemical symbols and M, N, P are integers
+            where X, Y, Z are chemical symbols and M, N, P are counts. A count of 1 can
+            be left out, counts can have decimals and parts of the formula can be put in
+            brackets with a count after them
         
         examples: C12H22O12
                     Al1Zr1
+                    AlZr
+                    Al0.5Zr0.5
+                    Ca(OH)2
 
     Returns
     -------
@@ -54,9 +125,7 @@ def get_molar_mass(molecular_string):
         The calculated molar mass of the compound in g/mol
 
     """
-    formula = molecular_string
-    s = re.findall('([A-Z][a-z]?)([0-9]*)', formula)
-    molar_mass = sum([pt_dict[s[x][0]] * int(s[x][1]) for x in range(len(s))])
+    molar_mass = sum(pt_dict[element] * count for element, count in _parse_formula(molecular_string))
     
     return molar_mass
 